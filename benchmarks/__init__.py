@@ -0,0 +1,2 @@
+# Offline harnesses and benchmarks. Run them from the repository root, e.g.:
+#   python -m benchmarks.webhook_harness
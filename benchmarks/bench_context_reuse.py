@@ -0,0 +1,139 @@
+# benchmarks/bench_context_reuse.py
+"""Time to first token with and without reusing Ollama's context, as the history grows.
+
+A stub Ollama server answers /api/generate with a prefill delay proportional to the
+tokens it has to process: the whole prompt without a context, only the new prompt
+with one. The bot's own prompt building (build_context, SessionStore) is used.
+
+    python -m benchmarks.bench_context_reuse --turns 60 --prefill-ms 0.5
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+STUB_PORT = 11499
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+async def serve_stub(port, prefill_ms, reply_tokens):
+    """Minimal /api/generate: NDJSON stream whose first line waits for the simulated prefill."""
+
+    async def handle(reader, writer):
+        await reader.readline()     # Request line: only /api/generate is served
+        length = 0
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            name, _, value = line.decode().partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        body = json.loads(await reader.readexactly(length)) if length else {}
+        context = body.get("context") or []
+        prompt_tokens = estimate_tokens(body.get("prompt", ""))
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+        # Only the tokens that are not in the context have to be processed
+        await asyncio.sleep(prompt_tokens * prefill_ms / 1000)
+        for index in range(reply_tokens):
+            writer.write(json.dumps({"model": body.get("model"), "response": f"w{index} ", "done": False}).encode() + b"\n")
+            await writer.drain()
+        new_context = context + list(range(prompt_tokens + reply_tokens))
+        writer.write(json.dumps({
+            "model": body.get("model"), "response": "", "done": True, "context": new_context,
+            "prompt_eval_count": prompt_tokens, "eval_count": reply_tokens,
+        }).encode() + b"\n")
+        await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", port)
+
+
+async def run(args):
+    import data_manager
+    from texts import default_template, followup_template
+    from context_builder import build_context
+    from ollama_session import SessionStore, Generation
+    from benchmarks.stub_llm import StubLLM
+
+    data_manager.load_data()
+    # Summaries are off (SUMMARY_BATCH_TURNS below); should one be scheduled anyway, it gets
+    # an instant stub instead of a None model, and stays off the measured server
+    summary_llm = StubLLM(first_token_latency=0, tokens_per_second=0)
+    server = await serve_stub(args.port, args.prefill_ms, args.reply_tokens)
+    # Unmeasured first call: client creation and connection setup
+    await Generation("warm up").text()
+    results = {"reuse": [], "full": []}
+    for mode in results:
+        user_id = f"bench-{mode}"
+        store = SessionStore(max_tokens=args.max_context_tokens, enabled=mode == "reuse")
+        for turn in range(args.turns):
+            question = f"Question number {turn}: " + "tell me more about Italian grammar and verbs " * 3
+            context = store.reusable_context(user_id)
+            if context is not None:
+                prompt = followup_template.format(question=question)
+            else:
+                prompt = default_template.format(context=build_context(user_id, summary_llm), question=question)
+            generation = Generation(prompt, context)
+            started = time.perf_counter()
+            first = None
+            pieces = []
+            async for piece in generation.stream():
+                if first is None:
+                    first = time.perf_counter() - started
+                pieces.append(piece)
+            data_manager.add_conversation_turn(user_id, question, "".join(pieces) + " " + "explanation " * 40)
+            store.save(user_id, generation.context)
+            results[mode].append({"turn": turn + 1, "ttft_ms": round(first * 1000, 2), "prompt_tokens": generation.prompt_tokens})
+    server.close()
+    await server.wait_closed()
+
+    checkpoints = sorted({1, args.turns // 4, args.turns // 2, args.turns} - {0})
+    return {
+        "turns": args.turns,
+        "prefill_ms_per_token": args.prefill_ms,
+        "by_turn": [
+            {
+                "turn": turn,
+                "ttft_ms_full": results["full"][turn - 1]["ttft_ms"],
+                "ttft_ms_reuse": results["reuse"][turn - 1]["ttft_ms"],
+                "prompt_tokens_full": results["full"][turn - 1]["prompt_tokens"],
+                "prompt_tokens_reuse": results["reuse"][turn - 1]["prompt_tokens"],
+            }
+            for turn in checkpoints
+        ],
+        "mean_ttft_ms_full": round(sum(r["ttft_ms"] for r in results["full"]) / args.turns, 2),
+        "mean_ttft_ms_reuse": round(sum(r["ttft_ms"] for r in results["reuse"]) / args.turns, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--prefill-ms", type=float, default=0.5, help="stub prefill time per prompt token")
+    parser.add_argument("--reply-tokens", type=int, default=5)
+    parser.add_argument("--max-context-tokens", type=int, default=10 ** 9, help="rebuild past this context size")
+    parser.add_argument("--port", type=int, default=STUB_PORT)
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="bot_context_reuse_")
+    # Must be set before config is imported: the full prompt keeps the whole history
+    os.environ.update({
+        "OLLAMA_HOST": f"http://127.0.0.1:{args.port}",
+        "DATA_FILE": os.path.join(data_dir, "bot_data.json"),
+        "STORAGE_BACKEND": "json",
+        "CONTEXT_TOKEN_BUDGET": str(10 ** 9),
+        "SUMMARY_BATCH_TURNS": str(10 ** 9),
+    })
+    os.environ.pop("JOURNAL_FILE", None)
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# benchmarks/bench_grading.py
+"""Micro-benchmark of flashcard answer grading over a large synthetic deck.
+
+Grades exact answers, typos and wrong answers against cards with one to three
+meanings, with the answer variants cached (the study-session path) and uncached.
+
+    python -m benchmarks.bench_grading --cards 50000 --answers 200000
+"""
+import json
+import time
+import random
+import string
+import argparse
+from collections import Counter
+import grading
+
+
+def random_word(rng, length):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def make_deck(rng, cards):
+    """Translations like "the house", "run, sprint" or "big / large"."""
+    deck = []
+    for _ in range(cards):
+        meanings = [random_word(rng, rng.randint(3, 12)) for _ in range(rng.randint(1, 3))]
+        english = rng.choice([", ", " / "]).join(meanings)
+        if rng.random() < 0.3:
+            english = "the " + english
+        deck.append(english)
+    return deck
+
+
+def make_answer(rng, english):
+    """An exact answer, a one-typo answer or an unrelated answer."""
+    meaning = rng.choice(grading.answer_variants(english))
+    roll = rng.random()
+    if roll < 0.4:
+        return meaning.upper() if rng.random() < 0.2 else meaning
+    if roll < 0.8 and len(meaning) > 3:
+        position = rng.randrange(len(meaning) - 1)
+        if rng.random() < 0.5:
+            # Swapped neighbours
+            return meaning[:position] + meaning[position + 1] + meaning[position] + meaning[position + 2:]
+        return meaning[:position] + rng.choice(string.ascii_lowercase) + meaning[position + 1:]
+    return random_word(rng, rng.randint(3, 12))
+
+
+def timed_grading(pairs):
+    results = Counter()
+    started = time.perf_counter()
+    for answer, english in pairs:
+        results[grading.grade(answer, english)] += 1
+    return time.perf_counter() - started, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=50000)
+    parser.add_argument("--answers", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    deck = make_deck(rng, args.cards)
+    pairs = []
+    for _ in range(args.answers):
+        english = rng.choice(deck)
+        pairs.append((make_answer(rng, english), english))
+
+    grading.answer_variants.cache_clear()
+    grading.normalize.cache_clear()
+    cold_seconds, _ = timed_grading(pairs)
+    warm_seconds, results = timed_grading(pairs)
+    print(json.dumps({
+        "cards": args.cards,
+        "answers": args.answers,
+        "cold_us_per_answer": round(cold_seconds / args.answers * 1e6, 2),
+        "warm_us_per_answer": round(warm_seconds / args.answers * 1e6, 2),
+        "results": dict(results),
+        "variant_cache": grading.answer_variants.cache_info()._asdict(),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# benchmarks/bench_snapshot.py
+"""Size, startup time and peak RSS of bot_data.json versus the binary snapshot, on synthetic users.
+
+The json backend loads every user at startup, the snapshot backend only its index; the
+snapshot figures also include loading ACCESSED users on demand and writing a new
+snapshot after CHANGED of them changed. Each load runs in a fresh interpreter so its
+peak RSS is not mixed with the generator's.
+
+    python -m benchmarks.bench_snapshot --users 100000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+
+WORDS = ("ciao", "casa", "cane", "gatto", "libro", "acqua", "pane", "sole", "luna", "mare", "treno", "scuola",
+         "verbo", "essere", "avere", "andare", "parlare", "mangiare", "grammatica", "domanda", "risposta")
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def synthetic_sections(users, turns, seed=1):
+    """Sections shaped like bot_data.json: history, notes, settings, cards, answer log, stats, schedules."""
+    from storage import SECTIONS
+    rng = random.Random(seed)
+    sections = {name: {} for name in SECTIONS}
+    now = time.time()
+    for number in range(users):
+        user_id = str(100000000 + number)
+        sections["conversation_context"][user_id] = [
+            {"user": sentence(rng, 8), "ai": sentence(rng, 30), "ts": now - rng.uniform(0, 90 * 86400)}
+            for _ in range(turns)
+        ]
+        sections["user_notes"][user_id] = [sentence(rng, 6) for _ in range(2)]
+        sections["user_settings"][user_id] = {"mode": "normal", "level": "beginner", "topic": "general"}
+        cards = {rng.choice(WORDS) + str(index): sentence(rng, 1) for index in range(5)}
+        sections["flashcards"][user_id] = cards
+        sections["conversation_summaries"][user_id] = {"text": sentence(rng, 40), "covered": turns // 2}
+        sections["flashcard_log"][user_id] = [
+            {"flashcard": {italian: english}, "user_response": english, "correct": rng.random() < 0.7,
+             "timestamp": now - rng.uniform(0, 90 * 86400)}
+            for italian, english in cards.items()
+        ]
+        sections["flashcard_stats"][user_id] = {
+            italian: {"attempts": 1, "correct": 1, "last_seen": now} for italian in cards
+        }
+        sections["flashcard_schedules"][user_id] = {
+            italian: {"due": now + rng.uniform(0, 7 * 86400), "interval": 1, "ease": 2.5, "reps": 1} for italian in cards
+        }
+    return sections
+
+
+def peak_rss_kib():
+    """Peak resident set size of this process in KiB."""
+    # ru_maxrss survives exec on Linux (a child would report its parent's peak); VmHWM does not
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure_load(kind, path, user_ids):
+    """Run in a child process: start the backend as the bot would and report time and peak RSS."""
+    from storage import JsonStorage
+    from snapshot import SnapshotStorage
+    storage = JsonStorage(path) if kind == "json" else SnapshotStorage(path)
+    baseline = peak_rss_kib()
+    started = time.perf_counter()
+    storage.load_all()
+    result = {"load_seconds": round(time.perf_counter() - started, 3)}
+    if kind == "snapshot":
+        started = time.perf_counter()
+        for user_id in user_ids:
+            storage.load_user(user_id)
+        result["load_user_us"] = round((time.perf_counter() - started) / len(user_ids) * 1e6, 1)
+    peak = peak_rss_kib()
+    result.update(peak_rss_mb=round(peak / 1024, 1), load_rss_mb=round((peak - baseline) / 1024, 1))
+    print(json.dumps(result))
+
+
+def measure_rewrite(path, sections, user_ids):
+    """Seconds to write a new snapshot after the given users changed (copying the others by offset)."""
+    from snapshot import SnapshotStorage
+    storage = SnapshotStorage(path)
+    storage.load_all()
+    changed = {name: {user_id: section[user_id] for user_id in user_ids if user_id in section}
+               for name, section in sections.items()}
+    for user_id in user_ids:
+        changed["user_notes"].setdefault(user_id, []).append("changed")
+    started = time.perf_counter()
+    storage.commit(storage.prepare(changed, user_ids))
+    elapsed = time.perf_counter() - started
+    storage.close()
+    return elapsed
+
+
+def random_access(path, user_ids, samples, seed=2):
+    """Time to open the snapshot and read its index, and mean time to read one user's record."""
+    from snapshot import SnapshotReader
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    with SnapshotReader(path) as reader:
+        reader.index()
+        index_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        for user_id in rng.sample(user_ids, samples):
+            reader.read_user(user_id)
+        per_read = (time.perf_counter() - started) / samples
+    return {"open_and_index_ms": round(index_seconds * 1000, 2), "read_user_us": round(per_read * 1e6, 1)}
+
+
+def run_child(kind, path, user_ids=()):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_snapshot", "--load", kind, path, ",".join(user_ids)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--turns", type=int, default=4, help="history turns per user")
+    parser.add_argument("--accessed", type=int, default=1000, help="users loaded on demand from the snapshot")
+    parser.add_argument("--changed", type=int, default=1000, help="users changed before the snapshot is rewritten")
+    parser.add_argument("--dir", default=None, help="directory for the files (default: a temp dir)")
+    parser.add_argument("--load", nargs=3, metavar=("KIND", "PATH", "USERS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.load:
+        kind, path, users = args.load
+        measure_load(kind, path, users.split(",") if users else [])
+        return
+
+    from storage import write_atomic
+    from snapshot import encode_record, user_record, snapshot_chunks
+
+    directory = args.dir or tempfile.mkdtemp(prefix="bot_snapshot_bench_")
+    json_path = os.path.join(directory, "bot_data.json")
+    snapshot_path = os.path.join(directory, "bot_data.snap")
+    sections = synthetic_sections(args.users, args.turns)
+    user_ids = list(sections["user_settings"])
+
+    started = time.perf_counter()
+    write_atomic(json_path, json.dumps(dict(sections)))
+    json_write = time.perf_counter() - started
+    started = time.perf_counter()
+    records = ((user_id, encode_record(user_id, user_record(sections, user_id))) for user_id in user_ids)
+    write_atomic(snapshot_path, snapshot_chunks(records))
+    snapshot_write = time.perf_counter() - started
+    rng = random.Random(3)
+    rewrite = measure_rewrite(snapshot_path, sections, rng.sample(user_ids, min(args.changed, len(user_ids))))
+    del sections
+
+    result = {
+        "users": args.users,
+        "json": {
+            "bytes": os.path.getsize(json_path),
+            "write_seconds": round(json_write, 3),
+            **run_child("json", json_path),
+        },
+        "snapshot": {
+            "bytes": os.path.getsize(snapshot_path),
+            "write_seconds": round(snapshot_write, 3),
+            "rewrite_seconds": round(rewrite, 3),
+            **run_child("snapshot", snapshot_path, rng.sample(user_ids, min(args.accessed, len(user_ids)))),
+            **random_access(snapshot_path, user_ids, min(1000, len(user_ids))),
+        },
+    }
+    result["size_ratio"] = round(result["snapshot"]["bytes"] / result["json"]["bytes"], 3)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
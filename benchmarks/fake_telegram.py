@@ -0,0 +1,77 @@
+# benchmarks/fake_telegram.py
+import json
+import time
+from telegram.request import BaseRequest
+
+BOT_ID = 123456789
+
+
+class FakeRequest(BaseRequest):
+    """Answers Bot API calls locally, so an Application can run without a token or network.
+
+    Every call is recorded in `calls` as (timestamp, API method, parameters).
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return 5.0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, parameters):
+        self._message_id += 1
+        chat_id = parameters.get("chat_id", 0)
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "FakeBot"},
+            "text": parameters.get("text", ""),
+        }
+
+    def answer(self, method, parameters):
+        """Return the `result` field Telegram would send for a call."""
+        if method == "getMe":
+            return {
+                "id": BOT_ID,
+                "is_bot": True,
+                "first_name": "FakeBot",
+                "username": "fake_bot",
+                "can_join_groups": False,
+                "can_read_all_group_messages": False,
+                "supports_inline_queries": False,
+            }
+        if method in ("sendMessage", "sendDocument", "editMessageText"):
+            return self._message(parameters)
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        self.calls.append((time.perf_counter(), api_method, parameters))
+        body = {"ok": True, "result": self.answer(api_method, parameters)}
+        return 200, json.dumps(body).encode()
+
+
+def make_text_update(update_id, user_id, text):
+    """Build the JSON of an Update carrying a private text message (commands get their entity)."""
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": update_id, "message": message}
@@ -0,0 +1,262 @@
+# benchmarks/load_test.py
+"""Offline load test: simulated users drive the real handlers through a fake Bot API and a stub LLM.
+
+Each user runs a mix of chat messages, notes, note searches and flashcard study
+sessions, with random think time between actions. The handlers are registered as in
+main.py and updates go through PerUserUpdateProcessor, so queuing, persistence and
+the LLM scheduler behave as in production. No token, network or Ollama is needed.
+
+    python -m benchmarks.load_test --users 50 --actions 20 --output run.json
+    python -m benchmarks.load_test --users 50 --actions 20 --compare run.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+from storage import BACKENDS
+
+# Action mix: (kind, weight)
+ACTION_MIX = (
+    ("chat", 50),
+    ("note", 15),
+    ("shownotes", 5),
+    ("searchnotes", 5),
+    ("add_flashcard", 10),
+    ("study", 15),
+)
+WORDS = ("ciao", "casa", "cane", "gatto", "libro", "acqua", "pane", "sole", "luna", "mare", "treno", "scuola")
+MEANINGS = {
+    "ciao": "hello", "casa": "house", "cane": "dog", "gatto": "cat", "libro": "book", "acqua": "water",
+    "pane": "bread", "sole": "sun", "luna": "moon", "mare": "sea", "treno": "train", "scuola": "school",
+}
+LAG_INTERVAL = 0.01
+
+
+def percentiles(values):
+    """count, p50, p95, p99 and max of a list of seconds, in milliseconds."""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pick(q):
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000, 2)
+
+    return {"count": len(ordered), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+            "max_ms": round(ordered[-1] * 1000, 2)}
+
+
+async def measure_loop_lag(samples, stop):
+    """Sleep in short steps and record how late the event loop wakes up."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + LAG_INTERVAL
+        await asyncio.sleep(LAG_INTERVAL)
+        samples.append(max(loop.time() - expected, 0.0))
+
+
+async def run(args):
+    # Imported here: config reads the environment prepared by main()
+    from telegram import Update
+    from telegram.ext import Application
+    import llm
+    import data_manager
+    from main import register_handlers
+    from outbound import OutboundRateLimiter, outbox
+    from update_processor import PerUserUpdateProcessor
+    from benchmarks.fake_telegram import FakeRequest, make_text_update
+    from benchmarks.stub_llm import StubLLM
+
+    stub = StubLLM(args.llm_latency, args.tokens_per_second, args.reply_tokens)
+    llm.set_model(stub)
+    data_manager.load_data()
+
+    first_response = []
+    pending = {}    # chat_id -> time the current action was submitted
+
+    class TimingRequest(FakeRequest):
+        def answer(self, method, parameters):
+            if method in ("sendMessage", "sendDocument"):
+                started = pending.pop(parameters.get("chat_id"), None)
+                if started is not None:
+                    first_response.append(time.perf_counter() - started)
+            return super().answer(method, parameters)
+
+    request = TimingRequest()
+    builder = (
+        Application.builder()
+        .token("0:benchmark")
+        .request(request)
+        .get_updates_request(FakeRequest())
+        .concurrent_updates(PerUserUpdateProcessor(args.max_concurrent))
+    )
+    if args.rate_limit:
+        builder = builder.rate_limiter(OutboundRateLimiter())
+    app = builder.build()
+    register_handlers(app)
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(repr(context.error))
+
+    app.add_error_handler(on_error)
+
+    latencies = defaultdict(list)
+    update_ids = iter(range(1, 10 ** 9))
+
+    async def send(user_id, text, kind):
+        update = Update.de_json(make_text_update(next(update_ids), user_id, text), app.bot)
+        started = time.perf_counter()
+        pending[user_id] = started
+        # What Application does with each fetched update, awaited so the latency can be measured
+        await app.update_processor.process_update(update, app.process_update(update))
+        latencies[kind].append(time.perf_counter() - started)
+        pending.pop(user_id, None)
+
+    async def simulate_user(user_id, rng):
+        await asyncio.sleep(rng.uniform(0, args.think))
+        # A few cards first, so study sessions have something to ask
+        for word in rng.sample(WORDS, 4):
+            await send(user_id, f"/add_flashcard {word} {MEANINGS[word]}", "add_flashcard")
+        kinds = [kind for kind, _ in ACTION_MIX]
+        weights = [weight for _, weight in ACTION_MIX]
+        for _ in range(args.actions):
+            kind = rng.choices(kinds, weights)[0]
+            if kind == "chat":
+                await send(user_id, f"Can you tell me something about {rng.choice(WORDS)}?", kind)
+            elif kind == "note":
+                await send(user_id, f"/note remember {rng.choice(WORDS)} and {rng.choice(WORDS)}", kind)
+            elif kind == "shownotes":
+                await send(user_id, "/shownotes", kind)
+            elif kind == "searchnotes":
+                await send(user_id, f"/searchnotes {rng.choice(WORDS)[:3]}", kind)
+            elif kind == "add_flashcard":
+                word = rng.choice(WORDS)
+                await send(user_id, f"/add_flashcard {word} {MEANINGS[word]}", kind)
+            else:
+                await send(user_id, "/flashcards_study 3", kind)
+                for _ in range(3):
+                    await asyncio.sleep(rng.expovariate(1 / args.think) if args.think else 0)
+                    await send(user_id, rng.choice(list(MEANINGS.values())), "study_answer")
+            await asyncio.sleep(rng.expovariate(1 / args.think) if args.think else 0)
+
+    lag_samples = []
+    stop = asyncio.Event()
+    async with app:
+        data_manager.start_persistence()
+        lag_task = asyncio.create_task(measure_loop_lag(lag_samples, stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            simulate_user(100000 + user, random.Random(args.seed * 100003 + user)) for user in range(args.users)
+        ))
+        await outbox.drain()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await lag_task
+        await data_manager.stop_persistence()
+
+    data_bytes = sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(args.data_dir) for name in names
+    )
+    actions = sum(len(values) for values in latencies.values())
+    journal = getattr(data_manager._storage, "journal", None)
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "elapsed_seconds": round(elapsed, 3),
+        "updates": actions,
+        "updates_per_second": round(actions / elapsed, 1),
+        "latency": percentiles([value for values in latencies.values() for value in values]),
+        "latency_by_kind": {kind: percentiles(values) for kind, values in sorted(latencies.items())},
+        "first_response": percentiles(first_response),
+        "event_loop_lag": percentiles(lag_samples),
+        "llm": {"calls": stub.calls, "avg_prompt_chars": round(stub.prompt_chars / max(stub.calls, 1))},
+        "persistence": {
+            "flushes": data_manager.persistence_stats["flushes"],
+            "bytes_written": data_manager.persistence_stats["bytes_written"],
+            "journal_bytes": journal.stats["bytes"] if journal else 0,
+            "max_flush_ms": round(data_manager.persistence_stats["max_flush_seconds"] * 1000, 2),
+            "data_on_disk_bytes": data_bytes,
+        },
+        "errors": len(errors),
+        "bot_api_calls": len(request.calls),
+    }
+
+
+# Metrics compared by --compare: (label, path in the result, lower is better)
+COMPARED = (
+    ("updates/s", ("updates_per_second",), False),
+    ("latency p50 ms", ("latency", "p50_ms"), True),
+    ("latency p95 ms", ("latency", "p95_ms"), True),
+    ("latency p99 ms", ("latency", "p99_ms"), True),
+    ("first response p95 ms", ("first_response", "p95_ms"), True),
+    ("loop lag p99 ms", ("event_loop_lag", "p99_ms"), True),
+    ("loop lag max ms", ("event_loop_lag", "max_ms"), True),
+    ("bytes written", ("persistence", "bytes_written"), True),
+    ("journal bytes", ("persistence", "journal_bytes"), True),
+)
+
+
+def compare(baseline, result):
+    """Print the change of the main metrics against a previous run."""
+    print(f"{'metric':<24}{'baseline':>14}{'this run':>14}{'change':>10}")
+    for label, path, _ in COMPARED:
+        old, new = baseline, result
+        for key in path:
+            old = old.get(key, {}) if isinstance(old, dict) else None
+            new = new.get(key, {}) if isinstance(new, dict) else None
+        if not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+            continue
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"{label:<24}{old:>14}{new:>14}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--actions", type=int, default=10, help="actions per user")
+    parser.add_argument("--think", type=float, default=0.2, help="mean think time between actions (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="stub LLM time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--reply-tokens", type=int, default=40)
+    parser.add_argument("--llm-concurrency", type=int, default=1, help="OLLAMA_MAX_CONCURRENCY")
+    parser.add_argument("--max-concurrent", type=int, default=64, help="updates processed at once")
+    parser.add_argument("--rate-limit", action="store_true", help="use the outbound flood control limits")
+    parser.add_argument("--storage", default="json", choices=BACKENDS)
+    parser.add_argument("--data-dir", default=None, help="directory for the data files (default: a temp dir)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    parser.add_argument("--compare", help="JSON result of a previous run to compare against")
+    args = parser.parse_args()
+
+    args.data_dir = args.data_dir or tempfile.mkdtemp(prefix="bot_load_test_")
+    # Must be set before config is imported
+    os.environ.update({
+        "STORAGE_BACKEND": args.storage,
+        "DATA_FILE": os.path.join(args.data_dir, "bot_data.json"),
+        "SQLITE_FILE": os.path.join(args.data_dir, "bot_data.sqlite3"),
+        "SNAPSHOT_FILE": os.path.join(args.data_dir, "bot_data.snap"),
+        "SHARD_DIR": os.path.join(args.data_dir, "bot_data"),
+        "OLLAMA_MAX_CONCURRENCY": str(args.llm_concurrency),
+        "LLM_QUEUE_SIZE": str(max(args.users * 2, 32)),
+        "RESPONSE_CACHE_FILE": "",
+    })
+    os.environ.pop("JOURNAL_FILE", None)
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+    sys.exit(1 if result["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+# benchmarks/stub_llm.py
+import asyncio
+
+
+class StubLLM:
+    """Stands in for the Ollama model and chain: answers after a fixed delay at a fixed token rate.
+
+    Accepts the same inputs as the real runnables (a prompt string or the chain's dict)
+    and supports ainvoke() and astream().
+    """
+
+    def __init__(self, first_token_latency=0.2, tokens_per_second=50.0, reply_tokens=40):
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.calls = 0
+        self.prompt_chars = 0
+
+    def _record(self, inputs):
+        self.calls += 1
+        self.prompt_chars += len(inputs) if isinstance(inputs, str) else sum(len(str(v)) for v in inputs.values())
+
+    async def astream(self, inputs):
+        self._record(inputs)
+        await asyncio.sleep(self.first_token_latency)
+        interval = 1 / self.tokens_per_second if self.tokens_per_second else 0
+        for index in range(self.reply_tokens):
+            if index and interval:
+                await asyncio.sleep(interval)
+            yield f"tok{index} "
+
+    async def ainvoke(self, inputs):
+        return "".join([chunk async for chunk in self.astream(inputs)])
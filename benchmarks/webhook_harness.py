@@ -0,0 +1,109 @@
+# benchmarks/webhook_harness.py
+"""Post fake updates to a local webhook server and check concurrency and per-user ordering.
+
+Runs PTB's webhook server with PerUserUpdateProcessor and a fake Bot API, so no token
+or network is needed. Each simulated user posts numbered updates one after the other;
+users post in parallel. The probe handler sleeps a random time and records the order.
+
+    python -m benchmarks.webhook_harness --users 20 --updates 10 --delay 0.05
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+import httpx
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+from update_processor import PerUserUpdateProcessor
+from benchmarks.fake_telegram import FakeRequest, make_text_update
+
+SECRET_TOKEN = "harness-secret"
+
+
+async def run(users, updates, delay, port, max_concurrent):
+    processed = {}          # user_id -> sequence numbers in processing order
+    in_flight = Counter()   # user_id -> handlers currently running
+    totals = {"running": 0, "max_running": 0, "same_user_overlaps": 0}
+
+    async def probe(update: Update, context):
+        user_id = update.effective_user.id
+        if in_flight[user_id]:
+            totals["same_user_overlaps"] += 1
+        in_flight[user_id] += 1
+        totals["running"] += 1
+        totals["max_running"] = max(totals["max_running"], totals["running"])
+        await asyncio.sleep(random.uniform(0, delay))
+        processed.setdefault(user_id, []).append(int(update.message.text))
+        totals["running"] -= 1
+        in_flight[user_id] -= 1
+
+    app = (
+        Application.builder()
+        .token("0:harness")
+        .request(FakeRequest())
+        .get_updates_request(FakeRequest())
+        .concurrent_updates(PerUserUpdateProcessor(max_concurrent))
+        .build()
+    )
+    app.add_handler(TypeHandler(Update, probe))
+
+    url = f"http://127.0.0.1:{port}/hook"
+    update_ids = iter(range(1, users * updates + 1))
+
+    async def post_updates(client, user_id):
+        # One user's updates are posted in order, waiting for each to be accepted
+        for sequence in range(updates):
+            payload = make_text_update(next(update_ids), user_id, str(sequence))
+            response = await client.post(url, json=payload, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET_TOKEN})
+            response.raise_for_status()
+
+    async with app:
+        await app.updater.start_webhook(
+            listen="127.0.0.1", port=port, url_path="hook", webhook_url=url, secret_token=SECRET_TOKEN
+        )
+        await app.start()
+        started = time.perf_counter()
+        async with httpx.AsyncClient() as client:
+            await asyncio.gather(*(post_updates(client, 1000 + user) for user in range(users)))
+        while sum(len(done) for done in processed.values()) < users * updates:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        await app.updater.stop()
+        await app.stop()
+
+    out_of_order = [user_id for user_id, done in processed.items() if done != sorted(done)]
+    return {
+        "users": users,
+        "updates_per_user": updates,
+        "elapsed_seconds": round(elapsed, 3),
+        "updates_per_second": round(users * updates / elapsed, 1),
+        "sequential_estimate_seconds": round(users * updates * delay / 2, 3),
+        "max_concurrent_handlers": totals["max_running"],
+        "same_user_overlaps": totals["same_user_overlaps"],
+        "users_out_of_order": len(out_of_order),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--updates", type=int, default=10, help="updates per user")
+    parser.add_argument("--delay", type=float, default=0.05, help="max handler sleep in seconds")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-concurrent", type=int, default=64)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.users, args.updates, args.delay, args.port, args.max_concurrent))
+    print(json.dumps(result, indent=2))
+    ok = result["same_user_overlaps"] == 0 and result["users_out_of_order"] == 0
+    if args.users > 1 and result["max_concurrent_handlers"] < 2:
+        ok = False
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
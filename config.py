@@ -0,0 +1,112 @@
+# config.py
+import os
+from dotenv import load_dotenv
+
+# Load environment variables from .env file before any setting is read
+load_dotenv()
+
+# Persistent data file
+DATA_FILE = os.getenv("DATA_FILE", "bot_data.json")
+
+# Write-behind persistence: seconds between two background flushes
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", "2.0"))
+
+# Storage backend: "json" (single bot_data.json document), "snapshot" (compact binary snapshot),
+# "sharded" (one JSON file per user) or "sqlite" (per-user rows)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+SQLITE_FILE = os.getenv("SQLITE_FILE", "bot_data.sqlite3")
+SHARD_DIR = os.getenv("SHARD_DIR", "bot_data")
+SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", "bot_data.snap")
+
+# Lazy backends only: users kept in memory, and how long a user must be idle before it can be evicted
+MAX_RESIDENT_USERS = int(os.getenv("MAX_RESIDENT_USERS", "1000"))
+EVICTION_MIN_IDLE = float(os.getenv("EVICTION_MIN_IDLE", "60"))
+
+# LLM scheduling: generations run at once (match OLLAMA_NUM_PARALLEL) and max waiting requests
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "1"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "32"))
+
+# Streamed replies: show the answer while it is generated, editing the message at most once per interval
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "true").lower() in ("1", "true", "yes")
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+# Prompt context: token budget, turns always kept verbatim, and older turns left out of the context that trigger a summary
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "6"))
+SUMMARY_BATCH_TURNS = int(os.getenv("SUMMARY_BATCH_TURNS", "10"))
+
+# Default card selection for /flashcards_study: "srs" (spaced repetition) or "random"
+FLASHCARD_STUDY_MODE = os.getenv("FLASHCARD_STUDY_MODE", "srs").lower()
+
+# Language-mode response cache: memory cap in bytes, entry lifetime in seconds, optional file kept across restarts
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 60 * 60)))
+RESPONSE_CACHE_FILE = os.getenv("RESPONSE_CACHE_FILE", "")
+
+# Ollama model and how long the server keeps it loaded between requests
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:latest")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Update delivery: "polling" or "webhook" (PTB's built-in web server), and updates processed at once
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+
+# Append-only journal for history and flashcard-interaction appends (json backend), folded into the snapshot past a size
+JOURNAL_ENABLED = os.getenv("JOURNAL_ENABLED", "true").lower() in ("1", "true", "yes")
+JOURNAL_FILE = os.getenv("JOURNAL_FILE", DATA_FILE + ".journal")
+JOURNAL_COMPACT_BYTES = int(os.getenv("JOURNAL_COMPACT_BYTES", str(4 * 1024 * 1024)))
+JOURNAL_FSYNC = os.getenv("JOURNAL_FSYNC", "false").lower() in ("1", "true", "yes")
+
+# Items per page of /shownotes and /show_flashcards
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "10"))
+
+# /import_flashcards limits: rows read from one file, and file size (the Bot API serves downloads up to 20 MB)
+FLASHCARD_IMPORT_MAX_ROWS = int(os.getenv("FLASHCARD_IMPORT_MAX_ROWS", "100000"))
+FLASHCARD_IMPORT_MAX_BYTES = int(os.getenv("FLASHCARD_IMPORT_MAX_BYTES", str(20 * 1024 * 1024)))
+
+# Metrics: off by default; when on, a Prometheus endpoint is served on METRICS_LISTEN:METRICS_PORT (0 = no endpoint)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+# Telegram user IDs allowed to use /stats, comma-separated
+ADMIN_USER_IDS = {user_id.strip() for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+
+# Outbound flood control: messages per second for the whole bot and per chat (with a short burst), retries after RetryAfter
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+# Retrieval: put the RETRIEVAL_TOP_K past turns most similar to the question in the prompt (plus the recent turns)
+CONTEXT_RETRIEVAL = os.getenv("CONTEXT_RETRIEVAL", "false").lower() in ("1", "true", "yes")
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+# Embeddings from Ollama ("ollama") or a deterministic offline word-hashing embedder ("hashing")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "ollama").lower()
+OLLAMA_EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+
+# Incremental prompts: keep Ollama's context per user and send only the new question; rebuilt past the token limit
+OLLAMA_REUSE_CONTEXT = os.getenv("OLLAMA_REUSE_CONTEXT", "false").lower() in ("1", "true", "yes")
+OLLAMA_CONTEXT_MAX_TOKENS = int(os.getenv("OLLAMA_CONTEXT_MAX_TOKENS", "3000"))
+
+# Multi-process mode: worker processes owning a shard of the users each (1 = everything in one process)
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+# Seconds between worker heartbeats, silence after which a worker is restarted, and undelivered updates kept per worker
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "2.0"))
+WORKER_HEARTBEAT_TIMEOUT = float(os.getenv("WORKER_HEARTBEAT_TIMEOUT", "60"))
+WORKER_QUEUE_LIMIT = int(os.getenv("WORKER_QUEUE_LIMIT", "1000"))
+
+# Retention: per-user limits on the conversation history and the flashcard answer log (0 = no limit)
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "0"))
+HISTORY_MAX_AGE_DAYS = float(os.getenv("HISTORY_MAX_AGE_DAYS", "0"))
+FLASHCARD_LOG_MAX_ENTRIES = int(os.getenv("FLASHCARD_LOG_MAX_ENTRIES", "0"))
+FLASHCARD_LOG_MAX_AGE_DAYS = float(os.getenv("FLASHCARD_LOG_MAX_AGE_DAYS", "0"))
+# Seconds between retention passes, and event-loop time a pass may take before it yields
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+RETENTION_SLICE_SECONDS = float(os.getenv("RETENTION_SLICE_SECONDS", "0.005"))
+# Removed entries are appended to gzip-compressed JSON Lines files here ("" = discard them)
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
@@ -0,0 +1,158 @@
+# context_builder.py
+import asyncio
+import metrics
+from texts import summary_template
+from llm_scheduler import scheduler, SchedulerBusy
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_RECENT_TURNS, SUMMARY_BATCH_TURNS
+from data_manager import (
+    get_conversation_history,
+    get_conversation_summary,
+    set_conversation_summary,
+    history_version,
+    on_user_evicted,
+)
+
+# Scheduler queue shared by all background summaries, so they take turns with the users
+SUMMARY_QUEUE = "__summaries__"
+SUMMARY_MAX_WORDS = 150
+
+# user_id -> ((history version, summary coverage), rendered context)
+_context_cache = {}
+# Users whose summary is being regenerated, and the tasks doing it
+_summarizing = set()
+_summary_tasks = set()
+
+
+def _forget_user(user_id):
+    _context_cache.pop(user_id, None)
+
+
+on_user_evicted(_forget_user)
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (about four characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+def render_turn(turn):
+    """Render one conversation turn the way the prompt expects it."""
+    user_text = turn.get("user", "Unknown")
+    ai_text = turn.get("ai", "Unknown")
+    return f"\nUser: {user_text}\nAI: {ai_text}"
+
+
+def build_history_string(history_list):
+    """Convert the conversation history into a single string."""
+    return "".join(render_turn(turn) for turn in history_list)
+
+
+def build_context(user_id, llm, relevant=None):
+    """Return the prompt context for a user: rolling summary plus the newest turns that fit the budget.
+
+    The result is cached until a new turn is appended or the summary changes. When at least
+    SUMMARY_BATCH_TURNS older turns no longer fit and are not covered by the summary yet,
+    a background task folds them in with llm.
+    With relevant (indexes of older turns picked by retrieval), those turns and the recent
+    ones are used instead of walking back through the history.
+    """
+    history = get_conversation_history(user_id)
+    summary = get_conversation_summary(user_id)
+    if relevant is not None:
+        return _build_retrieval_context(history, summary, relevant)
+    key = (history_version(user_id), summary["covered"])
+    cached = _context_cache.get(user_id)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    covered = min(summary["covered"], len(history))
+    budget = CONTEXT_TOKEN_BUDGET
+    header = ""
+    if summary["text"]:
+        header = f"\nSummary of earlier conversation: {summary['text']}"
+        budget -= estimate_tokens(header)
+
+    # Walk back from the newest turn; the last CONTEXT_RECENT_TURNS are always kept verbatim
+    parts = []
+    index = len(history)
+    while index > covered:
+        rendered = render_turn(history[index - 1])
+        cost = estimate_tokens(rendered)
+        recent = len(history) - index < CONTEXT_RECENT_TURNS
+        if cost > budget and not recent:
+            break
+        parts.append(rendered)
+        budget -= cost
+        index -= 1
+    context = header + "".join(reversed(parts))
+    _context_cache[user_id] = (key, context)
+
+    # Turns dropped for the budget are summarized once a whole batch of them has piled up
+    if index - covered >= SUMMARY_BATCH_TURNS:
+        _schedule_summary(user_id, llm)
+    return context
+
+
+def _build_retrieval_context(history, summary, relevant):
+    """Summary, then the relevant older turns that fit the budget, then the recent turns verbatim."""
+    recent_start = max(len(history) - CONTEXT_RECENT_TURNS, 0)
+    recent = "".join(render_turn(turn) for turn in history[recent_start:])
+    budget = CONTEXT_TOKEN_BUDGET - estimate_tokens(recent)
+    header = ""
+    if summary["text"]:
+        header = f"\nSummary of earlier conversation: {summary['text']}"
+        budget -= estimate_tokens(header)
+    parts = []
+    for index in relevant:
+        if index >= recent_start:
+            continue
+        rendered = render_turn(history[index])
+        cost = estimate_tokens(rendered)
+        if cost > budget:
+            break
+        parts.append(rendered)
+        budget -= cost
+    if parts:
+        header += "\nRelevant earlier turns:" + "".join(parts) + "\nRecent turns:"
+    return header + recent
+
+
+def _schedule_summary(user_id, llm):
+    """Start a background summary update for user_id unless one is already running."""
+    if user_id in _summarizing:
+        return
+    _summarizing.add(user_id)
+    task = asyncio.get_running_loop().create_task(_update_summary(user_id, llm))
+    _summary_tasks.add(task)
+    task.add_done_callback(_summary_tasks.discard)
+
+
+async def _update_summary(user_id, llm):
+    """Fold the turns between the current summary and the recent window into the summary."""
+    try:
+        history = get_conversation_history(user_id)
+        summary = get_conversation_summary(user_id)
+        end = len(history) - CONTEXT_RECENT_TURNS
+        if end <= summary["covered"]:
+            return
+        prompt = summary_template.format(
+            summary=summary["text"] or "(none)",
+            turns=build_history_string(history[summary["covered"]:end]),
+            max_words=SUMMARY_MAX_WORDS,
+        )
+        metrics.observe("prompt_chars", len(prompt), metrics.SIZE_BUCKETS, kind="summary")
+
+        async def summarize():
+            with metrics.timer("llm_request_seconds", kind="summary"):
+                return await llm.ainvoke(prompt)
+
+        text = await scheduler.submit(SUMMARY_QUEUE, summarize)
+        # Drop the result if the history was cleared while the summary was generated
+        if get_conversation_history(user_id) is history and len(history) >= end:
+            set_conversation_summary(user_id, text.strip(), end)
+    except SchedulerBusy:
+        pass  # Retried the next time the context is built
+    except Exception as e:
+        print(f"Failed to summarize the history of user {user_id}: {e}")
+    finally:
+        _summarizing.discard(user_id)
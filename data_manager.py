@@ -1,126 +1,558 @@
-import os
-import json
-
-# Persistent data file
-DATA_FILE = "bot_data.json"
+import time
+import asyncio
+from collections import OrderedDict
+import srs
+import metrics
+from notes_index import NoteIndex
+from config import (
+    DATA_FILE,
+    FLUSH_INTERVAL,
+    STORAGE_BACKEND,
+    SQLITE_FILE,
+    SHARD_DIR,
+    SNAPSHOT_FILE,
+    MAX_RESIDENT_USERS,
+    EVICTION_MIN_IDLE,
+    JOURNAL_ENABLED,
+    JOURNAL_FILE,
+    JOURNAL_COMPACT_BYTES,
+    JOURNAL_FSYNC,
+)
+from journal import Journal
+from storage import create_storage
 
 # Data storage
 conversation_context = {}
 user_notes = {}
 user_settings = {}
 flashcards = {}
+conversation_summaries = {}
+flashcard_log = {}
+flashcard_stats = {}
+flashcard_schedules = {}
 
-def load_data():
-    """Load conversation_context, user_notes, user_settings, and flashcards from a JSON file."""
-    global conversation_context, user_notes, user_settings, flashcards
-
-    if os.path.exists(DATA_FILE):
-        print(f"Loading data from {DATA_FILE}...")
-        with open(DATA_FILE, "r") as f:
-            data = json.load(f)
-            conversation_context = data.get("conversation_context", {})
-            user_notes = data.get("user_notes", {})
-            user_settings = data.get("user_settings", {})
-            flashcards = data.get("flashcards", {})
-
-    else:
-        print(f"{DATA_FILE} does not exist. Initializing empty data.")
-        conversation_context = {}
-        user_notes = {}
-        user_settings = {}
-        flashcards = {}
+# Per-user min-heaps of (due time, Italian word), built on first use
+_due_heaps = {}
 
+# Per-user inverted indexes over the notes, built on first search
+_note_indexes = {}
 
-def save_data():
-    """Save conversation_context, user_notes, user_settings, and flashcards to a JSON file."""
-    data = {
+# Bumped on every history append; rendered prompt contexts are cached per version
+_history_versions = {}
+_version_counter = 0
+
+# Storage backend selected by STORAGE_BACKEND
+_storage = None
+# Users loaded from a lazy backend, least recently used first: user_id -> last access (monotonic)
+_resident = OrderedDict()
+# Called with the user_id of every evicted user, so caches elsewhere can drop it too
+_eviction_listeners = []
+# Called with (user_id, index, turn) after a turn is appended to a user's history
+_turn_listeners = []
+# Called with user_id when a user's history is trimmed or cleared
+_reset_listeners = []
+
+# Write-behind persistence state
+_dirty_users = set()
+_flushing_users = set()
+# Dirty users picked for eviction: dropped once the next background flush has written them
+_evicting_users = set()
+_pending_writes = 0
+_flush_task = None
+_stop_event = None
+persistence_stats = {
+    "flushes": 0,
+    "coalesced_writes": 0,
+    "bytes_written": 0,
+    "last_flush_seconds": 0.0,
+    "max_flush_seconds": 0.0,
+    "total_flush_seconds": 0.0,
+    "evictions": 0,
+    "eviction_flushes": 0,
+}
+
+metrics.gauge_callback("resident_users", lambda: len(_resident))
+metrics.gauge_callback("dirty_users", lambda: len(_dirty_users))
+metrics.gauge_callback("journal_bytes", lambda: _storage.journal_size() if _storage else 0)
+
+def _sections():
+    """Map each section name to its in-memory dict."""
+    return {
         "conversation_context": conversation_context,
         "user_notes": user_notes,
         "user_settings": user_settings,
         "flashcards": flashcards,
+        "conversation_summaries": conversation_summaries,
+        "flashcard_log": flashcard_log,
+        "flashcard_stats": flashcard_stats,
+        "flashcard_schedules": flashcard_schedules,
     }
-    with open(DATA_FILE, "w") as f:
-        json.dump(data, f, indent=3)
+
+def load_data():
+    """Load conversation_context, user_notes, user_settings, and flashcards from the configured storage."""
+    global _storage
+
+    journal = Journal(JOURNAL_FILE, fsync=JOURNAL_FSYNC) if JOURNAL_ENABLED else None
+    _storage = create_storage(STORAGE_BACKEND, DATA_FILE, SQLITE_FILE, SHARD_DIR, journal, SNAPSHOT_FILE)
+    _resident.clear()
+    _due_heaps.clear()
+    _note_indexes.clear()
+    data = _storage.load_all()
+    # Fill the existing dicts instead of rebinding them, so modules that imported them see the data
+    for name, section in _sections().items():
+        section.clear()
+        section.update(data[name])
+    for user_id in list(conversation_context):
+        _move_legacy_interactions(user_id)
+
+def on_user_evicted(callback):
+    """Register callback(user_id), called when a cold user is dropped from memory."""
+    _eviction_listeners.append(callback)
+
+def on_turn_added(callback):
+    """Register callback(user_id, index, turn), called after add_conversation_turn()."""
+    _turn_listeners.append(callback)
+
+def on_history_reset(callback):
+    """Register callback(user_id), called when a user's history loses turns (retention or /clear_data)."""
+    _reset_listeners.append(callback)
+
+def _ensure_loaded(user_id):
+    """Load a user's shard from a lazy storage backend on first access and mark it recently used."""
+    if not _storage.lazy:
+        return
+    if user_id in _resident:
+        _resident[user_id] = time.monotonic()
+        _resident.move_to_end(user_id)
+        return
+    _install_record(user_id, _storage.load_user(user_id))
+
+def _install_record(user_id, record):
+    """Put a user's stored record into the in-memory dicts."""
+    _resident[user_id] = time.monotonic()
+    if record:
+        sections = _sections()
+        for name, value in record.items():
+            sections[name].setdefault(user_id, value)
+        _move_legacy_interactions(user_id)
+    _evict_cold_users()
+
+def _evict_cold_users():
+    """Drop least recently used users above MAX_RESIDENT_USERS; dirty ones are dropped after the next flush."""
+    now = time.monotonic()
+    excess = len(_resident) - MAX_RESIDENT_USERS
+    for user_id, last_access in list(_resident.items()):
+        # Recently used users may still be referenced by a running handler
+        if excess <= 0 or now - last_access < EVICTION_MIN_IDLE:
+            break
+        if user_id in _flushing_users:
+            continue
+        excess -= 1
+        if user_id not in _dirty_users:
+            _drop_user(user_id)
+        elif _flush_task is None:
+            # Persistence engine not running (e.g. scripts): write synchronously
+            persistence_stats["bytes_written"] += _storage.commit(_storage.prepare(_sections(), [user_id]))
+            persistence_stats["eviction_flushes"] += 1
+            _dirty_users.discard(user_id)
+            _drop_user(user_id)
+        else:
+            # Written in an executor by flush_data(), one write at a time, never on the event loop
+            _evicting_users.add(user_id)
+
+def _drop_written_users(written_users):
+    """Drop the users picked for eviction that a flush has written and that stayed idle and clean."""
+    now = time.monotonic()
+    for user_id in _evicting_users & written_users:
+        _evicting_users.discard(user_id)
+        last_access = _resident.get(user_id)
+        if last_access is not None and user_id not in _dirty_users and now - last_access >= EVICTION_MIN_IDLE:
+            persistence_stats["eviction_flushes"] += 1
+            _drop_user(user_id)
+
+def _drop_user(user_id):
+    for section in _sections().values():
+        section.pop(user_id, None)
+    _due_heaps.pop(user_id, None)
+    _note_indexes.pop(user_id, None)
+    del _resident[user_id]
+    persistence_stats["evictions"] += 1
+    metrics.inc("evictions_total")
+    for callback in _eviction_listeners:
+        callback(user_id)
+
+def _move_legacy_interactions(user_id):
+    """Move flashcard interactions that older versions logged in the conversation history to flashcard_log."""
+    history = conversation_context.get(user_id)
+    if not history or not any(turn.get("type") == "flashcard" for turn in history):
+        return
+    turns = []
+    summary = conversation_summaries.get(user_id)
+    covered = summary["covered"] if summary else 0
+    for index, turn in enumerate(history):
+        if turn.get("type") != "flashcard":
+            turns.append(turn)
+            continue
+        _record_interaction(user_id, {key: value for key, value in turn.items() if key != "type"})
+        if index < covered:
+            summary["covered"] -= 1
+    history[:] = turns
+    # Persisted by the next flush; no write per user while loading
+    _dirty_users.add(user_id)
+
+async def preload_user(user_id):
+    """Load a user's record off the event loop so later get_* calls hit memory."""
+    if _storage is None or not _storage.lazy or user_id in _resident:
+        return
+    loop = asyncio.get_running_loop()
+    record = await loop.run_in_executor(None, _storage.load_user, user_id)
+    if user_id not in _resident:
+        _install_record(user_id, record)
+
+def _record_flush(started, written, mode):
+    """Update the persistence counters after a completed flush."""
+    global _pending_writes
+    elapsed = time.perf_counter() - started
+    metrics.observe("persistence_flush_seconds", elapsed, mode=mode)
+    metrics.inc("persistence_bytes_written_total", written)
+    persistence_stats["flushes"] += 1
+    persistence_stats["coalesced_writes"] += max(_pending_writes - 1, 0)
+    persistence_stats["bytes_written"] += written
+    persistence_stats["last_flush_seconds"] = elapsed
+    persistence_stats["max_flush_seconds"] = max(persistence_stats["max_flush_seconds"], elapsed)
+    persistence_stats["total_flush_seconds"] += elapsed
+    _pending_writes = 0
+
+def save_data():
+    """Save conversation_context, user_notes, user_settings, and flashcards right away."""
+    started = time.perf_counter()
+    if _storage.lazy:
+        _dirty_users.intersection_update(_resident)
+    # Blocks the caller (the event loop, when called from a handler) for the whole write
+    written = _storage.commit(_storage.prepare(_sections(), _dirty_users))
+    _dirty_users.clear()
+    _record_flush(started, written, "sync")
+
+def _journal_or_mark_dirty(user_id, ops):
+    """Persist small changes with one journal append if the backend has a journal, else mark the user dirty."""
+    if not _storage.journal_write(ops):
+        mark_dirty(user_id)
+
+def _compaction_due():
+    """True once the journal has grown past JOURNAL_COMPACT_BYTES and should be folded into a snapshot."""
+    return _storage.journal_size() >= JOURNAL_COMPACT_BYTES
+
+def mark_dirty(user_id, section=None):
+    """Record that a user's data changed; the background task will persist it.
+
+    With section, only that section of the user changed: a backend with a journal records
+    its new value there instead of rewriting the user.
+    """
+    global _pending_writes
+    if section is not None:
+        value = _sections()[section].get(user_id)
+        _journal_or_mark_dirty(user_id, [{"op": "replace", "section": section, "user": user_id, "value": value}])
+        return
+    _dirty_users.add(user_id)
+    _pending_writes += 1
+    if _flush_task is None:
+        # Persistence engine not running (e.g. scripts): write synchronously
+        save_data()
+
+async def flush_data():
+    """Persist pending changes, if any, without blocking the event loop on file I/O."""
+    if not _dirty_users and not _compaction_due():
+        return
+    started = time.perf_counter()
+    flushed_users = set(_dirty_users)
+    if _storage.lazy:
+        # A user evicted in the meantime has nothing left in memory to write
+        flushed_users.intersection_update(_resident)
+    _dirty_users.clear()
+    # Serialize on the event loop so no handler mutates the dicts mid-dump
+    with metrics.timer("persistence_prepare_seconds"):
+        payload = _storage.prepare(_sections(), flushed_users)
+    loop = asyncio.get_running_loop()
+    # Users being written must not be evicted and reloaded before the write lands
+    _flushing_users.update(flushed_users)
+    try:
+        written = await loop.run_in_executor(None, _storage.commit, payload)
+    except Exception:
+        _dirty_users.update(flushed_users)
+        raise
+    finally:
+        _flushing_users.clear()
+    _record_flush(started, written, "background")
+    _drop_written_users(flushed_users)
+
+async def _persistence_loop():
+    """Coalesce mutations into one flush every FLUSH_INTERVAL seconds until stopped."""
+    while not _stop_event.is_set():
+        try:
+            await asyncio.wait_for(_stop_event.wait(), timeout=FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await flush_data()
+        except Exception as e:
+            print(f"Failed to save data ({STORAGE_BACKEND}): {e}")
+
+def start_persistence():
+    """Start the background write-behind task on the running event loop."""
+    global _flush_task, _stop_event
+    if _flush_task is not None:
+        return
+    _stop_event = asyncio.Event()
+    _flush_task = asyncio.get_running_loop().create_task(_persistence_loop())
+
+async def stop_persistence():
+    """Stop the background task and force a final flush of pending changes."""
+    global _flush_task
+    if _flush_task is None:
+        return
+    _stop_event.set()
+    await _flush_task
+    _flush_task = None
+    if _dirty_users or _compaction_due():
+        save_data()
+    _storage.close()
+
+def _bump_history_version(user_id):
+    global _version_counter
+    _version_counter += 1
+    _history_versions[user_id] = _version_counter
 
 def add_conversation_turn(user_id, user_input, ai_response):
     """Add a conversation turn to the history."""
+    _ensure_loaded(user_id)
     if user_id not in conversation_context:
         conversation_context[user_id] = []  # Ensure user history exists
-    conversation_context[user_id].append({"user": user_input, "ai": ai_response})
-    save_data()
+    turn = {"user": user_input, "ai": ai_response, "ts": time.time()}
+    conversation_context[user_id].append(turn)
+    _bump_history_version(user_id)
+    _journal_or_mark_dirty(user_id, [{"op": "append", "section": "conversation_context", "user": user_id, "value": turn}])
+    for callback in _turn_listeners:
+        callback(user_id, len(conversation_context[user_id]) - 1, turn)
+
+def history_version(user_id):
+    """Return a value that changes whenever the user's history changes (a turn appended, trimmed or cleared)."""
+    return _history_versions.get(user_id, 0)
+
+def get_conversation_summary(user_id):
+    """Return the rolling summary of the user's older turns ({"text", "covered"})."""
+    _ensure_loaded(user_id)
+    return conversation_summaries.get(user_id, {"text": "", "covered": 0})
+
+def set_conversation_summary(user_id, text, covered):
+    """Store a summary of the first `covered` turns of the user's history."""
+    _ensure_loaded(user_id)
+    conversation_summaries[user_id] = {"text": text, "covered": covered}
+    mark_dirty(user_id, "conversation_summaries")
 
 
-def clear_data():
-    """Clear all in-memory data."""
-    global conversation_context, user_notes, user_settings, flashcards
-    conversation_context.clear()
-    user_notes.clear()
-    user_settings.clear()
-    flashcards.clear()
-   # save_data()
+def clear_user_data(user_id):
+    """Delete every record of one user; the other users are not touched."""
+    _ensure_loaded(user_id)
+    for section in _sections().values():
+        section.pop(user_id, None)
+    _due_heaps.pop(user_id, None)
+    _note_indexes.pop(user_id, None)
+    _bump_history_version(user_id)
+    for name in ("conversation_context", "flashcard_log"):
+        _storage.log_truncated(user_id, name)
+    # Still resident on lazy backends, so the next flush writes the empty record instead of reloading it
+    _journal_or_mark_dirty(user_id, [{"op": "clear", "user": user_id}])
+    for callback in _reset_listeners:
+        callback(user_id)
+
+def trim_log(user_id, section, count):
+    """Remove the oldest count entries of a user's conversation_context or flashcard_log and return them."""
+    _ensure_loaded(user_id)
+    entries = _sections()[section].get(user_id)
+    if not entries or count <= 0:
+        return []
+    removed = entries[:count]
+    # A new list, so code holding the old one (a summary being generated, retrieval) sees the change
+    _sections()[section][user_id] = entries[count:]
+    ops = [{"op": "trim", "section": section, "user": user_id, "count": len(removed)}]
+    if section == "conversation_context":
+        _bump_history_version(user_id)
+        summary = conversation_summaries.get(user_id)
+        if summary:
+            # The summary still describes the removed turns; only its position moves
+            summary["covered"] = max(summary["covered"] - len(removed), 0)
+            ops.append({"op": "set", "section": "conversation_summaries", "user": user_id,
+                        "key": "covered", "value": summary["covered"]})
+    _storage.log_truncated(user_id, section)
+    _journal_or_mark_dirty(user_id, ops)
+    if section == "conversation_context":
+        for callback in _reset_listeners:
+            callback(user_id)
+    return removed
+
+def loaded_user_ids():
+    """Ids of the users whose data is in memory (every user, unless the backend is lazy)."""
+    if _storage.lazy:
+        return list(_resident)
+    return list(set(conversation_context) | set(flashcard_log))
 
 def get_user_settings(user_id):
     """Retrieve or initialize settings for a specific user."""
+    _ensure_loaded(user_id)
     if user_id not in user_settings:
         user_settings[user_id] = {"mode": "normal", "level": "beginner", "topic": "general"}
-        save_data()
+        mark_dirty(user_id, "user_settings")
     return user_settings[user_id]
 
 
 def get_conversation_history(user_id):
     """Retrieve the conversation history for a specific user."""
+    _ensure_loaded(user_id)
     return conversation_context.setdefault(user_id, [])
 
 def get_user_notes(user_id):
     """Get notes for a specific user."""
+    _ensure_loaded(user_id)
     return user_notes.setdefault(user_id, [])
 
 def add_user_note(user_id, note):
     """Add a note for a specific user."""
     notes = get_user_notes(user_id)
     notes.append(note)
-    save_data()
+    if user_id in _note_indexes:
+        _note_indexes[user_id].add(note)
+    _journal_or_mark_dirty(user_id, [{"op": "append", "section": "user_notes", "user": user_id, "value": note}])
 
 def delete_user_note(user_id, index):
     """Delete a note by index for a specific user."""
     notes = get_user_notes(user_id)
     if 0 <= index < len(notes):
         deleted_note = notes.pop(index)
-        save_data()
+        if user_id in _note_indexes:
+            _note_indexes[user_id].remove(index, deleted_note)
+        mark_dirty(user_id, "user_notes")
         return deleted_note
     return None
 
+def search_user_notes(user_id, query, limit=10):
+    """Return [(index, note)] of the user's notes best matching query, best first."""
+    notes = get_user_notes(user_id)
+    index = _note_indexes.get(user_id)
+    if index is None or len(index) != len(notes):
+        # Missing (first search, reload) or out of step with the list: rebuild it
+        index = _note_indexes[user_id] = NoteIndex(notes)
+    return [(position, notes[position]) for position, _ in index.search(query, limit)]
+
 def get_flashcards(user_id):
     """Retrieve or initialize flashcards for a specific user."""
+    _ensure_loaded(user_id)
     return flashcards.setdefault(user_id, {})
 
 def save_flashcards(user_id, updated_flashcards):
     """Save updated flashcards for a specific user."""
+    _ensure_loaded(user_id)
     flashcards[user_id] = updated_flashcards
-    save_data()
+    # Cards may have been added in place; rebuild the due index on next use
+    _due_heaps.pop(user_id, None)
+    mark_dirty(user_id, "flashcards")
+
+def bulk_upsert_flashcards(user_id, deck):
+    """Add or update many flashcards at once with a single persist; returns (added, updated)."""
+    cards = get_flashcards(user_id)
+    added = updated = 0
+    ops = []
+    for italian, english in deck.items():
+        if italian not in cards:
+            added += 1
+        elif cards[italian] != english:
+            updated += 1
+        else:
+            continue
+        cards[italian] = english
+        ops.append({"op": "set", "section": "flashcards", "user": user_id, "key": italian, "value": english})
+    if ops:
+        # New cards are due right away; rebuild the due index on next use
+        _due_heaps.pop(user_id, None)
+        _journal_or_mark_dirty(user_id, ops)
+    return added, updated
 
 def add_flashcard(user_id, italian, english):
     """Add a flashcard for a specific user."""
     flashcards = get_flashcards(user_id)
     flashcards[italian] = english
-    save_data()
+    if user_id in _due_heaps and italian not in flashcard_schedules.get(user_id, {}):
+        srs.push_due(_due_heaps[user_id], 0, italian)
+    _journal_or_mark_dirty(user_id, [{"op": "set", "section": "flashcards", "user": user_id, "key": italian, "value": english}])
 
 def delete_flashcard(user_id, italian):
     """Delete a specific flashcard for a user."""
     flashcards = get_flashcards(user_id)
     if italian in flashcards:
         del flashcards[italian]
-        save_data()
+        # Its entry in the due index goes stale and is skipped lazily
+        flashcard_schedules.get(user_id, {}).pop(italian, None)
+        flashcard_stats.get(user_id, {}).pop(italian, None)
+        _journal_or_mark_dirty(user_id, [
+            {"op": "unset", "section": section, "user": user_id, "key": italian}
+            for section in ("flashcards", "flashcard_schedules", "flashcard_stats")
+        ])
         return True
     return False
 
+def get_due_flashcards(user_id, count):
+    """Return up to count (italian, english) pairs whose review is due first."""
+    cards = get_flashcards(user_id)
+    schedules = flashcard_schedules.get(user_id, {})
+    heap = _due_heaps.get(user_id)
+    if heap is None or len(heap) > 2 * len(cards) + 16:
+        # Missing, or mostly stale entries: rebuild from the stored schedules
+        heap = _due_heaps[user_id] = srs.build_due_heap(cards, schedules)
+    return [(italian, cards[italian]) for italian in srs.next_due(heap, count, cards, schedules)]
+
+def review_flashcard(user_id, italian, quality):
+    """Update a card's spaced-repetition schedule after an answer of the given quality (0-5)."""
+    if italian not in get_flashcards(user_id):
+        # Deleted while a study session still held it
+        return
+    schedule = flashcard_schedules.setdefault(user_id, {}).setdefault(italian, srs.new_schedule())
+    srs.review(schedule, quality, time.time())
+    if user_id in _due_heaps:
+        srs.push_due(_due_heaps[user_id], schedule["due"], italian)
+    _journal_or_mark_dirty(user_id, [
+        {"op": "set", "section": "flashcard_schedules", "user": user_id, "key": italian, "value": schedule}
+    ])
+
+def _record_interaction(user_id, interaction):
+    """Append an interaction to the user's log and update the per-card aggregates."""
+    flashcard_log.setdefault(user_id, []).append(interaction)
+    stats = flashcard_stats.setdefault(user_id, {})
+    for italian in interaction["flashcard"]:
+        card = stats.setdefault(italian, {"attempts": 0, "correct": 0, "last_seen": None})
+        card["attempts"] += 1
+        if interaction["correct"]:
+            card["correct"] += 1
+        card["last_seen"] = interaction.get("timestamp")
+
 def add_flashcard_interaction(user_id, flashcard, user_response, correct):
     """Log a flashcard interaction."""
-    history = get_conversation_history(user_id)
+    _ensure_loaded(user_id)
     interaction = {
         "flashcard": flashcard,
         "user_response": user_response,
         "correct": correct,
+        "timestamp": time.time(),
     }
-    history.append({"type": "flashcard", **interaction})
-    save_data()
+    _record_interaction(user_id, interaction)
+    stats = flashcard_stats[user_id]
+    ops = [{"op": "append", "section": "flashcard_log", "user": user_id, "value": interaction}]
+    ops += [
+        {"op": "set", "section": "flashcard_stats", "user": user_id, "key": italian, "value": stats[italian]}
+        for italian in flashcard
+    ]
+    _journal_or_mark_dirty(user_id, ops)
+
+def get_flashcard_stats(user_id):
+    """Return the per-card aggregates of the cards in a user's deck: {italian: {"attempts", "correct", "last_seen"}}."""
+    cards = get_flashcards(user_id)
+    # An answer to a card deleted during a study session can still add an entry
+    return {italian: card for italian, card in flashcard_stats.get(user_id, {}).items() if italian in cards}
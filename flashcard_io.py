@@ -0,0 +1,65 @@
+# flashcard_io.py
+import csv
+
+# Longest Italian word or English translation accepted from an import
+MAX_FIELD_LENGTH = 100
+# Header cells recognized (and skipped) in the first row of an import
+HEADER_WORDS = {"italian", "english", "italiano", "inglese", "front", "back", "word", "translation"}
+
+
+def _sniff_delimiter(line):
+    """Tab for TSV, else semicolon or comma, whichever the first line uses."""
+    if "\t" in line:
+        return "\t"
+    if line.count(";") > line.count(","):
+        return ";"
+    return ","
+
+
+def read_deck(path, max_rows):
+    """Parse a CSV/TSV deck row by row into {italian: english}.
+
+    The file is read as a stream, so only the resulting deck is kept in memory.
+    Returns (deck, stats) with stats counting rows, duplicates and rejected rows.
+    Reading stops after max_rows rows (stats["truncated"] is then True).
+    """
+    deck = {}
+    stats = {"rows": 0, "duplicates": 0, "rejected": 0, "truncated": False}
+    with open(path, "r", newline="", encoding="utf-8-sig", errors="replace") as f:
+        first = f.readline()
+        f.seek(0)
+        reader = csv.reader(f, delimiter=_sniff_delimiter(first))
+        for line_number, row in enumerate(reader):
+            if not row or not any(cell.strip() for cell in row):
+                continue
+            if line_number == 0 and {cell.strip().lower() for cell in row[:2]} <= HEADER_WORDS:
+                continue
+            if stats["rows"] >= max_rows:
+                stats["truncated"] = True
+                break
+            stats["rows"] += 1
+            if len(row) < 2:
+                stats["rejected"] += 1
+                continue
+            italian = row[0].strip().lower()
+            english = row[1].strip().lower()
+            if not italian or not english or len(italian) > MAX_FIELD_LENGTH or len(english) > MAX_FIELD_LENGTH:
+                stats["rejected"] += 1
+                continue
+            if italian in deck:
+                # The last translation of a word repeated in the file wins
+                stats["duplicates"] += 1
+            deck[italian] = english
+    return deck, stats
+
+
+def write_deck(path, cards):
+    """Write (italian, english) pairs to path as CSV, one row at a time; returns the number of rows."""
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["italian", "english"])
+        for italian, english in cards:
+            writer.writerow([italian, english])
+            count += 1
+    return count
@@ -0,0 +1,109 @@
+# grading.py
+import re
+import unicodedata
+from functools import lru_cache
+
+CORRECT = "correct"
+CLOSE = "close"
+WRONG = "wrong"
+
+# Leading words that do not change the meaning of an answer ("the dog", "to eat")
+_ARTICLES = ("the ", "a ", "an ", "to ")
+# Several meanings can be stored in one card: "dog, hound" or "dog / hound"
+_MEANING_SEPARATORS = re.compile(r"[,/;]")
+_NOT_WORD = re.compile(r"[^\w\s']+")
+_SPACES = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=65536)
+def normalize(text):
+    """Lowercase, accent-folded text without punctuation, extra spaces or a leading article."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = _SPACES.sub(" ", _NOT_WORD.sub(" ", text)).strip()
+    for article in _ARTICLES:
+        if text.startswith(article) and len(text) > len(article):
+            return text[len(article):]
+    return text
+
+
+@lru_cache(maxsize=65536)
+def answer_variants(english):
+    """Normalized accepted answers of a card, computed once per stored translation."""
+    variants = {normalize(english)}
+    variants.update(normalize(part) for part in _MEANING_SEPARATORS.split(english))
+    variants.discard("")
+    return tuple(sorted(variants, key=len))
+
+
+def typo_allowance(text):
+    """Edits tolerated for a "close" answer: none for short words, more for longer ones."""
+    if len(text) <= 3:
+        return 0
+    if len(text) <= 7:
+        return 1
+    return 2
+
+
+def bounded_distance(a, b, limit):
+    """Damerau-Levenshtein (optimal string alignment) distance, or limit + 1 once it exceeds limit.
+
+    Only the band of cells within limit of the diagonal is computed, and the loop
+    stops as soon as a whole row is above limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if a == b:
+        return 0
+    # Shared prefixes and suffixes cost nothing
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    a, b = a[start:], b[start:]
+    while a and b and a[-1] == b[-1]:
+        a, b = a[:-1], b[:-1]
+    if not a or not b:
+        return min(max(len(a), len(b)), limit + 1)
+
+    over = limit + 1
+    width = len(b)
+    previous2 = None
+    previous = [j if j <= limit else over for j in range(width + 1)]
+    for i in range(1, len(a) + 1):
+        low = max(1, i - limit)
+        high = min(width, i + limit)
+        current = [over] * (width + 1)
+        current[0] = i if i <= limit else over
+        row_min = current[0]
+        char = a[i - 1]
+        for j in range(low, high + 1):
+            value = previous[j - 1] if char == b[j - 1] else previous[j - 1] + 1
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if i > 1 and j > 1 and char == b[j - 2] and a[i - 2] == b[j - 1] and previous2[j - 2] + 1 < value:
+                value = previous2[j - 2] + 1
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        # Every later row is at least this row's minimum: give up early
+        if row_min > limit:
+            return over
+        previous2, previous = previous, current
+    return min(previous[-1], over)
+
+
+def grade(answer, english):
+    """Grade a user's answer against a card's stored translation: CORRECT, CLOSE or WRONG."""
+    answer = normalize(answer)
+    if not answer:
+        return WRONG
+    variants = answer_variants(english)
+    if answer in variants:
+        return CORRECT
+    for variant in variants:
+        limit = typo_allowance(variant)
+        if limit and bounded_distance(answer, variant, limit) <= limit:
+            return CLOSE
+    return WRONG
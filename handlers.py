@@ -1,71 +1,96 @@
 # handlers.py
+import os
 import random
-from texts import default_template, language_mode_template
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_ollama import OllamaLLM
+import asyncio
+import tempfile
+from texts import language_mode_template, default_template, followup_template
+from llm_scheduler import scheduler, SchedulerBusy
+from streaming import stream_reply, split_text, EMPTY_ANSWER
+from outbound import outbox, reply, BULK
+from context_builder import build_context, estimate_tokens
+from retention import retention
+from ollama_session import sessions, Generation
+import metrics
+from response_cache import response_cache
+from pagination import render_page, edit_page, decode_cursor
+from flashcard_io import read_deck, write_deck
+from config import (
+    STREAM_REPLIES,
+    FLASHCARD_STUDY_MODE,
+    OLLAMA_MODEL,
+    LIST_PAGE_SIZE,
+    ADMIN_USER_IDS,
+    FLASHCARD_IMPORT_MAX_ROWS,
+    FLASHCARD_IMPORT_MAX_BYTES,
+    CONTEXT_RETRIEVAL,
+)
+from llm import aget_model, aget_default_chain
+from srs import QUALITY_CORRECT, QUALITY_CLOSE, QUALITY_WRONG
+from grading import grade, answer_variants, CORRECT, CLOSE
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
 from data_manager import (
-    save_data,
+    mark_dirty,
     get_user_notes,
+    bulk_upsert_flashcards,
+    add_user_note,
+    delete_user_note,
+    search_user_notes,
     get_flashcards,
-    save_flashcards,
+    add_flashcard,
     delete_flashcard,
+    get_due_flashcards,
+    review_flashcard,
     add_flashcard_interaction,
-    clear_data,
+    get_flashcard_stats,
+    clear_user_data,
     get_conversation_history, 
     get_user_settings,
     add_conversation_turn,
-    user_settings, 
+    preload_user,
 )
 
 # Persistent data file
 DATA_FILE = "bot_data.json"
 
-# Initialize the model
-model = OllamaLLM(model='llama3.2:latest')
-default_prompt = ChatPromptTemplate.from_template(default_template)
-default_chain = default_prompt | model
-
-# Data storage
-conversation_context = {}
-user_notes = {}
-user_settings = {}
-
-# Helper functions: Pass the conversion hitory as a context string 
-def build_history_string(history_list):
-    """Convert the conversation history into a single string."""
-    history_str = ""
-    for turn in history_list:
-        user_text = turn.get("user", "Unknown")
-        ai_text = turn.get("ai", "Unknown")
-        history_str += f"\nUser: {user_text}\nAI: {ai_text}"
-    return history_str
+# Notes listed by /searchnotes
+SEARCH_RESULTS = 10
+
+# The model and default chain are created on first use (see llm.py)
+
+# Runs before every other handler (group -1)
+async def preload_user_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Load the sender's stored data off the event loop before the handlers read it."""
+    if update.effective_user:
+        await preload_user(str(update.effective_user.id))
 
 # Command handlers
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /start command."""
     user_id = str(update.effective_user.id)
-    conversation_context.setdefault(user_id, [])
-    user_settings.setdefault(user_id, {"mode": "normal", "level": "beginner", "topic": "general"})
-    await update.message.reply_text(
+    get_conversation_history(user_id)
+    get_user_settings(user_id)
+    reply(
+        update.message,
         "Hi! 🤖👋🤖 I am your personal productivity assistant, here to make your tasks easier and more organized."
         "If you'd like to explore all the commands and features I offer, simply type /help."
     )
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /help command."""
-    await update.message.reply_text(
+    reply(
+        update.message,
         "Here are the commands you can use, organized by category:\n\n"
         
         "📘 **General Commands:**\n"
         "/start - Start a conversation and initialize settings\n"
         "/help - Show this list of available commands\n"
-        "/clear_data - Clear all saved data, including notes and flashcards\n\n"
+        "/clear_data - Clear all your saved data, including notes and flashcards\n\n"
         
         "📝 **Notes Management:**\n"
         "/note <text> - Save a note\n"
         "/shownotes - Display all saved notes\n"
+        "/searchnotes <words> - Search your notes (word beginnings match too)\n"
         "/delete_note <index> - Delete a specific note by its index\n\n"
         
         "🌍 **Language Learning Mode:**\n"
@@ -75,9 +100,12 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         "📚 **Flashcard Management:**\n"
         "/add_flashcard <Italian> <English> - Add a new flashcard for Italian to English translation\n"
-        "/flashcards_study <number> - Study a specific number of random flashcards\n"
+        "/flashcards_study <number> [srs|random] - Study the flashcards that are due for review (or random ones)\n"
         "/show_flashcards - Show all your saved flashcards\n"
         "/delete_flashcard <Italian word> - Delete a specific flashcard by its Italian word\n"
+        "/import_flashcards - Import flashcards from a CSV/TSV file\n"
+        "/export_flashcards - Download your flashcards as a CSV file\n"
+        "/flashcard_stats - Show how well you know your flashcards\n"
     )
 
 async def clear_data_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -87,7 +115,8 @@ async def clear_data_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Save that the user is being asked for confirmation
     context.user_data["clear_data_confirmation"] = True
     
-    await update.message.reply_text(
+    reply(
+        update.message,
         "⚠️ Are you sure you want to delete all your data? This action cannot be undone.\n"
         "This will clear all your notes and flashcards.\n\n"
         "Please type 'YES' to confirm or 'NO' to cancel."
@@ -102,17 +131,20 @@ async def handle_clear_data_confirmation(update: Update, context: ContextTypes.D
     # Check if the user is in the confirmation state
     if context.user_data.get("clear_data_confirmation"):
         if confirmation == "YES":
-            # Clear all data and reset the confirmation state
-            clear_data()
+            # Clear this user's data and reset the confirmation state
+            clear_user_data(user_id)
             context.user_data["clear_data_confirmation"] = False
-            await update.message.reply_text("✅ All your data has been cleared.")
+            reply(update.message, "✅ All your data has been cleared.")
+            # Archived history too (may take a moment with a large archive)
+            await retention.purge_user(user_id)
         elif confirmation == "NO":
             # Reset the confirmation state and cancel the operation
             context.user_data["clear_data_confirmation"] = False
-            await update.message.reply_text("❌ Data clearing operation canceled.")
+            reply(update.message, "❌ Data clearing operation canceled.")
         else:
             # Ask again if the response is invalid
-            await update.message.reply_text(
+            reply(
+                update.message,
                 "⚠️ Invalid response. Please type 'YES' to confirm or 'NO' to cancel."
             )
     
@@ -125,13 +157,11 @@ async def note_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     note_text = ' '.join(context.args).strip()
     if not note_text:
-        await update.message.reply_text("Please provide some text after /note to save it.")
+        reply(update.message, "Please provide some text after /note to save it.")
         return
     # Add note to the user's notes
-    user_notes = get_user_notes(user_id)
-    user_notes.append(note_text)
-    save_data()  # Persist the updated data
-    await update.message.reply_text(f"Note saved! You now have {len(user_notes)} notes.")
+    add_user_note(user_id, note_text)
+    reply(update.message, f"Note saved! You now have {len(get_user_notes(user_id))} notes.")
 
 async def shownotes_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /shownotes command."""
@@ -141,10 +171,66 @@ async def shownotes_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     notes = get_user_notes(user_id)
 
     if not notes:
-        await update.message.reply_text("You have no notes saved.")
+        reply(update.message, "You have no notes saved.")
     else:
-        notes_str = "\n".join([f"{idx + 1}. {note}" for idx, note in enumerate(notes)])
-        await update.message.reply_text(f"Here are your saved notes:\n{notes_str}")
+        text, markup = _notes_page(user_id, 0)
+        reply(update.message, text, reply_markup=markup)
+
+
+def _notes_page(user_id, offset):
+    notes = get_user_notes(user_id)
+    return render_page("notes", user_id, "Here are your saved notes", notes, len(notes), offset, LIST_PAGE_SIZE, str)
+
+
+def _flashcards_page(user_id, offset):
+    cards = get_flashcards(user_id)
+    return render_page(
+        "flashcards", user_id, "Here are your flashcards", cards.items(), len(cards), offset, LIST_PAGE_SIZE,
+        lambda card: f"{card[0]} -> {card[1]}",
+    )
+
+
+async def page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the Prev/Next buttons of /shownotes and /show_flashcards."""
+    query = update.callback_query
+    cursor = decode_cursor(query.data)
+    if cursor is None:
+        await query.answer()
+        return
+    kind, offset, user_id = cursor
+    # In a group, anyone can press the buttons under someone else's list
+    if user_id != str(update.effective_user.id):
+        await query.answer("Only the person who opened this list can turn its pages.", show_alert=True)
+        return
+    await query.answer()
+    if kind == "notes":
+        if not get_user_notes(user_id):
+            await edit_page(query, "You have no notes saved.", None)
+            return
+        text, markup = _notes_page(user_id, offset)
+    elif kind == "flashcards":
+        if not get_flashcards(user_id):
+            await edit_page(query, "You have no flashcards saved.", None)
+            return
+        text, markup = _flashcards_page(user_id, offset)
+    else:
+        return
+    await edit_page(query, text, markup)
+
+
+async def searchnotes_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /searchnotes command."""
+    user_id = str(update.effective_user.id)
+    query = ' '.join(context.args).strip()
+    if not query:
+        reply(update.message, "Please provide some words to search for. For example: /searchnotes verbs")
+        return
+    results = search_user_notes(user_id, query, limit=SEARCH_RESULTS)
+    if not results:
+        reply(update.message, f"No notes match \"{query}\".")
+        return
+    lines = "\n".join(f"{idx + 1}. {note}" for idx, note in results)
+    reply(update.message, split_text(f"Notes matching \"{query}\":\n{lines}")[0])
 
 
 async def delete_note_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -152,36 +238,36 @@ async def delete_note_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     user_id = str(update.effective_user.id)
     user_notes = get_user_notes(user_id)
     if not user_notes:
-        await update.message.reply_text("You have no notes to delete.")
+        reply(update.message, "You have no notes to delete.")
         return
     if len(context.args) != 1 or not context.args[0].isdigit():
-        await update.message.reply_text("Please provide the index of the note to delete. For example: /delete_note 1")
+        reply(update.message, "Please provide the index of the note to delete. For example: /delete_note 1")
         return
     index = int(context.args[0]) - 1  # Convert 1-based index to 0-based
     if 0 <= index < len(user_notes):
-        deleted_note = user_notes.pop(index)
-        save_data()  # Persist the updated data
-        await update.message.reply_text(f"Deleted note: {deleted_note}")
+        deleted_note = delete_user_note(user_id, index)
+        reply(update.message, f"Deleted note: {deleted_note}")
     else:
-        await update.message.reply_text(f"Invalid index. Please provide a number between 1 and {len(user_notes)}.")
+        reply(update.message, f"Invalid index. Please provide a number between 1 and {len(user_notes)}.")
 
 async def language_mode_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /language_mode command."""
     user_id = str(update.effective_user.id)
     if len(context.args) < 2:
-        await update.message.reply_text("Please specify a level and a topic. e.g.: /language_mode beginner travel")
+        reply(update.message, "Please specify a level and a topic. e.g.: /language_mode beginner travel")
         return
     level = context.args[0].lower()
     topic = ' '.join(context.args[1:]).lower()
     # Validate level
     if level not in ["beginner", "intermediate", "advanced"]:
-        await update.message.reply_text("Level must be one of: beginner, intermediate, advanced.")
+        reply(update.message, "Level must be one of: beginner, intermediate, advanced.")
         return
     # Update and save user settings
     settings = get_user_settings(user_id)
     settings.update({"mode": "language_learning", "level": level, "topic": topic})
-    save_data()
-    await update.message.reply_text(
+    mark_dirty(user_id, "user_settings")
+    reply(
+        update.message,
             f"🌟 Language learning mode activated! 🌟\n"
             f"Level: {level.capitalize()}\n"
             f"Topic: {topic.capitalize()}\n\n"
@@ -191,7 +277,7 @@ async def language_mode_command(update: Update, context: ContextTypes.DEFAULT_TY
             "Let's get started! 😊"
     )
 
-from data_manager import get_user_settings, save_data
+from data_manager import get_user_settings, mark_dirty
 
 async def exit_language_mode_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /exit_language_mode command."""
@@ -202,51 +288,122 @@ async def exit_language_mode_command(update: Update, context: ContextTypes.DEFAU
 
     # Check if the mode is already normal
     if settings["mode"] == "normal":
-        await update.message.reply_text("You are already in the normal assistant mode!")
+        reply(update.message, "You are already in the normal assistant mode!")
         return
 
     # Update settings and save
     settings["mode"] = "normal"
     settings["level"] = "beginner"
     settings["topic"] = "general"
-    save_data()
+    mark_dirty(user_id, "user_settings")
 
-    await update.message.reply_text(
+    reply(
+        update.message,
         "You've successfully exited language learning mode. Welcome back to normal assistant mode! 😊 Let me know how I can assist you next."
 )
 
+async def relevant_turns(user_id, question):
+    """Past turns picked by retrieval, or None when it is off."""
+    if not CONTEXT_RETRIEVAL:
+        return None
+    # Imported on first use: retrieval loads numpy, which the bot does not need otherwise
+    from retrieval import retriever
+    return await retriever.relevant_turns(user_id, question)
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     user_input = update.message.text
     # Retrieve or initialize settings
     settings = get_user_settings(user_id)
     mode = settings.get("mode", "normal")
-    # Generate response
+    level = settings["level"]
+    topic = settings["topic"]
+
     if mode == "language_learning":
-        level = settings["level"]
-        topic = settings["topic"]
-        ai_response = model.invoke(language_mode_template.format(level=level, topic=topic, user_sentence=user_input))
-    else:
-        history_str = build_history_string(get_conversation_history(user_id))
-        ai_response = default_chain.invoke({'context': history_str, 'question': user_input})
-    # Save to conversation history
-    add_conversation_turn(user_id, user_input, ai_response)
-    # Send response to user
-    await update.message.reply_text(ai_response)
+        # Corrections depend only on level, topic and sentence, so repeated sentences are served from the cache
+        cache_key = response_cache.make_key(level, topic, user_input, OLLAMA_MODEL, language_mode_template)
+        ai_response = response_cache.get(cache_key)
+        # An empty answer may still be in a cache file written before empty answers were skipped
+        if ai_response is not None and not ai_response.strip():
+            ai_response = None
+        if ai_response is not None:
+            add_conversation_turn(user_id, user_input, ai_response)
+            reply(update.message, ai_response)
+            return
+
+    async def generate():
+        # Runs when the scheduler gives this user a slot, so the history includes earlier queued turns
+        generation = None
+        if mode == "language_learning":
+            runnable = await aget_model()
+            inputs = language_mode_template.format(level=level, topic=topic, user_sentence=user_input)
+            prompt_text = inputs
+        elif sessions.enabled:
+            # Incremental mode: after our own last answer the model's context already holds the conversation
+            context_tokens = sessions.reusable_context(user_id)
+            if context_tokens is not None:
+                prompt_text = followup_template.format(question=user_input)
+            else:
+                relevant = await relevant_turns(user_id, user_input)
+                history_str = build_context(user_id, await aget_model(), relevant)
+                prompt_text = default_template.format(context=history_str, question=user_input)
+            generation = Generation(prompt_text, context_tokens)
+        else:
+            # Rolling summary plus the newest turns that fit the token budget (or the most relevant ones)
+            relevant = await relevant_turns(user_id, user_input)
+            history_str = build_context(user_id, await aget_model(), relevant)
+            runnable = await aget_default_chain()
+            inputs = {'context': history_str, 'question': user_input}
+            prompt_text = history_str + user_input
+        kind = "language" if mode == "language_learning" else "chat"
+        if metrics.enabled:
+            metrics.observe("prompt_chars", len(prompt_text), metrics.SIZE_BUCKETS, kind=kind)
+            metrics.observe("prompt_tokens", estimate_tokens(prompt_text), metrics.SIZE_BUCKETS, kind=kind)
+        with metrics.timer("llm_request_seconds", kind=kind):
+            if generation is not None:
+                if STREAM_REPLIES:
+                    ai_response = await stream_reply(update.message, generation.stream())
+                else:
+                    ai_response = await generation.text()
+            elif STREAM_REPLIES:
+                # Send response to user while it is being generated
+                ai_response = await stream_reply(update.message, runnable.astream(inputs))
+            else:
+                ai_response = await runnable.ainvoke(inputs)
+        if not ai_response.strip():
+            # Not cached or kept in the history: every later identical question would get the empty answer
+            return ai_response
+        if mode == "language_learning":
+            response_cache.put(cache_key, ai_response)
+        # Save the final text to conversation history
+        add_conversation_turn(user_id, user_input, ai_response)
+        if generation is not None:
+            sessions.save(user_id, generation.context)
+        return ai_response
+
+    # Generate response
+    try:
+        ai_response = await scheduler.submit(user_id, generate)
+    except SchedulerBusy:
+        metrics.inc("llm_rejected_total")
+        reply(update.message, "⏳ I'm handling a lot of requests right now. Please try again in a moment.")
+        return
+    if not STREAM_REPLIES:
+        # Send response to user
+        reply(update.message, ai_response if ai_response.strip() else EMPTY_ANSWER)
 
 # Flashcards Management
 
 async def add_flashcard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     if len(context.args) < 2:
-        await update.message.reply_text("Usage: /add_flashcard <Italian> <English>")
+        reply(update.message, "Usage: /add_flashcard <Italian> <English>")
         return
     italian_word = context.args[0].strip().lower()
     english_word = " ".join(context.args[1:]).strip().lower()
-    user_flashcards = get_flashcards(user_id)
-    user_flashcards[italian_word] = english_word
-    save_flashcards(user_id, user_flashcards)
-    await update.message.reply_text(f"Flashcard added: {italian_word} -> {english_word}")
+    add_flashcard(user_id, italian_word, english_word)
+    reply(update.message, f"Flashcard added: {italian_word} -> {english_word}")
 
 # Define conversation state for flashcard study
 
@@ -257,22 +414,36 @@ async def flashcards_study_command(update: Update, context: ContextTypes.DEFAULT
     user_id = str(update.effective_user.id)
     # Check if a session is already active
     if "flashcard_session" in context.user_data:
-        await update.message.reply_text(
+        reply(
+            update.message,
             "You already have an active flashcard study session. Use /cancel_flashcards_study to end it."
         )
         return ConversationHandler.END
-    try:
-        num_words = int(context.args[0]) if context.args else 10
-    except ValueError:
-        await update.message.reply_text("Please provide a valid number. Example: /flashcards_study 10")
-        return ConversationHandler.END
+    num_words = 10
+    study_mode = FLASHCARD_STUDY_MODE
+    for arg in context.args:
+        if arg.lower() in ("srs", "random"):
+            study_mode = arg.lower()
+            continue
+        try:
+            num_words = int(arg)
+        except ValueError:
+            reply(update.message, "Please provide a valid number. Example: /flashcards_study 10 (add 'random' or 'srs' to pick the mode)")
+            return ConversationHandler.END
     # Load flashcards
     flashcards = get_flashcards(user_id)
     if not flashcards:
-        await update.message.reply_text("No flashcards available. Add flashcards using /add_flashcard.")
+        reply(update.message, "No flashcards available. Add flashcards using /add_flashcard.")
         return ConversationHandler.END
-    # Select random flashcards
-    selected_flashcards = random.sample(list(flashcards.items()), min(num_words, len(flashcards)))
+    if study_mode == "random":
+        # Select random flashcards
+        selected_flashcards = random.sample(list(flashcards.items()), min(num_words, len(flashcards)))
+    else:
+        # Spaced repetition: cards whose review is due first
+        selected_flashcards = get_due_flashcards(user_id, num_words)
+    # Prepare the accepted answers now, so grading each response is only a lookup
+    for _, english in selected_flashcards:
+        answer_variants(english)
     # Initialize session data
     context.user_data["flashcard_session"] = {
         "flashcards": selected_flashcards,
@@ -281,31 +452,40 @@ async def flashcards_study_command(update: Update, context: ContextTypes.DEFAULT
     }
     # Start the first flashcard
     italian, english = selected_flashcards[0]
-    await update.message.reply_text(f"Flashcard 1/{len(selected_flashcards)}: What does '{italian}' mean?")
+    reply(update.message, f"Flashcard 1/{len(selected_flashcards)}: What does '{italian}' mean?")
     return FLASHCARD
 
 async def handle_flashcard_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the user's response to a flashcard."""
     session = context.user_data.get("flashcard_session")
     if not session:
-        await update.message.reply_text("No active flashcard study session. Use /flashcards_study to start.")
+        reply(update.message, "No active flashcard study session. Use /flashcards_study to start.")
         return ConversationHandler.END
     user_response = update.message.text.strip().lower()
     user_id = str(update.effective_user.id)
     # Get the current flashcard
     italian, english = session["flashcards"][session["current_index"]]
-    if user_response == english.lower():
-        await update.message.reply_text("Correct! 🎉")
+    result = grade(user_response, english)
+    if result == CORRECT:
+        reply(update.message, "Correct! 🎉")
+        session["correct_count"] += 1
+        add_flashcard_interaction(user_id, {italian: english}, user_response, True)
+        review_flashcard(user_id, italian, QUALITY_CORRECT)
+    elif result == CLOSE:
+        reply(update.message, f"Almost! Watch the spelling: '{english}'.")
         session["correct_count"] += 1
         add_flashcard_interaction(user_id, {italian: english}, user_response, True)
+        review_flashcard(user_id, italian, QUALITY_CLOSE)
     else:
-        await update.message.reply_text(f"Wrong! The correct answer is '{english}'.")
+        reply(update.message, f"Wrong! The correct answer is '{english}'.")
         add_flashcard_interaction(user_id, {italian: english}, user_response, False)
+        review_flashcard(user_id, italian, QUALITY_WRONG)
     # Move to the next flashcard
     session["current_index"] += 1
     if session["current_index"] < len(session["flashcards"]):
         italian, english = session["flashcards"][session["current_index"]]
-        await update.message.reply_text(
+        reply(
+            update.message,
             f"Flashcard {session['current_index'] + 1}/{len(session['flashcards'])}: What does '{italian}' mean?"
         )
         return FLASHCARD
@@ -314,16 +494,16 @@ async def handle_flashcard_response(update: Update, context: ContextTypes.DEFAUL
         correct_count = session["correct_count"]
         total = len(session["flashcards"])
         del context.user_data["flashcard_session"]
-        await update.message.reply_text(f"Study session complete! You got {correct_count}/{total} correct.")
+        reply(update.message, f"Study session complete! You got {correct_count}/{total} correct.")
         return ConversationHandler.END
 
 async def cancel_flashcards_study(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel the flashcard study session."""
     if "flashcard_session" in context.user_data:
         del context.user_data["flashcard_session"]
-        await update.message.reply_text("Flashcard study session canceled.")
+        reply(update.message, "Flashcard study session canceled.")
     else:
-        await update.message.reply_text("No active flashcard study session to cancel.")
+        reply(update.message, "No active flashcard study session to cancel.")
     return ConversationHandler.END
 
 
@@ -333,23 +513,117 @@ async def show_flashcards_command(update: Update, context: ContextTypes.DEFAULT_
     flashcards = get_flashcards(user_id)
 
     if not flashcards:
-        await update.message.reply_text("You have no flashcards saved. Add some using /add_flashcard <Italian> <English>.")
+        reply(update.message, "You have no flashcards saved. Add some using /add_flashcard <Italian> <English>.")
         return
 
-    # Format the flashcards for display
-    flashcards_str = "\n".join([f"{idx + 1}. {italian} -> {english}" for idx, (italian, english) in enumerate(flashcards.items())])
-    await update.message.reply_text(f"Here are your flashcards:\n{flashcards_str}")
+    # Format the first page of flashcards for display
+    text, markup = _flashcards_page(user_id, 0)
+    reply(update.message, text, reply_markup=markup)
 
 async def delete_flashcard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     if len(context.args) != 1:
-        await update.message.reply_text("Usage: /delete_flashcard <Italian word>")
+        reply(update.message, "Usage: /delete_flashcard <Italian word>")
         return
     italian_word = context.args[0].strip().lower()
-    user_flashcards = get_flashcards(user_id)
-    if italian_word in user_flashcards:
-        del user_flashcards[italian_word]
-        save_flashcards(user_id, user_flashcards)
-        await update.message.reply_text(f"Flashcard '{italian_word}' has been deleted.")
+    if delete_flashcard(user_id, italian_word):
+        reply(update.message, f"Flashcard '{italian_word}' has been deleted.")
     else:
-        await update.message.reply_text(f"Flashcard '{italian_word}' not found.")
+        reply(update.message, f"Flashcard '{italian_word}' not found.")
+
+async def import_flashcards_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /import_flashcards command: the next document the user sends is imported."""
+    context.user_data["awaiting_flashcard_import"] = True
+    reply(
+        update.message,
+        "Send me a CSV or TSV file with one flashcard per row: <Italian>,<English>.\n"
+        "Existing words get the new translation. A header row is optional."
+    )
+
+async def handle_flashcard_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Import the uploaded document after /import_flashcards."""
+    user_id = str(update.effective_user.id)
+    if not context.user_data.pop("awaiting_flashcard_import", False):
+        reply(update.message, "To import flashcards from a file, send /import_flashcards first.")
+        return
+    document = update.message.document
+    if document.file_size and document.file_size > FLASHCARD_IMPORT_MAX_BYTES:
+        reply(
+            update.message,
+            f"The file is too large (limit {FLASHCARD_IMPORT_MAX_BYTES // (1024 * 1024)} MB)."
+        )
+        return
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+        # Parsing a large file is blocking work: keep it off the event loop
+        loop = asyncio.get_running_loop()
+        deck, stats = await loop.run_in_executor(None, read_deck, path, FLASHCARD_IMPORT_MAX_ROWS)
+    except Exception as e:
+        print(f"Failed to import flashcards for user {user_id}: {e}")
+        reply(update.message, "Sorry, I couldn't read that file. Please send a UTF-8 CSV or TSV file.")
+        return
+    finally:
+        os.remove(path)
+    added, updated = bulk_upsert_flashcards(user_id, deck)
+    summary = (
+        f"Import finished: {added} added, {updated} updated, {stats['rejected']} rejected"
+        f" ({stats['duplicates']} duplicate rows)."
+    )
+    if stats["truncated"]:
+        summary += f"\nOnly the first {FLASHCARD_IMPORT_MAX_ROWS} rows were read."
+    reply(update.message, summary)
+
+async def export_flashcards_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send the user's flashcards as a CSV document."""
+    user_id = str(update.effective_user.id)
+    cards = get_flashcards(user_id)
+    if not cards:
+        reply(update.message, "You have no flashcards saved. Add some using /add_flashcard <Italian> <English>.")
+        return
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        # Rows are written straight from the deck; the user's updates run one at a time,
+        # so it does not change while the file is written
+        loop = asyncio.get_running_loop()
+        count = await loop.run_in_executor(None, write_deck, path, cards.items())
+        with open(path, "rb") as f:
+            # Bulk lane: the file waits behind other users' interactive replies
+            await outbox.send(
+                update.message.chat_id, update.message.reply_document, f,
+                filename="flashcards.csv", caption=f"{count} flashcards", lane=BULK,
+            )
+    finally:
+        os.remove(path)
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /stats command (admins only): latency, prompt size and queue metrics."""
+    user_id = str(update.effective_user.id)
+    if user_id not in ADMIN_USER_IDS:
+        reply(update.message, "This command is only available to the bot administrators.")
+        return
+    reply(update.message, split_text(metrics.summary())[0])
+
+async def flashcard_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the user's flashcard results from the per-card aggregates."""
+    user_id = str(update.effective_user.id)
+    stats = get_flashcard_stats(user_id)
+    if not stats:
+        reply(update.message, "No flashcard answers yet. Start studying with /flashcards_study.")
+        return
+    attempts = sum(card["attempts"] for card in stats.values())
+    correct = sum(card["correct"] for card in stats.values())
+    # Weakest cards first: lowest share of correct answers, then most attempts
+    weakest = sorted(stats.items(), key=lambda item: (item[1]["correct"] / item[1]["attempts"], -item[1]["attempts"]))[:10]
+    lines = [
+        f"{italian}: {card['correct']}/{card['attempts']} correct"
+        for italian, card in weakest
+    ]
+    reply(
+        update.message,
+        f"📊 Flashcard stats: {attempts} answers on {len(stats)} cards, {correct * 100 // attempts}% correct.\n\n"
+        "Cards to practice:\n" + "\n".join(lines)
+    )
@@ -0,0 +1,146 @@
+# journal.py
+import os
+import copy
+import json
+
+
+def apply_ops(sections, ops):
+    """Apply journaled operations to the section dicts.
+
+    Operations are dicts with an "op" key:
+    - append:  sections[section][user] (a list) gets value appended
+    - set:     sections[section][user][key] = value
+    - unset:   key is removed from sections[section][user]
+    - replace: sections[section][user] = value (removed if value is None)
+    - trim:    the first `count` entries of sections[section][user] are removed
+    - clear:   the user's records are removed from every section
+    - put:     the user's records are replaced by value ({section: value}, as stored by the backend)
+
+    Values are copied when they are stored: the ops applied after them change the lists
+    and dicts in place, and the same ops may be applied again (see snapshot.py).
+    """
+    for op in ops:
+        kind = op["op"]
+        if kind == "append":
+            sections[op["section"]].setdefault(op["user"], []).append(op["value"])
+        elif kind == "set":
+            sections[op["section"]].setdefault(op["user"], {})[op["key"]] = copy.deepcopy(op["value"])
+        elif kind == "unset":
+            sections[op["section"]].get(op["user"], {}).pop(op["key"], None)
+        elif kind == "replace":
+            if op["value"] is None:
+                sections[op["section"]].pop(op["user"], None)
+            else:
+                sections[op["section"]][op["user"]] = copy.deepcopy(op["value"])
+        elif kind == "trim":
+            entries = sections[op["section"]].get(op["user"])
+            if entries:
+                del entries[:op["count"]]
+        elif kind == "clear":
+            for section in sections.values():
+                section.pop(op["user"], None)
+        elif kind == "put":
+            for name, section in sections.items():
+                section.pop(op["user"], None)
+                if name in op["value"]:
+                    section[op["user"]] = copy.deepcopy(op["value"][name])
+
+
+class Journal:
+    """Append-only JSON Lines log of small changes, folded into the snapshot on compaction.
+
+    Every line is {"seq": n, "ops": [...]}. A snapshot records the last seq it contains, so
+    replaying skips records that are already in it. While a snapshot is being written, the
+    journal is rotated to <path>.old, which is removed once the snapshot is on disk.
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.old_path = path + ".old"
+        self.fsync = fsync
+        self.seq = 0
+        self._file = None
+        self.stats = {"appends": 0, "bytes": 0, "compactions": 0, "replayed": 0, "torn_records": 0}
+
+    def _read(self, path, after_seq):
+        """Yield the ops of the records in path with a seq above after_seq, truncating a torn tail.
+
+        Only the last record can be torn. A record that cannot be read in the middle of the
+        file raises ValueError, and the file is left as it is so it can be repaired.
+        """
+        if not os.path.exists(path):
+            return
+        good_offset = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("record without newline")
+                    record = json.loads(line)
+                except ValueError:
+                    if f.read(1):
+                        # Not a torn append: dropping the records after it would lose them
+                        raise ValueError(
+                            f"{path} has an unreadable record at byte {good_offset} followed by more records; "
+                            "repair or move the file aside before starting"
+                        ) from None
+                    # A crash in the middle of an append leaves a partial last record
+                    self.stats["torn_records"] += 1
+                    break
+                good_offset += len(line)
+                self.seq = max(self.seq, record["seq"])
+                if record["seq"] > after_seq:
+                    self.stats["replayed"] += 1
+                    yield record["ops"]
+        if good_offset < os.path.getsize(path):
+            with open(path, "r+b") as f:
+                f.truncate(good_offset)
+
+    def replay(self, after_seq):
+        """Yield the ops recorded after the snapshot (seq after_seq), oldest first."""
+        self.seq = max(self.seq, after_seq)
+        yield from self._read(self.old_path, after_seq)
+        yield from self._read(self.path, after_seq)
+
+    def open(self):
+        """Open the journal for appending (after replay)."""
+        self._file = open(self.path, "ab")
+
+    def append(self, ops):
+        """Write one record with a new sequence number: a single small sequential write."""
+        self.seq += 1
+        line = json.dumps({"seq": self.seq, "ops": ops}, separators=(",", ":")).encode() + b"\n"
+        self._file.write(line)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.stats["appends"] += 1
+        self.stats["bytes"] += len(line)
+
+    def size(self):
+        """Bytes appended since the last rotation."""
+        return self._file.tell() if self._file else 0
+
+    def rotate(self):
+        """Move the current records aside before a snapshot is written; returns the snapshot's seq."""
+        self._file.close()
+        if os.path.exists(self.old_path):
+            # The previous snapshot was not written: keep its records too
+            with open(self.old_path, "ab") as old, open(self.path, "rb") as current:
+                old.write(current.read())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.old_path)
+        self.open()
+        return self.seq
+
+    def discard_rotated(self):
+        """Drop the rotated records once a snapshot containing them is on disk."""
+        if os.path.exists(self.old_path):
+            os.remove(self.old_path)
+        self.stats["compactions"] += 1
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,81 @@
+# llm.py
+import time
+import asyncio
+import threading
+from texts import default_template
+from config import OLLAMA_MODEL, OLLAMA_KEEP_ALIVE
+
+# Built on first use: importing langchain and creating the model is slow
+_model = None
+_default_chain = None
+_init_lock = threading.Lock()
+
+
+def get_model():
+    """Return the Ollama model, creating it (and importing langchain_ollama) on first use."""
+    global _model
+    with _init_lock:
+        if _model is None:
+            from langchain_ollama import OllamaLLM
+            _model = OllamaLLM(model=OLLAMA_MODEL, keep_alive=OLLAMA_KEEP_ALIVE)
+    return _model
+
+
+def get_default_chain():
+    """Return the default assistant chain (prompt | model), creating it on first use."""
+    global _default_chain
+    model = get_model()
+    with _init_lock:
+        if _default_chain is None:
+            from langchain_core.prompts import ChatPromptTemplate
+            _default_chain = ChatPromptTemplate.from_template(default_template) | model
+    return _default_chain
+
+
+def set_model(model, chain=None):
+    """Use model (and chain, default: the model itself) instead of Ollama, e.g. a stub in benchmarks."""
+    global _model, _default_chain
+    with _init_lock:
+        _model = model
+        _default_chain = chain if chain is not None else model
+
+
+async def aget_model():
+    """Like get_model(), but a first-time initialization runs in a thread instead of the event loop."""
+    if _model is not None:
+        return _model
+    return await asyncio.get_running_loop().run_in_executor(None, get_model)
+
+
+async def aget_default_chain():
+    """Like get_default_chain(), but a first-time initialization runs in a thread."""
+    if _default_chain is not None:
+        return _default_chain
+    return await asyncio.get_running_loop().run_in_executor(None, get_default_chain)
+
+
+async def warm_up():
+    """Import the LLM stack, load the model into Ollama and run a tiny priming prompt.
+
+    Returns the duration of each phase in seconds.
+    """
+    timings = {}
+    loop = asyncio.get_running_loop()
+
+    started = time.perf_counter()
+    # The imports are synchronous, so they run in a thread while the bot is already polling
+    await loop.run_in_executor(None, get_default_chain)
+    timings["llm_import"] = time.perf_counter() - started
+
+    from ollama import AsyncClient
+    client = AsyncClient()
+
+    started = time.perf_counter()
+    # An empty prompt only loads the weights; keep_alive keeps them in memory afterwards
+    await client.generate(model=OLLAMA_MODEL, prompt="", keep_alive=OLLAMA_KEEP_ALIVE)
+    timings["model_load"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await client.generate(model=OLLAMA_MODEL, prompt="Hi", options={"num_predict": 1}, keep_alive=OLLAMA_KEEP_ALIVE)
+    timings["priming"] = time.perf_counter() - started
+    return timings
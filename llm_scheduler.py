@@ -0,0 +1,122 @@
+# llm_scheduler.py
+import time
+import asyncio
+from collections import OrderedDict, deque
+import metrics
+from config import OLLAMA_MAX_CONCURRENCY, LLM_QUEUE_SIZE
+
+
+class SchedulerBusy(Exception):
+    """Raised when the LLM request queue is full."""
+
+
+class LLMScheduler:
+    """Run LLM jobs with a global concurrency cap, one job in flight per user and round-robin fairness."""
+
+    def __init__(self, max_concurrency, max_queue):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        # user_id -> deque of (future, job, enqueued_at); order of the dict is the round-robin order
+        self._queues = OrderedDict()
+        self._busy_users = set()
+        self._tasks = set()
+        self._queued = 0
+        self.stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "last_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "total_wait_seconds": 0.0,
+        }
+
+    @property
+    def queue_depth(self):
+        """Number of jobs waiting for a slot."""
+        return self._queued
+
+    @property
+    def running(self):
+        """Number of jobs currently running."""
+        return len(self._busy_users)
+
+    def snapshot(self):
+        """Return the counters together with the current queue depth and running jobs."""
+        return {**self.stats, "queue_depth": self.queue_depth, "running": self.running}
+
+    async def submit(self, user_id, job):
+        """Queue job (a no-argument coroutine function) for user_id and return its result."""
+        if self._queued >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise SchedulerBusy()
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user_id, deque()).append((future, job, time.perf_counter()))
+        self._queued += 1
+        self.stats["submitted"] += 1
+        self._dispatch()
+        return await future
+
+    def _next_job(self):
+        """Pop the next job of the first idle user in round-robin order."""
+        for user_id, queue in self._queues.items():
+            if user_id in self._busy_users:
+                continue
+            while queue:
+                future, job, enqueued_at = queue.popleft()
+                self._queued -= 1
+                if not future.cancelled():
+                    break
+            else:
+                future = None
+            if queue:
+                # The user goes to the back of the line for its next job
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            if future is not None:
+                return user_id, future, job, enqueued_at
+            # Every queued job of this user was cancelled; the dict changed, so start over
+            return self._next_job()
+        return None
+
+    def _dispatch(self):
+        """Start queued jobs while there are free slots."""
+        while len(self._busy_users) < self.max_concurrency:
+            entry = self._next_job()
+            if entry is None:
+                return
+            user_id, future, job, enqueued_at = entry
+            waited = time.perf_counter() - enqueued_at
+            self.stats["last_wait_seconds"] = waited
+            self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], waited)
+            self.stats["total_wait_seconds"] += waited
+            metrics.observe("llm_wait_seconds", waited)
+            self._busy_users.add(user_id)
+            task = asyncio.get_running_loop().create_task(self._run(user_id, future, job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, user_id, future, job):
+        try:
+            result = await job()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            self.stats["failed"] += 1
+            if not future.cancelled():
+                future.set_exception(e)
+        else:
+            self.stats["completed"] += 1
+            if not future.cancelled():
+                future.set_result(result)
+        finally:
+            self._busy_users.discard(user_id)
+            self._dispatch()
+
+
+# Shared scheduler for every LLM call made by the handlers
+scheduler = LLMScheduler(OLLAMA_MAX_CONCURRENCY, LLM_QUEUE_SIZE)
+metrics.gauge_callback("llm_running", lambda: scheduler.running)
+metrics.gauge_callback("llm_queue_depth", lambda: scheduler.queue_depth)
@@ -1,12 +1,44 @@
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, Defaults, ConversationHandler
-from data_manager import load_data
+import time
+_process_started = time.perf_counter()
+
+import signal
+import asyncio
+from telegram import Update
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, CallbackQueryHandler, filters, Defaults, ConversationHandler
+from data_manager import load_data, start_persistence, stop_persistence
+from response_cache import response_cache
+from llm import warm_up
+from update_processor import PerUserUpdateProcessor
+from pagination import CALLBACK_PREFIX
+from outbound import OutboundRateLimiter, outbox
+import retention
+from workers import WorkerPool, ShardingUpdateProcessor, check_shard_count, seed_shards, serve_shard
+import metrics
+from config import (
+    BOT_MODE,
+    MAX_CONCURRENT_UPDATES,
+    WEBHOOK_URL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET_TOKEN,
+    METRICS_LISTEN,
+    METRICS_PORT,
+    WORKER_PROCESSES,
+)
 from dotenv import load_dotenv
 import os
 from handlers import (
+    preload_user_handler,
     start_command,
     help_command,
     note_command,
     shownotes_command,
+    searchnotes_command,
+    page_callback,
+    import_flashcards_command,
+    export_flashcards_command,
+    handle_flashcard_document,
     delete_note_command,
     clear_data_command,
     handle_clear_data_confirmation,
@@ -18,17 +50,21 @@ from handlers import (
     cancel_flashcards_study,
     show_flashcards_command,
     delete_flashcard_command,
+    flashcard_stats_command,
+    stats_command,
     handle_flashcard_response,
     cancel_flashcards_study,
     handle_message,
 )
 
+# Duration of each startup phase, in seconds
+startup_timings = {"imports": time.perf_counter() - _process_started}
+_warm_up_task = None
+
 # Load environment variables from .env file
 load_dotenv()
 
 TOKEN = os.getenv("TELEGRAM_API_KEY")
-if not TOKEN:
-    raise ValueError("Missing TELEGRAM_API_KEY in .env file")
 
 # BOT_USERNAME = '@Soft_Eng_Project_Bot'
 FLASHCARD = range(1)
@@ -43,19 +79,72 @@ flashcards_handler = ConversationHandler(
 )
 
 
-def main():
-    """Start the Telegram bot."""
-    print("Starting Telegram bot...")
-    load_data()
+def print_startup_report(title, phases):
+    """Print the duration of the given startup phases on one line."""
+    report = " | ".join(f"{phase.replace('_', ' ')} {startup_timings[phase]:.2f}s" for phase in phases)
+    print(f"{title}: {report}")
+
+
+async def warm_up_model():
+    """Load the model in the background so the first user message does not pay for it."""
+    try:
+        startup_timings.update(await warm_up())
+    except Exception as e:
+        print(f"Model warm-up failed, the model will load on first use: {e}")
+        return
+    print_startup_report("Model warm-up", ["llm_import", "model_load", "priming"])
+
+
+async def post_init(application: Application):
+    """Start background services once the event loop is running."""
+    global _warm_up_task
+    start_persistence()
+    # Enforce the history limits in the background (only if a limit is configured)
+    retention.schedule(application)
+    await metrics.start_server(METRICS_LISTEN, METRICS_PORT)
+    _warm_up_task = asyncio.get_running_loop().create_task(warm_up_model())
+    startup_timings["ready"] = time.perf_counter() - _process_started
+    print_startup_report("Startup", ["imports", "data_load", "ready"])
+
+
+async def post_stop(application: Application):
+    """Send the replies still queued in the outbox while the bot can still send."""
+    await outbox.drain()
+
+
+async def post_shutdown(application: Application):
+    """Flush pending data before the process exits."""
+    if _warm_up_task is not None and not _warm_up_task.done():
+        _warm_up_task.cancel()
+    await stop_persistence()
+    await metrics.stop_server()
+    response_cache.save()
+
+
+def instrument_handlers(app):
+    """Time every registered handler callback (including the conversation's) when metrics are enabled."""
+    pending = [handler for group in app.handlers.values() for handler in group]
+    while pending:
+        handler = pending.pop()
+        if isinstance(handler, ConversationHandler):
+            pending.extend(handler.entry_points)
+            pending.extend(handler.fallbacks)
+            pending.extend(h for state in handler.states.values() for h in state)
+        else:
+            handler.callback = metrics.instrument(handler.callback)
+
 
-    # Create the application
-    app = Application.builder().token(TOKEN).defaults(Defaults()).build()
+def register_handlers(app):
+    """Add the bot's handlers to an Application (also used by the offline benchmarks)."""
+    # Load the sender's data before any other handler runs
+    app.add_handler(TypeHandler(Update, preload_user_handler), group=-1)
 
     # Command handlers
     app.add_handler(CommandHandler("start", start_command))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("note", note_command))
     app.add_handler(CommandHandler("shownotes", shownotes_command))
+    app.add_handler(CommandHandler("searchnotes", searchnotes_command))
     app.add_handler(CommandHandler("delete_note", delete_note_command))
     app.add_handler(CommandHandler("clear_data", clear_data_command)) 
     app.add_handler(CommandHandler("language_mode", language_mode_command))
@@ -63,14 +152,105 @@ def main():
     app.add_handler(CommandHandler("add_flashcard", add_flashcard_command))
     app.add_handler(CommandHandler("show_flashcards", show_flashcards_command))
     app.add_handler(CommandHandler("delete_flashcard", delete_flashcard_command))
+    app.add_handler(CommandHandler("flashcard_stats", flashcard_stats_command))
+    app.add_handler(CommandHandler("stats", stats_command))
+    app.add_handler(CommandHandler("import_flashcards", import_flashcards_command))
+    app.add_handler(CommandHandler("export_flashcards", export_flashcards_command))
+    app.add_handler(MessageHandler(filters.Document.ALL, handle_flashcard_document))
+    app.add_handler(CallbackQueryHandler(page_callback, pattern=f"^{CALLBACK_PREFIX}"))
     app.add_handler(flashcards_handler)
     
     # Message handler for confirmation and regular messages
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_clear_data_confirmation))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    instrument_handlers(app)
+
+
+def build_application(token):
+    """The Application serving the users: handlers, flood control and per-user ordering."""
+    app = (
+        Application.builder()
+        .token(token)
+        .defaults(Defaults())
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        # Global and per-chat flood control for everything the bot sends
+        .rate_limiter(OutboundRateLimiter())
+        # Different users are served concurrently, each user's updates stay in order
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .build()
+    )
+    register_handlers(app)
+    return app
+
+
+def load_bot_data():
+    started = time.perf_counter()
+    load_data()
+    response_cache.load()
+    startup_timings["data_load"] = time.perf_counter() - started
+
+
+def run_worker(index, updates, status):
+    """Entry point of a worker process (WORKER_PROCESSES > 1): serve the users of one shard."""
+    # Ctrl+C reaches the whole process group; the front process stops the workers in order
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    print(f"Worker {index} loading its data...")
+    load_bot_data()
+    asyncio.run(serve_shard(build_application(TOKEN), updates, status))
+
+
+async def post_init_front(application: Application):
+    await metrics.start_server(METRICS_LISTEN, METRICS_PORT)
+
+
+async def post_shutdown_front(application: Application):
+    await metrics.stop_server()
+
+
+def build_front_application(token):
+    """The Application of the front process: it only receives updates and routes them to the workers."""
+    seed_shards(WORKER_PROCESSES)
+    pool = WorkerPool(run_worker, WORKER_PROCESSES)
+    return (
+        Application.builder()
+        .token(token)
+        .post_init(post_init_front)
+        .post_shutdown(post_shutdown_front)
+        .concurrent_updates(ShardingUpdateProcessor(pool))
+        .build()
+    )
+
+
+def main():
+    """Start the Telegram bot."""
+    if not TOKEN:
+        raise ValueError("Missing TELEGRAM_API_KEY in .env file")
+    print("Starting Telegram bot...")
+    if WORKER_PROCESSES > 1:
+        print(f"Routing updates to {WORKER_PROCESSES} worker processes by user id")
+        app = build_front_application(TOKEN)
+    else:
+        # Data split between workers earlier is not in the single-process files
+        check_shard_count(1)
+        load_bot_data()
+        app = build_application(TOKEN)
 
-    print("Bot is polling for updates. Press Ctrl+C to stop.")
-    app.run_polling()
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            raise ValueError("Missing WEBHOOK_URL in .env file (required when BOT_MODE=webhook)")
+        print(f"Bot is serving webhook updates on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}. Press Ctrl+C to stop.")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET_TOKEN or None,
+        )
+    else:
+        print("Bot is polling for updates. Press Ctrl+C to stop.")
+        app.run_polling()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,229 @@
+# metrics.py
+import time
+import asyncio
+import functools
+from contextlib import nullcontext
+from config import METRICS_ENABLED
+
+# Histogram bucket upper bounds: latencies in seconds, prompt sizes in characters or tokens
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+enabled = METRICS_ENABLED
+
+# (name, labels) -> value; labels is a sorted tuple of (key, value) pairs
+_counters = {}
+_gauges = {}
+# (name, labels) -> [bucket counts..., +Inf count, sum]
+_histograms = {}
+_buckets = {}
+# name -> function returning the current value, read only when metrics are rendered
+_gauge_callbacks = {}
+_server = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Add value to a counter."""
+    if not enabled:
+        return
+    key = _key(name, labels)
+    _counters[key] = _counters.get(key, 0) + value
+
+
+def gauge_add(name, delta, **labels):
+    """Move a gauge up or down (e.g. requests in flight)."""
+    if not enabled:
+        return
+    key = _key(name, labels)
+    _gauges[key] = _gauges.get(key, 0) + delta
+
+
+def gauge_callback(name, callback):
+    """Report callback() as a gauge; it costs nothing until the metrics are read."""
+    _gauge_callbacks[name] = callback
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Record one observation in a histogram."""
+    if not enabled:
+        return
+    key = _key(name, labels)
+    counts = _histograms.get(key)
+    if counts is None:
+        counts = _histograms[key] = [0] * (len(buckets) + 2)
+        _buckets[name] = buckets
+    for index, bound in enumerate(buckets):
+        if value <= bound:
+            counts[index] += 1
+            break
+    else:
+        counts[-2] += 1
+    counts[-1] += value
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+_NO_TIMER = nullcontext()
+
+
+def timer(name, **labels):
+    """Context manager recording the duration of its block in a latency histogram."""
+    if not enabled:
+        return _NO_TIMER
+    return _Timer(name, labels)
+
+
+def instrument(callback, name=None):
+    """Wrap a handler callback to count calls and errors, time it and track how many are running."""
+    if not enabled:
+        return callback
+    handler = name or callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        gauge_add("handlers_in_flight", 1, handler=handler)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            inc("handler_errors_total", handler=handler)
+            raise
+        finally:
+            observe("handler_seconds", time.perf_counter() - started, handler=handler)
+            gauge_add("handlers_in_flight", -1, handler=handler)
+
+    return wrapper
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (f'{key}="{_escape(value)}"' for key, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(_counters.items()):
+        header(name, "counter")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), value in sorted(_gauges.items()):
+        header(name, "gauge")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for name, callback in sorted(_gauge_callbacks.items()):
+        header(name, "gauge")
+        lines.append(f"{name} {callback()}")
+    for (name, labels), counts in sorted(_histograms.items()):
+        header(name, "histogram")
+        cumulative = 0
+        for bound, count in zip(_buckets[name] + ("+Inf",), counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {counts[-1]}")
+        lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def quantile(name, q, **labels):
+    """Estimate a quantile of a histogram from its buckets (upper bound of the bucket reached)."""
+    counts = _histograms.get(_key(name, labels))
+    if not counts:
+        return None
+    total = sum(counts[:-1])
+    target = q * total
+    cumulative = 0
+    for bound, count in zip(_buckets[name] + (float("inf"),), counts):
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return float("inf")
+
+
+def summary():
+    """Short human-readable report for the /stats command."""
+    if not enabled:
+        return "Metrics are disabled (set METRICS_ENABLED=true)."
+    lines = []
+    for (name, labels), counts in sorted(_histograms.items()):
+        calls = sum(counts[:-1])
+        label_text = ",".join(f"{key}={label}" for key, label in labels)
+        p95 = quantile(name, 0.95, **dict(labels))
+        lines.append(f"{name}[{label_text}] n={calls} avg={counts[-1] / calls:.3f} p95<={p95}")
+    for (name, labels), value in sorted(_counters.items()):
+        label_text = ",".join(f"{key}={label}" for key, label in labels)
+        lines.append(f"{name}[{label_text}] {value}")
+    for name, callback in sorted(_gauge_callbacks.items()):
+        lines.append(f"{name} {callback()}")
+    return "\n".join(lines) or "No metrics recorded yet."
+
+
+async def _serve(reader, writer):
+    """Answer one HTTP request with the metrics page."""
+    try:
+        request_line = await reader.readline()
+        # Skip the request headers
+        while (await reader.readline()).strip():
+            pass
+        if request_line.split(b" ")[1:2] == [b"/metrics"]:
+            body = render().encode()
+            status = b"200 OK"
+        else:
+            body = b"Not found\n"
+            status = b"404 Not Found"
+        writer.write(
+            b"HTTP/1.1 " + status + b"\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            + b"Content-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host, port):
+    """Serve GET /metrics on host:port for Prometheus (no-op when metrics are disabled)."""
+    global _server
+    if not enabled or not port or _server is not None:
+        return
+    _server = await asyncio.start_server(_serve, host, port)
+    print(f"Metrics available on http://{host}:{port}/metrics")
+
+
+async def stop_server():
+    global _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
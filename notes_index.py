@@ -0,0 +1,100 @@
+# notes_index.py
+import re
+import math
+import bisect
+import unicodedata
+from collections import Counter
+
+_WORD = re.compile(r"\w+")
+
+# A query word that only matches as the prefix of a longer word counts for less
+PREFIX_WEIGHT = 0.5
+
+
+def tokenize(text):
+    """Lowercase, accent-folded words of a text ("Perché" -> "perche")."""
+    folded = unicodedata.normalize("NFKD", text.lower())
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    return _WORD.findall(folded)
+
+
+class NoteIndex:
+    """Inverted index over one user's notes, kept in step with the note list.
+
+    Each note gets a stable id when it is added. Ids only grow and deletions keep the
+    order of the others, so the id list stays sorted and a note's current position is
+    found by bisection: deleting a note shifts the positions of the later ones for free.
+    """
+
+    def __init__(self, notes=()):
+        self._postings = {}     # token -> {note id: occurrences}
+        self._tokens = []       # sorted tokens, for prefix lookups
+        self._ids = []          # position -> note id (sorted)
+        self._lengths = {}      # note id -> number of tokens
+        self._next_id = 0
+        for note in notes:
+            self.add(note)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, note):
+        """Index a note appended at the end of the list."""
+        note_id = self._next_id
+        self._next_id += 1
+        self._ids.append(note_id)
+        counts = Counter(tokenize(note))
+        self._lengths[note_id] = sum(counts.values())
+        for token, count in counts.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                bisect.insort(self._tokens, token)
+            postings[note_id] = count
+
+    def remove(self, position, note):
+        """Drop the note that was at position (note is its text, to find its postings)."""
+        note_id = self._ids.pop(position)
+        del self._lengths[note_id]
+        for token in set(tokenize(note)):
+            postings = self._postings[token]
+            del postings[note_id]
+            if not postings:
+                del self._postings[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+
+    def _matches(self, word):
+        """Yield (token, weight) for the indexed tokens equal to or starting with word."""
+        index = bisect.bisect_left(self._tokens, word)
+        while index < len(self._tokens) and self._tokens[index].startswith(word):
+            token = self._tokens[index]
+            yield token, 1.0 if token == word else PREFIX_WEIGHT
+            index += 1
+
+    def search(self, query, limit=10):
+        """Return [(position, score)] of the best matching notes, best first.
+
+        Notes matching more query words rank first, then by TF-IDF score.
+        """
+        words = set(tokenize(query))
+        if not words:
+            return []
+        total = len(self._ids)
+        matched = Counter()
+        scores = Counter()
+        for word in words:
+            best = {}
+            for token, weight in self._matches(word):
+                postings = self._postings[token]
+                idf = math.log(1 + total / len(postings))
+                for note_id, count in postings.items():
+                    score = weight * idf * count / self._lengths[note_id]
+                    best[note_id] = max(best.get(note_id, 0.0), score)
+            for note_id, score in best.items():
+                matched[note_id] += 1
+                scores[note_id] += score
+        ranked = sorted(scores, key=lambda note_id: (matched[note_id], scores[note_id]), reverse=True)
+        return [
+            (bisect.bisect_left(self._ids, note_id), round(scores[note_id], 4))
+            for note_id in ranked[:limit]
+        ]
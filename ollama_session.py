@@ -0,0 +1,94 @@
+# ollama_session.py
+from array import array
+from config import OLLAMA_MODEL, OLLAMA_KEEP_ALIVE, OLLAMA_REUSE_CONTEXT, OLLAMA_CONTEXT_MAX_TOKENS
+from data_manager import history_version, get_conversation_summary, on_user_evicted, on_history_reset
+
+_client = None
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        from ollama import AsyncClient
+        _client = AsyncClient()
+    return _client
+
+
+class Generation:
+    """One streamed /api/generate call; `context` holds the model's token context once it is done."""
+
+    def __init__(self, prompt, context=None):
+        self.prompt = prompt
+        self.context = context
+        self.prompt_tokens = None
+
+    async def stream(self):
+        """Yield the answer text as it is generated."""
+        chunks = await _get_client().generate(
+            model=OLLAMA_MODEL,
+            prompt=self.prompt,
+            context=list(self.context) if self.context else None,
+            stream=True,
+            keep_alive=OLLAMA_KEEP_ALIVE,
+        )
+        self.context = None
+        async for chunk in chunks:
+            if chunk["response"]:
+                yield chunk["response"]
+            if chunk["done"]:
+                self.context = chunk["context"]
+                self.prompt_tokens = chunk["prompt_eval_count"]
+
+    async def text(self):
+        return "".join([piece async for piece in self.stream()])
+
+
+class SessionStore:
+    """Ollama's token context per user, valid for as long as the history only grew by our own answers.
+
+    A session is recorded right after the answer is added to the history. Any other
+    change (a turn from language mode, a new summary, /clear_data) changes the history
+    version or summary coverage, and the next question rebuilds the prompt from scratch.
+    """
+
+    def __init__(self, max_tokens=OLLAMA_CONTEXT_MAX_TOKENS, enabled=OLLAMA_REUSE_CONTEXT):
+        self.max_tokens = max_tokens
+        self.enabled = enabled
+        self._sessions = {}     # user_id -> (history version, summary coverage, token context)
+        self.stats = {"reused": 0, "rebuilt": 0}
+
+    def forget(self, user_id):
+        self._sessions.pop(user_id, None)
+
+    def reusable_context(self, user_id):
+        """The user's saved context if the next prompt can be just the new question, else None."""
+        session = self._sessions.get(user_id)
+        if not self.enabled or session is None:
+            return None
+        version, covered, context = session
+        if (
+            version != history_version(user_id)
+            or covered != get_conversation_summary(user_id)["covered"]
+            or len(context) > self.max_tokens
+        ):
+            # Edited, summarized, cleared or too long: the caller rebuilds the prompt
+            self.forget(user_id)
+            self.stats["rebuilt"] += 1
+            return None
+        self.stats["reused"] += 1
+        return context
+
+    def save(self, user_id, context):
+        """Record the context returned with the answer that was just added to the history."""
+        if not self.enabled or not context:
+            return
+        self._sessions[user_id] = (
+            history_version(user_id),
+            get_conversation_summary(user_id)["covered"],
+            array("i", context),
+        )
+
+
+sessions = SessionStore()
+on_user_evicted(sessions.forget)
+on_history_reset(sessions.forget)
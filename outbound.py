@@ -0,0 +1,226 @@
+# outbound.py
+import heapq
+import asyncio
+import itertools
+import contextvars
+from collections import deque
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_MAX_RETRIES
+
+# Priority lanes, lowest value first: replies to what the user just did, streamed edits, bulk output
+INTERACTIVE = 0
+STREAM = 1
+BULK = 2
+
+# Lane of the Bot API calls made in the current task (set by Outbox, read by the rate limiter)
+_lane = contextvars.ContextVar("outbound_lane", default=INTERACTIVE)
+
+
+class TokenBucket:
+    """`rate` tokens per second, up to `capacity` saved up for bursts."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = None
+        self.paused_until = 0.0
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, now, seconds):
+        """Hand out nothing for a while (after Telegram answered RetryAfter)."""
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0
+
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """Rate limiter for every Bot API call: a global token bucket plus one bucket per chat.
+
+    Waiting calls are granted in lane order (INTERACTIVE before STREAM before BULK), then
+    in arrival order; a call whose chat is throttled does not hold up other chats. When
+    Telegram answers RetryAfter, the chat (or everything, for calls without a chat) is
+    paused for the requested time and the call is retried.
+    """
+
+    def __init__(self, global_rate=OUTBOUND_GLOBAL_RATE, chat_rate=OUTBOUND_CHAT_RATE,
+                 chat_burst=OUTBOUND_CHAT_BURST, max_retries=OUTBOUND_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chat_buckets = {}
+        self._waiting = []          # heap of (lane, arrival, chat_id, future)
+        self._arrivals = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+        self.stats = {"granted": 0, "retry_after": 0, "max_waiting": 0}
+
+    async def initialize(self):
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for _, _, _, future in self._waiting:
+            future.cancel()
+        self._waiting.clear()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _dispatch(self):
+        """Grant waiting calls as the buckets allow, best lane first."""
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._waiting:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = loop.time()
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+            # Best entry whose chat has a token; throttled chats are skipped, not waited on
+            shortest = None
+            granted = None
+            for entry in sorted(self._waiting):
+                chat_wait = self._chat_bucket(entry[2]).wait_time(now)
+                if chat_wait == 0:
+                    granted = entry
+                    break
+                shortest = chat_wait if shortest is None else min(shortest, chat_wait)
+            if granted is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), shortest)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._waiting.remove(granted)
+            heapq.heapify(self._waiting)
+            future = granted[3]
+            if future.done():
+                continue
+            self.global_bucket.take()
+            self._chat_bucket(granted[2]).take()
+            self.stats["granted"] += 1
+            future.set_result(None)
+            # Forget chats whose bucket has refilled, so idle chats do not pile up
+            if len(self._chat_buckets) > 10000:
+                self._chat_buckets = {
+                    chat_id: bucket for chat_id, bucket in self._chat_buckets.items()
+                    if bucket.wait_time(now) > 0 or bucket.tokens < bucket.capacity
+                }
+
+    async def _acquire(self, chat_id, lane):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (lane, next(self._arrivals), chat_id, future))
+        self.stats["max_waiting"] = max(self.stats["max_waiting"], len(self._waiting))
+        self._wakeup.set()
+        await future
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        lane = _lane.get()
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                await self._acquire(chat_id, lane)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.stats["retry_after"] += 1
+                if attempt == self.max_retries:
+                    raise
+                delay = e.retry_after
+                delay = delay.total_seconds() if hasattr(delay, "total_seconds") else float(delay)
+                now = asyncio.get_running_loop().time()
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).pause(now, delay)
+                    self._wakeup.set()
+                else:
+                    self.global_bucket.pause(now, delay)
+                    await asyncio.sleep(delay)
+
+
+class Outbox:
+    """Per-chat FIFO queues of Bot API calls, so handlers can send without waiting.
+
+    send() returns a future with the call's result; await it only when the result is
+    needed. A chat's calls run one after the other in the order they were queued, so
+    queued replies keep their order even while the rate limiter holds them back.
+    """
+
+    def __init__(self):
+        self._queues = {}       # chat_id -> deque of (future, call, args, kwargs, lane)
+        self._workers = {}      # chat_id -> worker task
+        self.stats = {"queued": 0, "failed": 0}
+
+    def send(self, chat_id, call, *args, lane=INTERACTIVE, **kwargs):
+        """Queue call(*args, **kwargs) for chat_id in the given lane; returns a future of its result."""
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_log_failure)
+        self._queues.setdefault(chat_id, deque()).append((future, call, args, kwargs, lane))
+        self.stats["queued"] += 1
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.get_running_loop().create_task(self._work(chat_id))
+        return future
+
+    async def _work(self, chat_id):
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                future, call, args, kwargs, lane = queue.popleft()
+                if future.cancelled():
+                    continue
+                _lane.set(lane)
+                try:
+                    result = await call(*args, **kwargs)
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            del self._queues[chat_id]
+            del self._workers[chat_id]
+
+    async def drain(self):
+        """Wait until every queued call has been sent (e.g. before shutdown)."""
+        while self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+
+def _log_failure(future):
+    # Retrieving the exception here also keeps asyncio from warning about unawaited failures
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Failed to send a message: {future.exception()}")
+
+
+outbox = Outbox()
+
+
+def reply(message, text, lane=INTERACTIVE, **kwargs):
+    """Queue a reply to message without waiting for it to be sent; returns a future of the sent Message."""
+    return outbox.send(message.chat_id, message.reply_text, text, lane=lane, **kwargs)
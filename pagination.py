@@ -0,0 +1,67 @@
+# pagination.py
+import base64
+from itertools import islice
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from streaming import MAX_MESSAGE_LENGTH
+
+# Prefix of the callback data of the Prev/Next buttons
+CALLBACK_PREFIX = "pg:"
+# Longest item shown on a page, so a full page always fits in one message
+MAX_ITEM_LENGTH = 300
+
+
+def encode_cursor(kind, offset, owner):
+    """Opaque callback data pointing at the page of `kind` that starts at offset, in owner's listing."""
+    token = base64.urlsafe_b64encode(f"{kind}:{offset}:{owner}".encode()).decode().rstrip("=")
+    return CALLBACK_PREFIX + token
+
+
+def decode_cursor(data):
+    """Return (kind, offset, owner) from callback data, or None if it is not a valid cursor."""
+    if not data or not data.startswith(CALLBACK_PREFIX):
+        return None
+    token = data[len(CALLBACK_PREFIX):]
+    try:
+        kind, offset, owner = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode().split(":")
+        return kind, max(int(offset), 0), owner
+    except ValueError:
+        return None
+
+
+def _shorten(text):
+    return text if len(text) <= MAX_ITEM_LENGTH else text[:MAX_ITEM_LENGTH - 1] + "…"
+
+
+def render_page(kind, owner, title, items, total, offset, page_size, format_item):
+    """Render one page of owner's collection and its Prev/Next keyboard.
+
+    items is any iterable over the collection; only the page's slice is consumed.
+    Returns (text, reply_markup).
+    """
+    if offset >= total:
+        # The collection shrank since the button was sent: show the last page
+        offset = (total - 1) // page_size * page_size
+    lines = [
+        f"{offset + number + 1}. {_shorten(format_item(item))}"
+        for number, item in enumerate(islice(items, offset, offset + page_size))
+    ]
+    end = offset + len(lines)
+    text = f"{title} ({offset + 1}-{end} of {total}):\n" + "\n".join(lines)
+
+    buttons = []
+    if offset > 0:
+        buttons.append(InlineKeyboardButton("« Prev", callback_data=encode_cursor(kind, max(offset - page_size, 0), owner)))
+    if end < total:
+        buttons.append(InlineKeyboardButton("Next »", callback_data=encode_cursor(kind, end, owner)))
+    markup = InlineKeyboardMarkup([buttons]) if buttons else None
+    return text[:MAX_MESSAGE_LENGTH], markup
+
+
+async def edit_page(query, text, markup):
+    """Replace the message of a button press with another page, in place."""
+    try:
+        await query.edit_message_text(text, reply_markup=markup)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
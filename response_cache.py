@@ -0,0 +1,107 @@
+# response_cache.py
+import os
+import json
+import time
+import hashlib
+from collections import OrderedDict
+import metrics
+from storage import write_atomic
+from config import RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL, RESPONSE_CACHE_FILE
+
+# Rough per-entry bookkeeping cost added to the size of the cached text
+ENTRY_OVERHEAD = 200
+
+
+def _normalize(text):
+    """Case-fold and collapse whitespace so trivially different inputs share an entry."""
+    return " ".join(text.casefold().split())
+
+
+class ResponseCache:
+    """LRU cache of LLM responses with a TTL, a memory cap and optional persistence to a JSON file."""
+
+    def __init__(self, max_bytes, ttl, path=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path = path
+        # key -> (response, stored_at); the order of the dict is the LRU order
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    @staticmethod
+    def make_key(level, topic, sentence, model_name, template):
+        """Build the cache key of a language-mode correction."""
+        template_hash = hashlib.sha256(template.encode()).hexdigest()
+        raw = "\x1f".join((_normalize(level), _normalize(topic), _normalize(sentence), model_name, template_hash))
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def snapshot(self):
+        """Return the counters together with the current size of the cache."""
+        return {**self.stats, "entries": len(self._entries), "bytes": self._bytes}
+
+    def get(self, key):
+        """Return the cached response for key, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            metrics.inc("response_cache_misses_total")
+            return None
+        response, stored_at = entry
+        if time.time() - stored_at > self.ttl:
+            self._remove(key)
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            metrics.inc("response_cache_misses_total")
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        metrics.inc("response_cache_hits_total")
+        return response
+
+    def put(self, key, response, stored_at=None):
+        """Store a response, evicting the least recently used entries above the memory cap."""
+        size = len(response.encode()) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (response, stored_at or time.time())
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats["evictions"] += 1
+            metrics.inc("response_cache_evictions_total")
+
+    def _remove(self, key):
+        response, _ = self._entries.pop(key)
+        self._bytes -= len(response.encode()) + ENTRY_OVERHEAD
+
+    def load(self):
+        """Load persisted entries that have not expired yet."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable response cache {self.path}: {e}")
+            return
+        now = time.time()
+        for key, (response, stored_at) in entries.items():
+            if now - stored_at <= self.ttl:
+                self.put(key, response, stored_at)
+        print(f"Loaded {len(self._entries)} cached responses from {self.path}")
+
+    def save(self):
+        """Persist the cache (oldest entries first, so the LRU order survives a restart)."""
+        if not self.path:
+            return
+        write_atomic(self.path, json.dumps(self._entries))
+
+
+# Cache of language-mode corrections, which depend only on level, topic and sentence
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL, RESPONSE_CACHE_FILE or None)
+metrics.gauge_callback("response_cache_entries", lambda: len(response_cache._entries))
+metrics.gauge_callback("response_cache_bytes", lambda: response_cache._bytes)
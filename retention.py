@@ -0,0 +1,190 @@
+# retention.py
+import os
+import json
+import gzip
+import time
+import asyncio
+import threading
+import metrics
+import data_manager
+from config import (
+    HISTORY_MAX_TURNS,
+    HISTORY_MAX_AGE_DAYS,
+    FLASHCARD_LOG_MAX_ENTRIES,
+    FLASHCARD_LOG_MAX_AGE_DAYS,
+    RETENTION_INTERVAL,
+    RETENTION_SLICE_SECONDS,
+    ARCHIVE_DIR,
+)
+
+# A count limit is enforced once it is exceeded by this fraction, so entries are removed in batches
+COUNT_SLACK = 0.1
+# Delay before the first pass after startup (seconds)
+FIRST_PASS_DELAY = 60
+SECONDS_PER_DAY = 86400
+
+
+def expired_prefix(entries, max_count, max_age_days, now, time_key):
+    """Number of oldest entries that break the count or the age limit (entries are oldest first)."""
+    count = 0
+    if max_count and len(entries) > max_count + max(int(max_count * COUNT_SLACK), 1):
+        count = len(entries) - max_count
+    if max_age_days:
+        cutoff = now - max_age_days * SECONDS_PER_DAY
+        # Entries without a timestamp (from before timestamps were recorded) only count towards max_count
+        while count < len(entries) and (entries[count].get(time_key) or cutoff) < cutoff:
+            count += 1
+    return count
+
+
+class Archive:
+    """Cold storage for removed entries: one gzip-compressed JSON Lines file per section and month.
+
+    Every line is {"user": ..., "archived_at": ..., "entry": ...}. Files are only appended
+    to (each append adds a gzip member), except when a user's records are purged.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, section, now):
+        return os.path.join(self.directory, f"{section}-{time.strftime('%Y-%m', time.gmtime(now))}.jsonl.gz")
+
+    def append(self, section, records, now):
+        """Append [(user_id, entry)] to the section's file of the month (blocking, runs in an executor)."""
+        lines = "".join(
+            json.dumps({"user": user_id, "archived_at": now, "entry": entry}) + "\n" for user_id, entry in records
+        )
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with gzip.open(self._path(section, now), "at", encoding="utf-8") as f:
+                f.write(lines)
+        return len(lines)
+
+    def purge(self, user_id):
+        """Rewrite the archive files without the records of user_id (blocking, runs in an executor)."""
+        # Lines start with the user, so they can be matched without parsing them
+        prefix = '{"user": ' + json.dumps(user_id) + ","
+        removed = 0
+        with self._lock:
+            if not os.path.isdir(self.directory):
+                return 0
+            for name in sorted(os.listdir(self.directory)):
+                if not name.endswith(".jsonl.gz"):
+                    continue
+                path = os.path.join(self.directory, name)
+                tmp_path = path + ".tmp"
+                removed_here = 0
+                with gzip.open(path, "rt", encoding="utf-8") as src, gzip.open(tmp_path, "wt", encoding="utf-8") as dst:
+                    for line in src:
+                        if line.startswith(prefix):
+                            removed_here += 1
+                        else:
+                            dst.write(line)
+                if removed_here:
+                    os.replace(tmp_path, path)
+                else:
+                    os.remove(tmp_path)
+                removed += removed_here
+        return removed
+
+
+class Retention:
+    """Removes the entries of the loaded users that break the retention limits, a few users at a time.
+
+    A pass yields to the event loop whenever it has run for slice_seconds, and removed
+    entries are archived (in an executor) before they are dropped from memory. Users
+    that are not loaded are not touched: their data only grows while they are active,
+    and the limits are applied again once they are.
+    """
+
+    def __init__(self, rules, archive=None, slice_seconds=RETENTION_SLICE_SECONDS):
+        self.rules = rules      # (section, max entries, max age in days, timestamp key) with a limit set
+        self.archive = archive
+        self.slice_seconds = slice_seconds
+        self._running = False
+        self.stats = {"passes": 0, "trimmed": 0, "archived_bytes": 0, "max_slice_seconds": 0.0}
+
+    async def _remove(self, batch, now):
+        """Archive, then drop, the entries collected in one slice: [(user_id, section, entries, count)]."""
+        if self.archive is not None:
+            loop = asyncio.get_running_loop()
+            for section, _, _, _ in self.rules:
+                records = [
+                    (user_id, entry)
+                    for user_id, name, entries, count in batch if name == section
+                    for entry in entries[:count]
+                ]
+                if records:
+                    self.stats["archived_bytes"] += await loop.run_in_executor(
+                        None, self.archive.append, section, records, now
+                    )
+        for user_id, section, entries, count in batch:
+            # Skip users whose list was replaced meanwhile (cleared, evicted)
+            if getattr(data_manager, section).get(user_id) is not entries:
+                continue
+            data_manager.trim_log(user_id, section, count)
+            self.stats["trimmed"] += count
+            metrics.inc("retention_trimmed_total", count, section=section)
+
+    async def run_pass(self):
+        if self._running or not self.rules:
+            return
+        self._running = True
+        started = time.perf_counter()
+        now = time.time()
+        try:
+            batch = []
+            slice_started = time.perf_counter()
+            for user_id in data_manager.loaded_user_ids():
+                for section, max_count, max_age_days, time_key in self.rules:
+                    entries = getattr(data_manager, section).get(user_id)
+                    count = expired_prefix(entries, max_count, max_age_days, now, time_key) if entries else 0
+                    if count:
+                        batch.append((user_id, section, entries, count))
+                elapsed = time.perf_counter() - slice_started
+                if elapsed >= self.slice_seconds:
+                    self.stats["max_slice_seconds"] = max(self.stats["max_slice_seconds"], elapsed)
+                    await self._remove(batch, now)
+                    batch = []
+                    await asyncio.sleep(0)
+                    slice_started = time.perf_counter()
+            await self._remove(batch, now)
+            self.stats["passes"] += 1
+        finally:
+            self._running = False
+        metrics.observe("retention_pass_seconds", time.perf_counter() - started)
+
+    async def purge_user(self, user_id):
+        """Remove a user's archived entries (after /clear_data)."""
+        if self.archive is None:
+            return 0
+        return await asyncio.get_running_loop().run_in_executor(None, self.archive.purge, user_id)
+
+
+async def _retention_job(context):
+    await retention.run_pass()
+
+
+def schedule(application):
+    """Run retention passes every RETENTION_INTERVAL seconds on the application's JobQueue."""
+    if not retention.rules:
+        return
+    if application.job_queue is None:
+        print("Retention limits are set but the JobQueue is unavailable (install python-telegram-bot[job-queue])")
+        return
+    application.job_queue.run_repeating(_retention_job, interval=RETENTION_INTERVAL, first=FIRST_PASS_DELAY,
+                                        name="retention")
+
+
+retention = Retention(
+    [
+        rule for rule in (
+            ("conversation_context", HISTORY_MAX_TURNS, HISTORY_MAX_AGE_DAYS, "ts"),
+            ("flashcard_log", FLASHCARD_LOG_MAX_ENTRIES, FLASHCARD_LOG_MAX_AGE_DAYS, "timestamp"),
+        )
+        if rule[1] or rule[2]
+    ],
+    Archive(ARCHIVE_DIR) if ARCHIVE_DIR else None,
+)
@@ -0,0 +1,201 @@
+# retrieval.py
+import zlib
+import asyncio
+import numpy as np
+from notes_index import tokenize
+from config import CONTEXT_RETRIEVAL, RETRIEVAL_TOP_K, CONTEXT_RECENT_TURNS, EMBEDDING_BACKEND, OLLAMA_EMBED_MODEL
+from data_manager import get_conversation_history, on_turn_added, on_user_evicted, on_history_reset
+
+# Characters of a turn that are embedded
+MAX_EMBED_CHARS = 2000
+# Turns embedded per Ollama request when indexing an existing history
+BATCH_SIZE = 32
+
+
+def turn_text(turn):
+    return f"{turn.get('user', '')}\n{turn.get('ai', '')}"[:MAX_EMBED_CHARS]
+
+
+def _normalized(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+class HashingEmbedder:
+    """Deterministic offline embedder: words and word pairs hashed into a fixed number of signed buckets.
+
+    Similarity is lexical only, but it needs no model and gives the same vectors on
+    every run, which makes it suitable for tests and benchmarks.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def embed_one(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = tokenize(text)
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            hashed = zlib.crc32(feature.encode())
+            vector[hashed % self.dim] += 1.0 if hashed & 0x80000000 else -1.0
+        return vector
+
+    async def embed(self, texts):
+        return _normalized(np.stack([self.embed_one(text) for text in texts]))
+
+
+class OllamaEmbedder:
+    """Embeddings from a local Ollama embedding model."""
+
+    def __init__(self, model=OLLAMA_EMBED_MODEL):
+        self.model = model
+        self._client = None
+
+    async def embed(self, texts):
+        if self._client is None:
+            from ollama import AsyncClient
+            self._client = AsyncClient()
+        response = await self._client.embed(model=self.model, input=list(texts))
+        return _normalized(np.asarray(response["embeddings"], dtype=np.float32))
+
+
+class TurnIndex:
+    """Embeddings of one user's turns, row i holding turn i (rows may still be missing)."""
+
+    def __init__(self, history):
+        self.history = history      # The history list these rows belong to
+        self.vectors = None
+        self.filled = np.zeros(0, dtype=bool)
+
+    def _reserve(self, rows, dim):
+        if self.vectors is None:
+            self.vectors = np.zeros((max(rows, 16), dim), dtype=np.float32)
+            self.filled = np.zeros(len(self.vectors), dtype=bool)
+        elif rows > len(self.vectors):
+            # Grow geometrically so appends stay amortized O(1)
+            capacity = max(rows, 2 * len(self.vectors))
+            vectors = np.zeros((capacity, self.vectors.shape[1]), dtype=np.float32)
+            vectors[:len(self.vectors)] = self.vectors
+            filled = np.zeros(capacity, dtype=bool)
+            filled[:len(self.filled)] = self.filled
+            self.vectors, self.filled = vectors, filled
+
+    def set_rows(self, indexes, vectors):
+        self._reserve(max(indexes) + 1, vectors.shape[1])
+        self.vectors[indexes] = vectors
+        self.filled[indexes] = True
+
+    def missing(self, upto):
+        """Indexes of the turns below upto without an embedding yet."""
+        filled = np.zeros(upto, dtype=bool)
+        known = min(upto, len(self.filled))
+        filled[:known] = self.filled[:known]
+        return np.flatnonzero(~filled).tolist()
+
+    def search(self, query, k, upto):
+        """Indexes of the k embedded turns below upto most similar to query, oldest first."""
+        if self.vectors is None or upto <= 0:
+            return []
+        upto = min(upto, len(self.vectors))
+        # One matrix-vector product scores every turn; unembedded rows never win
+        scores = self.vectors[:upto] @ query
+        scores[~self.filled[:upto]] = -np.inf
+        k = min(k, int(self.filled[:upto].sum()))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        return sorted(int(index) for index in best)
+
+
+class Retriever:
+    """Keeps a TurnIndex per user up to date and finds the past turns relevant to a question."""
+
+    def __init__(self, embedder, top_k=RETRIEVAL_TOP_K, recent_turns=CONTEXT_RECENT_TURNS, enabled=True):
+        self.embedder = embedder
+        self.top_k = top_k
+        self.recent_turns = recent_turns
+        self.enabled = enabled
+        self._indexes = {}
+        self._backfilling = set()
+        self._tasks = set()
+
+    def forget(self, user_id):
+        """Drop a user's index (evicted, cleared or trimmed history); it is rebuilt on next use."""
+        self._indexes.pop(user_id, None)
+
+    def _index(self, user_id):
+        history = get_conversation_history(user_id)
+        index = self._indexes.get(user_id)
+        if index is None or index.history is not history:
+            index = self._indexes[user_id] = TurnIndex(history)
+        return index
+
+    def _spawn(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def turn_added(self, user_id, position, turn):
+        """Embed a new turn once, in the background (listener of add_conversation_turn)."""
+        if not self.enabled or user_id not in self._indexes:
+            return  # Indexed on the user's first retrieval, together with the rest of the history
+        try:
+            self._spawn(self._embed_rows(user_id, self._indexes[user_id], [position]))
+        except RuntimeError:
+            pass  # No running event loop (e.g. scripts): indexed on next use
+
+    async def _embed_rows(self, user_id, index, positions):
+        for start in range(0, len(positions), BATCH_SIZE):
+            batch = positions[start:start + BATCH_SIZE]
+            try:
+                vectors = await self.embedder.embed([turn_text(index.history[i]) for i in batch])
+            except Exception as e:
+                print(f"Failed to embed the history of user {user_id}: {e}")
+                return
+            # Skip the result if the history was replaced meanwhile
+            if self._indexes.get(user_id) is index:
+                index.set_rows(batch, vectors)
+
+    async def _backfill(self, user_id, index, positions):
+        try:
+            await self._embed_rows(user_id, index, positions)
+        finally:
+            self._backfilling.discard(user_id)
+
+    async def relevant_turns(self, user_id, question):
+        """Indexes of the past turns (before the recent window) most similar to question, oldest first.
+
+        Returns None when retrieval is disabled or unavailable, so the caller falls back
+        to the regular context. Turns not embedded yet are indexed in the background.
+        """
+        if not self.enabled:
+            return None
+        index = self._index(user_id)
+        upto = len(index.history) - self.recent_turns
+        if upto <= 0:
+            return []
+        missing = index.missing(upto)
+        if len(missing) <= BATCH_SIZE:
+            # A few turns (usually just the previous one): embed them before searching
+            await self._embed_rows(user_id, index, missing)
+        elif user_id not in self._backfilling:
+            # A long history: search what is embedded while the rest is indexed
+            self._backfilling.add(user_id)
+            self._spawn(self._backfill(user_id, index, missing))
+        try:
+            query = (await self.embedder.embed([question]))[0]
+        except Exception as e:
+            print(f"Failed to embed the question of user {user_id}: {e}")
+            return None
+        return index.search(query, self.top_k, upto)
+
+
+def create_embedder(backend):
+    if backend == "hashing":
+        return HashingEmbedder()
+    return OllamaEmbedder()
+
+
+retriever = Retriever(create_embedder(EMBEDDING_BACKEND), enabled=CONTEXT_RETRIEVAL)
+on_turn_added(retriever.turn_added)
+on_user_evicted(retriever.forget)
+on_history_reset(retriever.forget)
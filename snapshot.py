@@ -0,0 +1,379 @@
+# snapshot.py
+"""Binary snapshot format: one zlib-compressed record per user, an offset index and a footer.
+
+Layout of a snapshot file:
+
+    MAGIC
+    record*     RECORD_HEADER (payload length, user id length), user id (UTF-8),
+                payload = zlib(JSON {section: value} of that user)
+    index       zlib(JSON [[user id, record offset], ...])
+    FOOTER      index offset, index length, journal seq, MAGIC
+
+Through the index at the end, one user's record is read without reading the others;
+the records can also be read one after the other from the start.
+
+    python -m snapshot to-snapshot bot_data.json bot_data.snap
+    python -m snapshot to-json bot_data.snap bot_data.json
+"""
+import os
+import sys
+import copy
+import json
+import zlib
+import struct
+import threading
+from journal import apply_ops
+from storage import Storage, SECTIONS, write_atomic
+from config import JOURNAL_COMPACT_BYTES
+
+MAGIC = b"BOTSNAP1"
+RECORD_HEADER = struct.Struct("<IH")
+FOOTER = struct.Struct("<QQQ8s")
+# zlib level: 6 is zlib's default, close to the best ratio at a fraction of level 9's time
+COMPRESSION_LEVEL = 6
+
+
+def encode_record(user_id, record):
+    """One user's record as stored in a snapshot (header, id and compressed payload)."""
+    key = user_id.encode()
+    payload = zlib.compress(json.dumps(record, separators=(",", ":")).encode(), COMPRESSION_LEVEL)
+    return RECORD_HEADER.pack(len(payload), len(key)) + key + payload
+
+
+def decode_record(encoded):
+    """Inverse of encode_record: (user_id, record)."""
+    payload_length, key_length = RECORD_HEADER.unpack_from(encoded)
+    start = RECORD_HEADER.size + key_length
+    return encoded[RECORD_HEADER.size:start].decode(), json.loads(zlib.decompress(encoded[start:start + payload_length]))
+
+
+def user_record(sections, user_id):
+    return {name: sections[name][user_id] for name in SECTIONS if user_id in sections[name]}
+
+
+def apply_user_ops(user_id, record, ops):
+    """A user's record (or None) with journaled operations applied on top."""
+    sections = {name: {} for name in SECTIONS}
+    for name, value in (record or {}).items():
+        sections[name][user_id] = value
+    apply_ops(sections, ops)
+    return user_record(sections, user_id) or None
+
+
+def snapshot_chunks(records, journal_seq=0):
+    """Yield a snapshot file piece by piece from (user_id, encoded record) pairs (as returned by encode_record)."""
+    yield MAGIC
+    index = []
+    offset = len(MAGIC)
+    for user_id, encoded in records:
+        index.append([user_id, offset])
+        yield encoded
+        offset += len(encoded)
+    index_bytes = zlib.compress(json.dumps(index, separators=(",", ":")).encode(), COMPRESSION_LEVEL)
+    yield index_bytes
+    yield FOOTER.pack(offset, len(index_bytes), journal_seq, MAGIC)
+
+
+def build_snapshot(encoded_records, journal_seq=0):
+    """Assemble a snapshot in memory from {user_id: encoded record}."""
+    return b"".join(snapshot_chunks(encoded_records.items(), journal_seq))
+
+
+class SnapshotReader:
+    """Read access to a snapshot file; nothing but the footer is read until it is asked for."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._index = None
+        if self._file.read(len(MAGIC)) != MAGIC:
+            self._file.close()
+            raise ValueError(f"{path} is not a snapshot file")
+        self._file.seek(-FOOTER.size, os.SEEK_END)
+        self.index_offset, self.index_length, self.journal_seq, magic = FOOTER.unpack(self._file.read(FOOTER.size))
+        if magic != MAGIC:
+            self._file.close()
+            raise ValueError(f"{path} is incomplete (no snapshot footer)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def raw_records(self):
+        """Yield (user_id, encoded record) in file order, without decompressing them."""
+        self._file.seek(len(MAGIC))
+        while self._file.tell() < self.index_offset:
+            header = self._file.read(RECORD_HEADER.size)
+            payload_length, key_length = RECORD_HEADER.unpack(header)
+            key = self._file.read(key_length)
+            yield key.decode(), header + key + self._file.read(payload_length)
+
+    def records(self):
+        """Yield (user_id, record) in file order, decoding one record at a time."""
+        for _, encoded in self.raw_records():
+            yield decode_record(encoded)
+
+    def index(self):
+        """{user_id: record offset}, read from the end of the file on first use."""
+        if self._index is None:
+            self._file.seek(self.index_offset)
+            entries = json.loads(zlib.decompress(self._file.read(self.index_length)))
+            self._index = {user_id: offset for user_id, offset in entries}
+        return self._index
+
+    def raw_record_at(self, offset):
+        """The encoded record starting at offset."""
+        self._file.seek(offset)
+        header = self._file.read(RECORD_HEADER.size)
+        payload_length, key_length = RECORD_HEADER.unpack(header)
+        return header + self._file.read(key_length + payload_length)
+
+    def read_user(self, user_id):
+        """Return one user's record ({section: value}), or None if the user is not in the snapshot."""
+        offset = self.index().get(user_id)
+        if offset is None:
+            return None
+        return decode_record(self.raw_record_at(offset))[1]
+
+
+class SnapshotStorage(Storage):
+    """Users in one binary snapshot, loaded lazily through its index; changes go to the journal.
+
+    Only the index is read at startup. Between snapshots, the operations of every change
+    (an appended turn, a card set or unset, a replaced list of notes) are appended to the
+    journal and kept per user, to be applied on top of the snapshot when a user is loaded.
+    Whole records are only encoded when a snapshot is written. Once the journal reaches
+    compact_bytes a new snapshot is written (in an executor): unchanged records are copied
+    from the old file by offset, only changed users are decoded and re-encoded. Without a
+    journal every write is a new snapshot.
+    """
+
+    lazy = True
+
+    def __init__(self, path, journal=None, compact_bytes=JOURNAL_COMPACT_BYTES):
+        self.path = path
+        self.journal = journal
+        self.compact_bytes = compact_bytes
+        self._reader = None
+        self._ops = {}          # user_id -> operations that are not in the snapshot file yet
+        self._writing = []      # snapshots prepared but not yet on disk, oldest first
+        # Held by load_user() and while the current file is swapped; commits wait for their turn on it
+        self._lock = threading.Lock()
+        self._turn = threading.Condition(self._lock)
+
+    def is_empty(self):
+        return not os.path.exists(self.path)
+
+    def load_all(self):
+        """Read the snapshot's index and replay the journal; users are loaded on demand with load_user()."""
+        journal_seq = 0
+        if not os.path.exists(self.path):
+            print(f"{self.path} does not exist. Initializing empty data.")
+        else:
+            print(f"Loading the index of {self.path}...")
+            if self._reader:
+                self._reader.close()
+            self._reader = SnapshotReader(self.path)
+            self._reader.index()
+            journal_seq = self._reader.journal_seq
+        if self.journal:
+            for ops in self.journal.replay(journal_seq):
+                self._note_ops(ops)
+            if self.journal.stats["replayed"]:
+                print(f"Replayed {self.journal.stats['replayed']} journal records from {self.journal.path}")
+            self.journal.open()
+        return {name: {} for name in SECTIONS}
+
+    def user_ids(self):
+        """Ids of the users in the snapshot or in pending changes (some may have been cleared since)."""
+        with self._lock:
+            users = dict.fromkeys(self._reader.index() if self._reader else ())
+            for write in self._writing:
+                users.update(dict.fromkeys(write["encoded"]))
+                users.update(dict.fromkeys(write["ops"]))
+            users.update(dict.fromkeys(self._ops))
+        return list(users)
+
+    def load_user(self, user_id):
+        """Return the record of one user (snapshot plus pending changes), or None if the user has no data."""
+        with self._lock:
+            record = self._reader.read_user(user_id) if self._reader else None
+            for write in self._writing:
+                if user_id in write["encoded"]:
+                    encoded = write["encoded"][user_id]
+                    record = decode_record(encoded)[1] if encoded else None
+                elif user_id in write["ops"]:
+                    record = apply_user_ops(user_id, record, write["ops"][user_id])
+            if user_id in self._ops:
+                record = apply_user_ops(user_id, record, self._ops[user_id])
+        return record
+
+    def _note_ops(self, ops):
+        for op in ops:
+            self._ops.setdefault(op["user"], []).append(op)
+
+    def journal_write(self, ops):
+        if self.journal is None:
+            return False
+        self.journal.append(ops)
+        # Copies, like the journal line: the values are live lists and dicts that keep changing
+        self._note_ops(copy.deepcopy(ops))
+        return True
+
+    def journal_size(self):
+        return self.journal.size() if self.journal else 0
+
+    def _snapshot_due(self):
+        if self.journal is None:
+            return True
+        # One snapshot at a time with a journal: rotating it again before the first is on disk could drop records
+        return not self._writing and (self._reader is None or self.journal.size() >= self.compact_bytes)
+
+    def prepare(self, sections, dirty_users):
+        """Journal the records of the dirty users, or encode them for a new snapshot (called on the event loop).
+
+        Changes are journaled as they happen (see data_manager), so between snapshots only
+        the few users changed without an operation, like a legacy history moved on load,
+        are dirty and journaled as whole records.
+        """
+        if not self._snapshot_due():
+            size = self.journal.size()
+            ops = [
+                {"op": "put", "user": user_id, "value": user_record(sections, user_id)}
+                for user_id in dirty_users
+            ]
+            if ops:
+                self.journal_write(ops)
+            return ("journal", self.journal.size() - size)
+        encoded = {}
+        for user_id in dirty_users:
+            record = user_record(sections, user_id)
+            encoded[user_id] = encode_record(user_id, record) if record else None
+        write = {
+            "encoded": encoded,
+            "ops": self._ops,
+            # Everything journaled so far is in this snapshot
+            "journal_seq": self.journal.rotate() if self.journal else 0,
+        }
+        self._ops = {}
+        with self._lock:
+            self._writing.append(write)
+        return ("snapshot", write)
+
+    def commit(self, payload):
+        """Write a prepared snapshot to disk (blocking, runs in an executor)."""
+        kind, value = payload
+        if kind == "journal":
+            return value
+        with self._turn:
+            self._turn.wait_for(lambda: self._writing[0] is value)
+        try:
+            written = self._write_snapshot(value)
+        except BaseException:
+            with self._turn:
+                self._writing.remove(value)
+                self._restore(value)
+                self._turn.notify_all()
+            raise
+        if self.journal:
+            self.journal.discard_rotated()
+        return written
+
+    def _write_snapshot(self, write):
+        encoded, ops = write["encoded"], write["ops"]
+        old = SnapshotReader(self.path) if os.path.exists(self.path) else None
+
+        def updated(user_id):
+            if user_id in encoded:
+                return encoded[user_id]
+            record = apply_user_ops(user_id, old.read_user(user_id) if old else None, ops[user_id])
+            return encode_record(user_id, record) if record else None
+
+        def records():
+            index = old.index() if old else {}
+            for user_id, offset in index.items():
+                if user_id in encoded or user_id in ops:
+                    record = updated(user_id)
+                    if record:
+                        yield user_id, record
+                else:
+                    yield user_id, old.raw_record_at(offset)
+            for user_id in {**dict.fromkeys(encoded), **dict.fromkeys(ops)}:
+                if user_id not in index:
+                    record = updated(user_id)
+                    if record:
+                        yield user_id, record
+
+        try:
+            written = write_atomic(self.path, snapshot_chunks(records(), write["journal_seq"]))
+        finally:
+            if old:
+                old.close()
+        reader = SnapshotReader(self.path)
+        reader.index()
+        with self._turn:
+            previous, self._reader = self._reader, reader
+            self._writing.remove(write)
+            self._turn.notify_all()
+        if previous:
+            previous.close()
+        return written
+
+    def _restore(self, write):
+        """Put the changes of a snapshot that could not be written back in front of the newer ones."""
+        changes = {user_id: list(user_ops) for user_id, user_ops in write["ops"].items()}
+        for user_id, encoded in write["encoded"].items():
+            changes[user_id] = [{"op": "put", "user": user_id, "value": decode_record(encoded)[1] if encoded else {}}]
+        for user_id, user_ops in self._ops.items():
+            changes.setdefault(user_id, []).extend(user_ops)
+        self._ops = changes
+
+    def close(self):
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+        if self.journal:
+            self.journal.close()
+
+
+def json_to_snapshot(json_path, snapshot_path):
+    """Convert a bot_data.json document to a snapshot file; returns the number of users."""
+    with open(json_path, "r") as f:
+        data = json.load(f)
+    sections = {name: data.get(name, {}) for name in SECTIONS}
+    users = sorted({user_id for section in sections.values() for user_id in section})
+    records = ((user_id, encode_record(user_id, user_record(sections, user_id))) for user_id in users)
+    write_atomic(snapshot_path, snapshot_chunks(records, data.get("journal_seq", 0)))
+    return len(users)
+
+
+def snapshot_to_json(snapshot_path, json_path):
+    """Convert a snapshot file back to a bot_data.json document; returns the number of users."""
+    sections = {name: {} for name in SECTIONS}
+    with SnapshotReader(snapshot_path) as reader:
+        for user_id, record in reader.records():
+            for name, value in record.items():
+                sections[name][user_id] = value
+        document = dict(sections)
+        document["journal_seq"] = reader.journal_seq
+    write_atomic(json_path, json.dumps(document))
+    return len({user_id for section in sections.values() for user_id in section})
+
+
+def main():
+    if len(sys.argv) != 4 or sys.argv[1] not in ("to-snapshot", "to-json"):
+        print("Usage: python -m snapshot to-snapshot|to-json <source> <target>")
+        sys.exit(2)
+    command, source, target = sys.argv[1:]
+    convert = json_to_snapshot if command == "to-snapshot" else snapshot_to_json
+    count = convert(source, target)
+    print(f"Wrote {count} users to {target} ({os.path.getsize(target)} bytes, source {os.path.getsize(source)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# srs.py
+import heapq
+
+# SM-2 constants
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+DAY = 24 * 60 * 60
+
+# Answer quality on SM-2's 0-5 scale
+QUALITY_CORRECT = 4
+QUALITY_CLOSE = 3
+QUALITY_WRONG = 1
+
+
+def new_schedule():
+    """Scheduling state of a card that was never reviewed (due right away)."""
+    return {"interval": 0, "ease": DEFAULT_EASE, "reps": 0, "due": 0}
+
+
+def review(schedule, quality, now):
+    """Apply one SM-2 review with the given quality (0-5) to a schedule, in place."""
+    if quality < 3:
+        # Forgotten: start the repetitions again
+        schedule["reps"] = 0
+        schedule["interval"] = 1
+    else:
+        schedule["reps"] += 1
+        if schedule["reps"] == 1:
+            schedule["interval"] = 1
+        elif schedule["reps"] == 2:
+            schedule["interval"] = 6
+        else:
+            schedule["interval"] = round(schedule["interval"] * schedule["ease"])
+    schedule["ease"] = max(MIN_EASE, schedule["ease"] + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    schedule["due"] = now + schedule["interval"] * DAY
+    return schedule
+
+
+def build_due_heap(cards, schedules):
+    """Build a min-heap of (due, card) for every card of a deck."""
+    heap = [(schedules[card]["due"] if card in schedules else 0, card) for card in cards]
+    heapq.heapify(heap)
+    return heap
+
+
+def push_due(heap, due, card):
+    """Add a (possibly updated) due time for a card; older entries of the card become stale."""
+    heapq.heappush(heap, (due, card))
+
+
+def next_due(heap, count, cards, schedules):
+    """Return up to count cards with the earliest due times, in O(count log n).
+
+    Stale entries (deleted cards or outdated due times) are dropped on the way. The
+    returned cards stay in the heap until a review pushes their new due time.
+    """
+    selected = []
+    seen = set()
+    taken = []
+    while heap and len(selected) < count:
+        due, card = heapq.heappop(heap)
+        current = schedules[card]["due"] if card in schedules else 0
+        if card not in cards or current != due or card in seen:
+            continue
+        selected.append(card)
+        seen.add(card)
+        taken.append((due, card))
+    for entry in taken:
+        heapq.heappush(heap, entry)
+    return selected
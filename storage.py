@@ -0,0 +1,442 @@
+# storage.py
+import os
+import json
+import sqlite3
+import tempfile
+import threading
+from urllib.parse import quote, unquote
+from journal import apply_ops
+
+# Sections of the dataset, in the order they appear in bot_data.json
+SECTIONS = (
+    "conversation_context",
+    "user_notes",
+    "user_settings",
+    "flashcards",
+    "conversation_summaries",
+    "flashcard_log",
+    "flashcard_stats",
+    "flashcard_schedules",
+)
+# Sections with their own SQLite table; the others are stored as one JSON document per user
+TABLE_SECTIONS = ("conversation_context", "user_notes", "user_settings", "flashcards", "flashcard_log")
+# Append-only sections and the column holding each JSON entry
+LOG_TABLES = {"conversation_context": "turn", "flashcard_log": "entry"}
+
+
+def write_atomic(path, payload):
+    """Write payload to a temporary file next to path, then rename it over path.
+
+    payload is a str, bytes, or an iterable of bytes chunks written as they are produced.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w" if isinstance(payload, str) else "wb") as f:
+            if isinstance(payload, (str, bytes)):
+                written = f.write(payload)
+            else:
+                written = sum(f.write(chunk) for chunk in payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return written
+
+
+class Storage:
+    """Defaults shared by the storage backends."""
+
+    # True if users are loaded one by one with load_user() instead of all at once
+    lazy = False
+
+    def journal_write(self, ops):
+        """Record small changes in an append-only journal; False if the backend has none."""
+        return False
+
+    def journal_size(self):
+        """Bytes in the journal since the last snapshot."""
+        return 0
+
+    def log_truncated(self, user_id, section):
+        """Entries were removed from the front of a user's append-only section."""
+
+    def close(self):
+        pass
+
+
+class JsonStorage(Storage):
+    """Whole dataset in a single JSON document, loaded eagerly and rewritten on every flush.
+
+    Each user's value in each section is kept encoded, and only the users changed since the
+    last flush are encoded again on the event loop; the document is assembled from the
+    encoded values and written in the executor.
+
+    With a journal, history and flashcard-interaction appends go to the journal instead,
+    and each rewrite of the document (a snapshot) compacts the journal.
+    """
+
+    def __init__(self, path, journal=None):
+        self.path = path
+        self.journal = journal
+        # section -> {user_id: JSON text of the user's value}
+        self._encoded = {name: {} for name in SECTIONS}
+        # Users changed through the journal since the last prepare(): their encoded values are stale
+        self._stale = set()
+
+    def load_all(self):
+        """Return every section of the JSON document, with the journal replayed on top."""
+        data = {}
+        if not os.path.exists(self.path):
+            print(f"{self.path} does not exist. Initializing empty data.")
+        else:
+            print(f"Loading data from {self.path}...")
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        sections = {name: data.get(name, {}) for name in SECTIONS}
+        if self.journal:
+            for ops in self.journal.replay(data.get("journal_seq", 0)):
+                apply_ops(sections, ops)
+            if self.journal.stats["replayed"]:
+                print(f"Replayed {self.journal.stats['replayed']} journal records from {self.journal.path}")
+            self.journal.open()
+        # Encoded once at startup, so a flush only encodes the users changed since the last one
+        self._encoded = {
+            name: {user_id: json.dumps(value) for user_id, value in section.items()}
+            for name, section in sections.items()
+        }
+        return sections
+
+    def load_user(self, user_id):
+        """Every user is resident after load_all(), so there is nothing to load lazily."""
+        return None
+
+    def journal_write(self, ops):
+        if self.journal is None:
+            return False
+        self.journal.append(ops)
+        self._stale.update(op["user"] for op in ops)
+        return True
+
+    def journal_size(self):
+        return self.journal.size() if self.journal else 0
+
+    def prepare(self, sections, dirty_users):
+        """Encode the changed users (called on the event loop); the document is assembled in commit()."""
+        for user_id in self._stale.union(dirty_users):
+            for name in SECTIONS:
+                if user_id in sections[name]:
+                    self._encoded[name][user_id] = json.dumps(sections[name][user_id])
+                else:
+                    self._encoded[name].pop(user_id, None)
+        self._stale.clear()
+        # Everything journaled so far is in memory, hence in this snapshot
+        journal_seq = self.journal.rotate() if self.journal else None
+        # Shallow copies: the next prepare() replaces entries while this document is being written
+        return {name: dict(encoded) for name, encoded in self._encoded.items()}, journal_seq
+
+    @staticmethod
+    def _document_chunks(encoded, journal_seq):
+        yield b"{"
+        for position, name in enumerate(SECTIONS):
+            yield f'{", " if position else ""}"{name}": {{'.encode()
+            yield ", ".join(f"{json.dumps(user_id)}: {value}" for user_id, value in encoded[name].items()).encode()
+            yield b"}"
+        if journal_seq is not None:
+            yield f', "journal_seq": {journal_seq}'.encode()
+        yield b"}"
+
+    def commit(self, payload):
+        """Write a prepared document to disk (blocking, runs in an executor)."""
+        written = write_atomic(self.path, self._document_chunks(*payload))
+        if self.journal:
+            self.journal.discard_rotated()
+        return written
+
+    def close(self):
+        if self.journal:
+            self.journal.close()
+
+
+class ShardedJsonStorage(Storage):
+    """One JSON file per user in a directory, loaded lazily and written only for dirty users."""
+
+    lazy = True
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, user_id):
+        return os.path.join(self.directory, quote(user_id, safe="") + ".json")
+
+    def load_all(self):
+        """Users are loaded on demand with load_user()."""
+        return {name: {} for name in SECTIONS}
+
+    def user_ids(self):
+        """Return the ids of every user with a shard on disk."""
+        return [unquote(name[:-5]) for name in os.listdir(self.directory) if name.endswith(".json")]
+
+    def is_empty(self):
+        """Return True if no user has a shard yet."""
+        return not self.user_ids()
+
+    def load_user(self, user_id):
+        """Return the record of one user, or None if the user has no shard."""
+        path = self._path(user_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def prepare(self, sections, dirty_users):
+        """Serialize the shards of the dirty users (called on the event loop)."""
+        payload = []
+        for user_id in dirty_users:
+            record = {name: sections[name][user_id] for name in SECTIONS if user_id in sections[name]}
+            payload.append((user_id, json.dumps(record) if record else None))
+        return payload
+
+    def commit(self, payload):
+        """Write or remove each prepared shard (blocking, runs in an executor)."""
+        written = 0
+        for user_id, data in payload:
+            path = self._path(user_id)
+            if data is None:
+                if os.path.exists(path):
+                    os.remove(path)
+            else:
+                written += write_atomic(path, data)
+        return written
+
+
+class SQLiteStorage(Storage):
+    """Per-user rows in SQLite (WAL mode), loaded lazily and written only for dirty users."""
+
+    lazy = True
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # The connection is shared between the event loop thread and executor threads
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS conversation_context (
+                user_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                turn TEXT NOT NULL,
+                PRIMARY KEY (user_id, position)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS flashcard_log (
+                user_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                entry TEXT NOT NULL,
+                PRIMARY KEY (user_id, position)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS user_notes (
+                user_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                note TEXT NOT NULL,
+                PRIMARY KEY (user_id, position)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS user_settings (
+                user_id TEXT PRIMARY KEY,
+                settings TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS flashcards (
+                user_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                italian TEXT NOT NULL,
+                english TEXT NOT NULL,
+                PRIMARY KEY (user_id, position)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS user_documents (
+                user_id TEXT NOT NULL,
+                section TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (user_id, section)
+            ) WITHOUT ROWID;
+            """
+        )
+        self._conn.commit()
+        # Rows already stored per (log section, user), so appends only insert the tail
+        self._log_lengths = {}
+        # (log section, user) whose rows must all be rewritten on the next write (positions shifted)
+        self._rewrite_logs = set()
+
+    def load_all(self):
+        """Users are loaded on demand with load_user()."""
+        return {name: {} for name in SECTIONS}
+
+    def user_ids(self):
+        """Return the ids of every user with stored data."""
+        query = " UNION ".join(f"SELECT user_id FROM {name}" for name in TABLE_SECTIONS + ("user_documents",))
+        with self._lock:
+            return [user_id for (user_id,) in self._conn.execute(query)]
+
+    def is_empty(self):
+        """Return True if no user has any stored data yet."""
+        with self._lock:
+            for name in TABLE_SECTIONS + ("user_documents",):
+                if self._conn.execute(f"SELECT 1 FROM {name} LIMIT 1").fetchone():
+                    return False
+        return True
+
+    def load_user(self, user_id):
+        """Return the record of one user, or None if the user has no stored data."""
+        with self._lock:
+            logs = {
+                name: self._conn.execute(
+                    f"SELECT {column} FROM {name} WHERE user_id = ? ORDER BY position", (user_id,)
+                ).fetchall()
+                for name, column in LOG_TABLES.items()
+            }
+            notes = self._conn.execute(
+                "SELECT note FROM user_notes WHERE user_id = ? ORDER BY position", (user_id,)
+            ).fetchall()
+            settings = self._conn.execute(
+                "SELECT settings FROM user_settings WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            cards = self._conn.execute(
+                "SELECT italian, english FROM flashcards WHERE user_id = ? ORDER BY position", (user_id,)
+            ).fetchall()
+            documents = self._conn.execute(
+                "SELECT section, data FROM user_documents WHERE user_id = ?", (user_id,)
+            ).fetchall()
+        for name, rows in logs.items():
+            self._log_lengths[name, user_id] = len(rows)
+        if not (any(logs.values()) or notes or settings or cards or documents):
+            return None
+        record = {name: [json.loads(row) for (row,) in rows] for name, rows in logs.items()}
+        record["user_notes"] = [note for (note,) in notes]
+        record["flashcards"] = {italian: english for italian, english in cards}
+        if settings:
+            record["user_settings"] = json.loads(settings[0])
+        for section, data in documents:
+            if section in SECTIONS:
+                record[section] = json.loads(data)
+        return record
+
+    def prepare(self, sections, dirty_users):
+        """Snapshot the rows of the dirty users (called on the event loop)."""
+        payload = []
+        for user_id in dirty_users:
+            logs = {}
+            for name in LOG_TABLES:
+                entries = sections[name].get(user_id, [])
+                stored = self._log_lengths.get((name, user_id), 0)
+                # Logs only grow between clears and trims, so only the new entries need inserting
+                start = stored if len(entries) >= stored else 0
+                if (name, user_id) in self._rewrite_logs:
+                    self._rewrite_logs.discard((name, user_id))
+                    start = 0
+                logs[name] = (start, [
+                    (user_id, position, json.dumps(entry)) for position, entry in enumerate(entries[start:], start)
+                ])
+            settings = sections["user_settings"].get(user_id)
+            payload.append((
+                user_id,
+                logs,
+                [(user_id, position, note) for position, note in enumerate(sections["user_notes"].get(user_id, []))],
+                json.dumps(settings) if settings is not None else None,
+                [
+                    (user_id, position, italian, english)
+                    for position, (italian, english) in enumerate(sections["flashcards"].get(user_id, {}).items())
+                ],
+                [
+                    (user_id, name, json.dumps(sections[name][user_id]))
+                    for name in SECTIONS
+                    if name not in TABLE_SECTIONS and user_id in sections[name]
+                ],
+            ))
+        return payload
+
+    def commit(self, payload):
+        """Write prepared rows in one transaction (blocking, runs in an executor)."""
+        written = 0
+        with self._lock, self._conn:
+            for user_id, logs, notes, settings, cards, documents in payload:
+                for name, (start, rows) in logs.items():
+                    self._conn.execute(f"DELETE FROM {name} WHERE user_id = ? AND position >= ?", (user_id, start))
+                    self._conn.executemany(f"INSERT INTO {name} VALUES (?, ?, ?)", rows)
+                    written += sum(len(row[2]) for row in rows)
+                self._conn.execute("DELETE FROM user_notes WHERE user_id = ?", (user_id,))
+                self._conn.executemany("INSERT INTO user_notes VALUES (?, ?, ?)", notes)
+                if settings is None:
+                    self._conn.execute("DELETE FROM user_settings WHERE user_id = ?", (user_id,))
+                else:
+                    self._conn.execute("INSERT OR REPLACE INTO user_settings VALUES (?, ?)", (user_id, settings))
+                self._conn.execute("DELETE FROM flashcards WHERE user_id = ?", (user_id,))
+                self._conn.executemany("INSERT INTO flashcards VALUES (?, ?, ?, ?)", cards)
+                self._conn.execute("DELETE FROM user_documents WHERE user_id = ?", (user_id,))
+                self._conn.executemany("INSERT INTO user_documents VALUES (?, ?, ?)", documents)
+                written += sum(len(row[2]) for row in notes) + len(settings or "")
+                written += sum(len(row[2]) + len(row[3]) for row in cards)
+                written += sum(len(row[2]) for row in documents)
+        for user_id, logs, *_ in payload:
+            for name, (start, rows) in logs.items():
+                self._log_lengths[name, user_id] = start + len(rows)
+        return written
+
+    def log_truncated(self, user_id, section):
+        """The stored positions no longer match the list: rewrite the whole log next time."""
+        if section in LOG_TABLES:
+            self._rewrite_logs.add((section, user_id))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def migrate_json(json_path, storage, journal=None):
+    """Copy every user of an existing bot_data.json (and its journal) into storage (one-shot migration)."""
+    sections = JsonStorage(json_path, journal).load_all()
+    users = set()
+    for name in SECTIONS:
+        users.update(sections[name])
+    storage.commit(storage.prepare(sections, users))
+    return len(users)
+
+
+BACKENDS = ("json", "snapshot", "sharded", "sqlite")
+
+
+def open_storage(backend, path, journal=None):
+    """Storage of backend at path: the JSON document, snapshot file, SQLite file or shard directory."""
+    if backend == "json":
+        return JsonStorage(path, journal)
+    if backend == "snapshot":
+        # Imported here: snapshot.py builds on this module
+        from snapshot import SnapshotStorage
+        return SnapshotStorage(path, journal)
+    if backend == "sqlite":
+        return SQLiteStorage(path)
+    if backend == "sharded":
+        return ShardedJsonStorage(path)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend!r} (expected one of {', '.join(BACKENDS)})")
+
+
+def create_storage(backend, data_file, sqlite_file, shard_dir, journal=None, snapshot_file=None):
+    """Build the storage backend selected in the configuration (the journal is used with json and snapshot only)."""
+    if backend == "json":
+        return JsonStorage(data_file, journal)
+    target = {"snapshot": snapshot_file, "sqlite": sqlite_file, "sharded": shard_dir}.get(backend)
+    storage = open_storage(backend, target, journal)
+    if storage.is_empty() and os.path.exists(data_file):
+        print(f"Migrating {data_file} to {target}...")
+        count = migrate_json(data_file, storage, journal)
+        os.replace(data_file, data_file + ".migrated")
+        if journal:
+            journal.close()
+            for path in (journal.path, journal.old_path):
+                if os.path.exists(path):
+                    os.replace(path, path + ".migrated")
+        print(f"Migrated {count} users. The old file was kept as {data_file}.migrated")
+    return storage
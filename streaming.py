@@ -0,0 +1,79 @@
+# streaming.py
+import time
+from telegram.error import BadRequest
+from config import STREAM_EDIT_INTERVAL
+from outbound import outbox, STREAM
+
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+PLACEHOLDER = "…"
+# Shown instead of an empty answer, which Telegram would reject
+EMPTY_ANSWER = "Sorry, I couldn't generate a response."
+
+
+def split_text(text, limit=MAX_MESSAGE_LENGTH):
+    """Split text in two at the last newline or space before limit (hard cut if there is none)."""
+    if len(text) <= limit:
+        return text, ""
+    cut = text.rfind("\n", 0, limit)
+    if cut <= 0:
+        cut = text.rfind(" ", 0, limit)
+    if cut <= 0:
+        cut = limit
+    return text[:cut], text[cut:].lstrip()
+
+
+async def _edit(message, text):
+    """Edit message, ignoring Telegram's complaint when the text did not change."""
+    try:
+        await message.edit_text(text)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+
+
+async def stream_reply(message, chunks):
+    """Show an async stream of text chunks as a reply to message, editing it at a limited rate.
+
+    Intermediate edits go through the outbox in the STREAM lane without being awaited, so
+    a rate-limited chat does not slow down reading the stream; while one is still queued,
+    later ones are skipped. Returns the complete text once the stream is exhausted.
+    """
+    chat_id = message.chat_id
+    reply = await outbox.send(chat_id, message.reply_text, PLACEHOLDER)
+    parts = []          # Every chunk received so far
+    segment = ""        # Text of the message currently being edited
+    shown = PLACEHOLDER
+    last_edit = time.monotonic()
+    pending_edit = None
+
+    async for chunk in chunks:
+        parts.append(chunk)
+        segment += chunk
+        # Finish full messages and continue the answer in a new one
+        while len(segment) > MAX_MESSAGE_LENGTH:
+            head, segment = split_text(segment)
+            if head != shown:
+                outbox.send(chat_id, _edit, reply, head, lane=STREAM)
+            # One chunk can hold several messages' worth: the new message starts with what fits
+            shown = split_text(segment)[0] or PLACEHOLDER
+            reply = await outbox.send(chat_id, message.reply_text, shown, lane=STREAM)
+            last_edit = time.monotonic()
+        if (
+            segment.strip() and segment != shown and time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL
+            and (pending_edit is None or pending_edit.done())
+        ):
+            pending_edit = outbox.send(chat_id, _edit, reply, segment, lane=STREAM)
+            shown = segment
+            last_edit = time.monotonic()
+
+    text = "".join(parts)
+    # The final state of the answer is what the user is waiting for
+    if segment.strip() and segment != shown:
+        await outbox.send(chat_id, _edit, reply, segment)
+    elif not text.strip():
+        await outbox.send(chat_id, _edit, reply, EMPTY_ANSWER)
+    elif not segment.strip():
+        # Only whitespace was left after the last split
+        await outbox.send(chat_id, reply.delete)
+    return text
@@ -0,0 +1,111 @@
+import unittest
+from unittest import mock
+import context_builder
+from context_builder import build_context, estimate_tokens, render_turn
+
+
+def turn(number):
+    return {"user": f"question {number:03d}", "ai": f"answer {number:03d}", "ts": float(number)}
+
+
+class FakeLLM:
+    def __init__(self):
+        self.prompts = []
+
+    async def ainvoke(self, prompt):
+        self.prompts.append(prompt)
+        return " The user asked many questions. "
+
+
+class ContextBuilderTest(unittest.IsolatedAsyncioTestCase):
+    """build_context against an in-memory history, with a budget of ten rendered turns."""
+
+    def setUp(self):
+        self.history = []
+        self.summary = {"text": "", "covered": 0}
+        self.version = 0
+        self.scheduled = []
+        turn_cost = estimate_tokens(render_turn(turn(0)))
+        patches = [
+            mock.patch.object(context_builder, "get_conversation_history", lambda user_id: self.history),
+            mock.patch.object(context_builder, "get_conversation_summary", lambda user_id: self.summary),
+            mock.patch.object(context_builder, "set_conversation_summary", self.set_summary),
+            mock.patch.object(context_builder, "history_version", lambda user_id: self.version),
+            mock.patch.object(context_builder, "CONTEXT_TOKEN_BUDGET", turn_cost * 10),
+            mock.patch.object(context_builder, "CONTEXT_RECENT_TURNS", 3),
+            mock.patch.object(context_builder, "SUMMARY_BATCH_TURNS", 5),
+            mock.patch.dict(context_builder._context_cache, clear=True),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def set_summary(self, user_id, text, covered):
+        self.summary = {"text": text, "covered": covered}
+
+    def add_turns(self, count):
+        for _ in range(count):
+            self.history.append(turn(len(self.history)))
+        self.version += 1
+
+    def build(self):
+        with mock.patch.object(context_builder, "_schedule_summary", lambda user_id, llm: self.scheduled.append(user_id)):
+            return build_context("1", None)
+
+    def test_short_history_is_kept_whole(self):
+        self.add_turns(4)
+        context = self.build()
+        self.assertEqual(context, "".join(render_turn(entry) for entry in self.history))
+        self.assertEqual(self.scheduled, [])
+
+    def test_oldest_turns_are_dropped_for_the_budget(self):
+        self.add_turns(12)
+        context = self.build()
+        self.assertNotIn("question 001", context)
+        self.assertIn("question 002", context)
+        self.assertTrue(context.endswith(render_turn(self.history[-1])))
+        self.assertLessEqual(estimate_tokens(context), context_builder.CONTEXT_TOKEN_BUDGET + 10)
+
+    def test_recent_turns_are_kept_over_budget(self):
+        self.history.append({"user": "x" * 1000, "ai": "y" * 1000, "ts": 0.0})
+        self.add_turns(2)
+        context = self.build()
+        self.assertIn("x" * 1000, context)
+
+    def test_summary_replaces_the_turns_it_covers(self):
+        self.add_turns(8)
+        self.summary = {"text": "Earlier small talk.", "covered": 5}
+        context = self.build()
+        self.assertTrue(context.startswith("\nSummary of earlier conversation: Earlier small talk."))
+        self.assertNotIn("question 004", context)
+        self.assertIn("question 005", context)
+
+    def test_summary_waits_for_a_full_batch_of_dropped_turns(self):
+        # Ten turns fit: four dropped turns are fewer than a batch
+        self.add_turns(14)
+        self.build()
+        self.assertEqual(self.scheduled, [])
+        self.add_turns(1)
+        self.build()
+        self.assertEqual(self.scheduled, ["1"])
+
+    def test_context_is_cached_until_the_history_changes(self):
+        self.add_turns(3)
+        first = self.build()
+        self.history.append(turn(99))
+        self.assertIs(self.build(), first)
+        self.version += 1
+        self.assertIn("question 099", self.build())
+
+    async def test_summary_covers_the_turns_before_the_recent_window(self):
+        self.add_turns(20)
+        llm = FakeLLM()
+        context_builder._schedule_summary("1", llm)
+        await context_builder._summary_tasks.pop()
+        self.assertEqual(self.summary, {"text": "The user asked many questions.", "covered": 17})
+        self.assertIn("question 016", llm.prompts[0])
+        self.assertNotIn("question 017", llm.prompts[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import data_manager
+from journal import Journal
+from srs import QUALITY_CORRECT
+from storage import JsonStorage, ShardedJsonStorage
+
+
+class DataManagerTestCase(unittest.TestCase):
+    """data_manager with empty in-memory data, written synchronously to a temporary bot_data.json."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = self.make_storage(directory.name)
+        self.addCleanup(self.storage.close)
+        patch = mock.patch.object(data_manager, "_storage", self.storage)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(self.clear)
+        self.clear()
+
+    def make_storage(self, directory):
+        return JsonStorage(os.path.join(directory, "bot_data.json"))
+
+    def clear(self):
+        for section in data_manager._sections().values():
+            section.clear()
+        for state in (data_manager._due_heaps, data_manager._note_indexes, data_manager._resident,
+                      data_manager._dirty_users, data_manager._evicting_users, data_manager._flushing_users):
+            state.clear()
+
+
+class FlashcardStatsTest(DataManagerTestCase):
+    def test_deleting_a_card_drops_its_stats(self):
+        data_manager.add_flashcard("1", "casa", "house")
+        data_manager.add_flashcard("1", "cane", "dog")
+        data_manager.add_flashcard_interaction("1", {"casa": "house"}, "house", True)
+        data_manager.add_flashcard_interaction("1", {"cane": "dog"}, "cat", False)
+        self.assertEqual(set(data_manager.get_flashcard_stats("1")), {"casa", "cane"})
+        data_manager.delete_flashcard("1", "casa")
+        self.assertEqual(set(data_manager.get_flashcard_stats("1")), {"cane"})
+        self.assertNotIn("casa", data_manager.flashcard_stats["1"])
+
+    def test_answer_to_a_deleted_card_is_not_reported(self):
+        data_manager.add_flashcard("1", "casa", "house")
+        data_manager.delete_flashcard("1", "casa")
+        # A study session still holding the card
+        data_manager.add_flashcard_interaction("1", {"casa": "house"}, "house", True)
+        self.assertEqual(data_manager.get_flashcard_stats("1"), {})
+        self.assertEqual(len(data_manager.flashcard_log["1"]), 1)
+
+    def test_stats_count_attempts_and_correct_answers(self):
+        data_manager.add_flashcard("1", "casa", "house")
+        for correct in (True, False, True):
+            data_manager.add_flashcard_interaction("1", {"casa": "house"}, "house", correct)
+        stats = data_manager.get_flashcard_stats("1")["casa"]
+        self.assertEqual((stats["attempts"], stats["correct"]), (3, 2))
+
+
+class ReviewFlashcardTest(DataManagerTestCase):
+    def test_review_schedules_the_card(self):
+        data_manager.add_flashcard("1", "casa", "house")
+        data_manager.add_flashcard("1", "cane", "dog")
+        data_manager.review_flashcard("1", "casa", QUALITY_CORRECT)
+        self.assertEqual(data_manager.flashcard_schedules["1"]["casa"]["interval"], 1)
+        # The reviewed card is due tomorrow, the new one right away
+        self.assertEqual(data_manager.get_due_flashcards("1", 2), [("cane", "dog"), ("casa", "house")])
+
+    def test_review_of_a_deleted_card_is_ignored(self):
+        data_manager.add_flashcard("1", "casa", "house")
+        data_manager.delete_flashcard("1", "casa")
+        data_manager.review_flashcard("1", "casa", QUALITY_CORRECT)
+        self.assertNotIn("casa", data_manager.flashcard_schedules.get("1", {}))
+
+
+class NoteSearchTest(DataManagerTestCase):
+    def test_index_follows_added_and_deleted_notes(self):
+        for note in ("ciao means hello", "grazie means thanks", "prego means you're welcome"):
+            data_manager.add_user_note("1", note)
+        self.assertEqual(data_manager.search_user_notes("1", "grazie"), [(1, "grazie means thanks")])
+        data_manager.delete_user_note("1", 0)
+        data_manager.add_user_note("1", "arrivederci means goodbye")
+        self.assertEqual(data_manager.search_user_notes("1", "prego"), [(1, "prego means you're welcome")])
+        self.assertEqual(data_manager.search_user_notes("1", "goodbye"), [(2, "arrivederci means goodbye")])
+        self.assertEqual(data_manager.search_user_notes("1", "ciao"), [])
+
+
+class JournaledChangesTest(DataManagerTestCase):
+    """Every change is one journal append; nothing is left for a full write."""
+
+    def make_storage(self, directory):
+        path = os.path.join(directory, "bot_data.json")
+        storage = JsonStorage(path, Journal(path + ".journal"))
+        storage.load_all()
+        return storage
+
+    def test_changes_are_journaled_and_replayed(self):
+        data_manager.add_user_note("1", "ciao means hello")
+        data_manager.add_user_note("1", "grazie means thanks")
+        data_manager.delete_user_note("1", 0)
+        data_manager.get_user_settings("1")["mode"] = "language_learning"
+        data_manager.mark_dirty("1", "user_settings")
+        data_manager.add_flashcard("1", "casa", "house")
+        data_manager.bulk_upsert_flashcards("1", {"cane": "dog", "gatto": "cat"})
+        data_manager.review_flashcard("1", "casa", QUALITY_CORRECT)
+        data_manager.add_flashcard_interaction("1", {"gatto": "cat"}, "cat", True)
+        data_manager.delete_flashcard("1", "gatto")
+        data_manager.set_conversation_summary("1", "Greetings.", 0)
+        self.assertEqual(data_manager._dirty_users, set())
+        self.assertFalse(os.path.exists(self.storage.path))
+        expected = {name: section.get("1") for name, section in data_manager._sections().items()}
+        self.storage.close()
+        reloaded = JsonStorage(self.storage.path, Journal(self.storage.path + ".journal"))
+        sections = reloaded.load_all()
+        reloaded.close()
+        self.assertEqual({name: section.get("1") for name, section in sections.items()}, expected)
+
+
+class EvictionTest(DataManagerTestCase, unittest.IsolatedAsyncioTestCase):
+    """A lazy backend with room for two resident users."""
+
+    def make_storage(self, directory):
+        return ShardedJsonStorage(os.path.join(directory, "shards"))
+
+    def setUp(self):
+        super().setUp()
+        for name, value in (("MAX_RESIDENT_USERS", 2), ("EVICTION_MIN_IDLE", 0)):
+            patch = mock.patch.object(data_manager, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_least_recently_used_user_is_evicted_and_reloaded(self):
+        for user_id in ("1", "2", "3"):
+            data_manager.add_user_note(user_id, f"note of {user_id}")
+        self.assertEqual(data_manager.loaded_user_ids(), ["2", "3"])
+        self.assertNotIn("1", data_manager.user_notes)
+        self.assertEqual(data_manager.get_user_notes("1"), ["note of 1"])
+        self.assertEqual(data_manager.loaded_user_ids(), ["3", "1"])
+
+    async def test_dirty_user_is_dropped_after_the_background_flush(self):
+        data_manager.start_persistence()
+        self.addAsyncCleanup(data_manager.stop_persistence)
+        for user_id in ("1", "2", "3"):
+            data_manager.add_user_note(user_id, f"note of {user_id}")
+        # Not written yet: it stays in memory until the flush has written it
+        self.assertIn("1", data_manager._evicting_users)
+        self.assertIn("1", data_manager.user_notes)
+        await data_manager.flush_data()
+        self.assertNotIn("1", data_manager.user_notes)
+        self.assertEqual(self.storage.load_user("1")["user_notes"], ["note of 1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
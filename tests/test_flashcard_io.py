@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+from flashcard_io import MAX_FIELD_LENGTH, read_deck, write_deck
+
+
+class FlashcardIOTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "deck.csv")
+
+    def read(self, content, max_rows=100, encoding="utf-8"):
+        with open(self.path, "w", encoding=encoding, newline="") as f:
+            f.write(content)
+        return read_deck(self.path, max_rows)
+
+    def test_header_row_is_skipped(self):
+        deck, stats = self.read("Italian,English\ncasa,house\n")
+        self.assertEqual(deck, {"casa": "house"})
+        self.assertEqual(stats["rows"], 1)
+
+    def test_first_row_without_header_words_is_a_card(self):
+        deck, _ = self.read("casa,house\ncane,dog\n")
+        self.assertEqual(deck, {"casa": "house", "cane": "dog"})
+
+    def test_delimiter_is_sniffed(self):
+        self.assertEqual(self.read("casa\thouse, home\n")[0], {"casa": "house, home"})
+        self.assertEqual(self.read("casa;house\ncane;dog, hound\n")[0], {"casa": "house", "cane": "dog, hound"})
+
+    def test_last_duplicate_wins(self):
+        deck, stats = self.read("casa,house\nCasa , home\n")
+        self.assertEqual(deck, {"casa": "home"})
+        self.assertEqual(stats["duplicates"], 1)
+
+    def test_bad_rows_are_rejected_and_blank_rows_ignored(self):
+        deck, stats = self.read(f"casa\n,dog\n\n ,\ngatto,cat\nx,{'y' * (MAX_FIELD_LENGTH + 1)}\n")
+        self.assertEqual(deck, {"gatto": "cat"})
+        self.assertEqual((stats["rows"], stats["rejected"]), (4, 3))
+
+    def test_reading_stops_at_max_rows(self):
+        deck, stats = self.read("".join(f"word{number},meaning{number}\n" for number in range(10)), max_rows=3)
+        self.assertEqual(len(deck), 3)
+        self.assertTrue(stats["truncated"])
+
+    def test_byte_order_mark_and_quotes(self):
+        deck, _ = self.read('\ufeffitaliano,inglese\n"città","city, town"\n', encoding="utf-8")
+        self.assertEqual(deck, {"città": "city, town"})
+
+    def test_written_deck_reads_back(self):
+        cards = [("casa", "house"), ("perché", "why, because")]
+        self.assertEqual(write_deck(self.path, cards), 2)
+        deck, stats = read_deck(self.path, 100)
+        self.assertEqual(deck, dict(cards))
+        self.assertEqual(stats["rows"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import random
+import unittest
+from grading import CLOSE, CORRECT, WRONG, answer_variants, bounded_distance, grade, normalize, typo_allowance
+
+
+def reference_distance(a, b):
+    """Unbounded optimal string alignment distance, computed the textbook way."""
+    rows = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(len(a) + 1):
+        rows[i][0] = i
+    for j in range(len(b) + 1):
+        rows[0][j] = j
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            rows[i][j] = min(rows[i - 1][j] + 1, rows[i][j - 1] + 1, rows[i - 1][j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                rows[i][j] = min(rows[i][j], rows[i - 2][j - 2] + 1)
+    return rows[-1][-1]
+
+
+class NormalizeTest(unittest.TestCase):
+    def test_case_accents_punctuation_and_articles_are_ignored(self):
+        self.assertEqual(normalize("  The Café!  "), "cafe")
+        self.assertEqual(normalize("to eat"), "eat")
+        # A lone article is an answer, not a prefix
+        self.assertEqual(normalize("a"), "a")
+
+    def test_every_stored_meaning_is_accepted(self):
+        self.assertEqual(set(answer_variants("dog, hound / the mutt")), {"dog", "hound", "mutt", "dog hound the mutt"})
+
+
+class GradeTest(unittest.TestCase):
+    def test_exact_and_normalized_answers_are_correct(self):
+        self.assertEqual(grade("House", "house"), CORRECT)
+        self.assertEqual(grade("the dog.", "dog"), CORRECT)
+        self.assertEqual(grade("hound", "dog, hound"), CORRECT)
+
+    def test_empty_answer_is_wrong(self):
+        self.assertEqual(grade("  ", "house"), WRONG)
+        self.assertEqual(grade("?!", "house"), WRONG)
+
+    def test_typo_thresholds_follow_the_word_length(self):
+        self.assertEqual([typo_allowance(word) for word in ("cat", "house", "umbrella")], [0, 1, 2])
+        # Up to three letters: no typo allowed
+        self.assertEqual(grade("cut", "cat"), WRONG)
+        # Four to seven letters: one edit
+        self.assertEqual(grade("hous", "house"), CLOSE)
+        self.assertEqual(grade("hosue", "house"), CLOSE)
+        self.assertEqual(grade("hose", "house"), CLOSE)
+        self.assertEqual(grade("hoseu", "house"), WRONG)
+        self.assertEqual(grade("huso", "house"), WRONG)
+        # Eight letters or more: two edits
+        self.assertEqual(grade("umbrela", "umbrella"), CLOSE)
+        self.assertEqual(grade("unbrela", "umbrella"), CLOSE)
+        self.assertEqual(grade("unbrelo", "umbrella"), WRONG)
+
+
+class BoundedDistanceTest(unittest.TestCase):
+    def test_matches_the_reference_within_the_limit(self):
+        rng = random.Random(7)
+        for _ in range(2000):
+            a = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 8)))
+            b = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 8)))
+            limit = rng.randint(0, 3)
+            expected = reference_distance(a, b)
+            self.assertEqual(bounded_distance(a, b, limit), expected if expected <= limit else limit + 1, (a, b, limit))
+
+
+if __name__ == "__main__":
+    unittest.main()
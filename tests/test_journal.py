@@ -0,0 +1,191 @@
+import os
+import json
+import tempfile
+import unittest
+from journal import Journal, apply_ops
+from storage import JsonStorage
+
+
+def append_op(user, value, section="conversation_context"):
+    return {"op": "append", "section": section, "user": user, "value": value}
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bot_data.json.journal")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_records(self, count):
+        journal = Journal(self.path)
+        journal.open()
+        for number in range(count):
+            journal.append([append_op("1", number)])
+        journal.close()
+
+    def test_replay_skips_records_already_in_the_snapshot(self):
+        self.write_records(3)
+        journal = Journal(self.path)
+        replayed = [ops[0]["value"] for ops in journal.replay(1)]
+        self.assertEqual(replayed, [1, 2])
+        self.assertEqual(journal.seq, 3)
+        self.assertEqual(journal.stats["replayed"], 2)
+
+    def test_torn_last_record_is_dropped_and_truncated(self):
+        self.write_records(2)
+        intact_size = os.path.getsize(self.path)
+        with open(self.path, "ab") as f:
+            f.write(b'{"seq": 3, "ops": [{"op": "app')
+        journal = Journal(self.path)
+        self.assertEqual([ops[0]["value"] for ops in journal.replay(0)], [0, 1])
+        self.assertEqual(journal.stats["torn_records"], 1)
+        self.assertEqual(os.path.getsize(self.path), intact_size)
+        # Appends after recovery continue the sequence and replay normally
+        journal.open()
+        journal.append([append_op("1", 2)])
+        journal.close()
+        self.assertEqual([ops[0]["value"] for ops in Journal(self.path).replay(0)], [0, 1, 2])
+
+    def test_record_without_newline_is_torn(self):
+        with open(self.path, "wb") as f:
+            f.write(json.dumps({"seq": 1, "ops": [append_op("1", 0)]}).encode())
+        journal = Journal(self.path)
+        self.assertEqual(list(journal.replay(0)), [])
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_corrupt_record_in_the_middle_is_not_truncated(self):
+        self.write_records(1)
+        with open(self.path, "ab") as f:
+            f.write(b'{"seq": 2, "ops": [garbage\n')
+        self.write_records(1)
+        size = os.path.getsize(self.path)
+        journal = Journal(self.path)
+        with self.assertRaises(ValueError):
+            list(journal.replay(0))
+        self.assertEqual(os.path.getsize(self.path), size)
+
+    def test_rotated_records_are_replayed_until_discarded(self):
+        journal = Journal(self.path)
+        journal.open()
+        journal.append([append_op("1", "before")])
+        self.assertEqual(journal.rotate(), 1)
+        journal.append([append_op("1", "after")])
+        self.assertTrue(os.path.exists(journal.old_path))
+        self.assertEqual([ops[0]["value"] for ops in Journal(self.path).replay(0)], ["before", "after"])
+        journal.discard_rotated()
+        journal.close()
+        self.assertFalse(os.path.exists(journal.old_path))
+        self.assertEqual([ops[0]["value"] for ops in Journal(self.path).replay(1)], ["after"])
+
+    def test_rotation_after_a_failed_snapshot_keeps_both_segments(self):
+        journal = Journal(self.path)
+        journal.open()
+        journal.append([append_op("1", "first")])
+        journal.rotate()
+        journal.append([append_op("1", "second")])
+        journal.rotate()
+        journal.close()
+        self.assertEqual([ops[0]["value"] for ops in Journal(self.path).replay(0)], ["first", "second"])
+
+
+class ApplyOpsTest(unittest.TestCase):
+    def sections(self):
+        return {
+            "conversation_context": {"1": [{"user": "a"}, {"user": "b"}, {"user": "c"}]},
+            "flashcard_stats": {"1": {"casa": {"attempts": 1}}},
+            "user_notes": {"1": ["note"], "2": ["other"]},
+        }
+
+    def test_append_set_and_trim(self):
+        sections = self.sections()
+        apply_ops(sections, [
+            append_op("1", {"user": "d"}),
+            append_op("3", {"user": "x"}),
+            {"op": "set", "section": "flashcard_stats", "user": "1", "key": "cane", "value": {"attempts": 2}},
+            {"op": "trim", "section": "conversation_context", "user": "1", "count": 2},
+        ])
+        self.assertEqual(sections["conversation_context"]["1"], [{"user": "c"}, {"user": "d"}])
+        self.assertEqual(sections["conversation_context"]["3"], [{"user": "x"}])
+        self.assertEqual(sections["flashcard_stats"]["1"]["cane"], {"attempts": 2})
+
+    def test_clear_only_removes_that_user(self):
+        sections = self.sections()
+        apply_ops(sections, [{"op": "clear", "user": "1"}])
+        self.assertNotIn("1", sections["conversation_context"])
+        self.assertNotIn("1", sections["user_notes"])
+        self.assertEqual(sections["user_notes"]["2"], ["other"])
+
+    def test_put_replaces_the_user_with_a_copy(self):
+        sections = self.sections()
+        value = {"user_notes": ["new"]}
+        ops = [{"op": "put", "user": "1", "value": value}, append_op("1", "more", "user_notes")]
+        apply_ops(sections, ops)
+        self.assertEqual(sections["user_notes"]["1"], ["new", "more"])
+        self.assertNotIn("1", sections["conversation_context"])
+        # The journaled value is not shared with the live sections
+        self.assertEqual(value, {"user_notes": ["new"]})
+
+    def test_replace_and_unset(self):
+        sections = self.sections()
+        notes = ["replaced"]
+        apply_ops(sections, [
+            {"op": "replace", "section": "user_notes", "user": "1", "value": notes},
+            append_op("1", "more", "user_notes"),
+            {"op": "replace", "section": "user_notes", "user": "2", "value": None},
+            {"op": "unset", "section": "flashcard_stats", "user": "1", "key": "casa"},
+            {"op": "unset", "section": "flashcard_stats", "user": "9", "key": "casa"},
+        ])
+        self.assertEqual(sections["user_notes"], {"1": ["replaced", "more"]})
+        self.assertEqual(notes, ["replaced"])
+        self.assertEqual(sections["flashcard_stats"], {"1": {}})
+
+    def test_set_stores_a_copy(self):
+        sections = self.sections()
+        value = {"attempts": 2}
+        apply_ops(sections, [{"op": "set", "section": "flashcard_stats", "user": "1", "key": "cane", "value": value}])
+        sections["flashcard_stats"]["1"]["cane"]["attempts"] += 1
+        self.assertEqual(value, {"attempts": 2})
+
+
+class JsonJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "bot_data.json")
+
+    def storage(self):
+        return JsonStorage(self.path, Journal(self.path + ".journal"))
+
+    def test_journaled_appends_survive_a_restart(self):
+        storage = self.storage()
+        sections = storage.load_all()
+        sections["conversation_context"]["1"] = [{"user": "ciao", "ai": "Ciao!", "ts": 1.0}]
+        storage.commit(storage.prepare(sections, {"1"}))
+        turn = {"user": "grazie", "ai": "Prego.", "ts": 2.0}
+        sections["conversation_context"]["1"].append(turn)
+        storage.journal_write([{"op": "append", "section": "conversation_context", "user": "1", "value": turn}])
+        storage.close()
+        reopened = self.storage()
+        reloaded = reopened.load_all()
+        reopened.close()
+        self.assertEqual(reloaded["conversation_context"]["1"], sections["conversation_context"]["1"])
+
+    def test_snapshot_compacts_the_journal(self):
+        storage = self.storage()
+        sections = storage.load_all()
+        storage.journal_write([{"op": "append", "section": "user_notes", "user": "1", "value": "note"}])
+        sections["user_notes"]["1"] = ["note"]
+        storage.commit(storage.prepare(sections, set()))
+        self.assertEqual(storage.journal_size(), 0)
+        storage.close()
+        # The record is in the document only once, not replayed again on top of it
+        reopened = self.storage()
+        self.assertEqual(reopened.load_all()["user_notes"]["1"], ["note"])
+        self.assertEqual(reopened.journal.stats["replayed"], 0)
+        reopened.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
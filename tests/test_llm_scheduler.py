@@ -0,0 +1,97 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+import handlers
+from llm_scheduler import LLMScheduler, SchedulerBusy
+
+
+class LLMSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def start_blocker(self, scheduler):
+        """Occupy the only slot until the returned event is set."""
+        release = asyncio.Event()
+
+        async def block():
+            await release.wait()
+
+        task = asyncio.create_task(scheduler.submit("blocker", block))
+        await asyncio.sleep(0)
+        return release, task
+
+    async def test_waiting_users_are_served_round_robin(self):
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=10)
+        release, blocker = await self.start_blocker(scheduler)
+        order = []
+
+        def job(name):
+            async def run():
+                order.append(name)
+            return run
+
+        tasks = [asyncio.create_task(scheduler.submit(user, job(f"{user}{number}")))
+                 for user in ("a", "b") for number in (1, 2, 3)]
+        await asyncio.sleep(0)
+        self.assertEqual(scheduler.queue_depth, 6)
+        release.set()
+        await asyncio.gather(blocker, *tasks)
+        self.assertEqual(order, ["a1", "b1", "a2", "b2", "a3", "b3"])
+
+    async def test_one_job_per_user_at_a_time(self):
+        scheduler = LLMScheduler(max_concurrency=4, max_queue=10)
+        running = []
+        peak = 0
+
+        async def job():
+            nonlocal peak
+            running.append(1)
+            peak = max(peak, len(running))
+            await asyncio.sleep(0.001)
+            running.pop()
+
+        await asyncio.gather(*(scheduler.submit("same user", job) for _ in range(3)))
+        self.assertEqual(peak, 1)
+        self.assertEqual(scheduler.stats["completed"], 3)
+
+    async def test_full_queue_is_rejected(self):
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=1)
+        release, blocker = await self.start_blocker(scheduler)
+
+        async def idle():
+            pass
+
+        queued = asyncio.create_task(scheduler.submit("a", idle))
+        await asyncio.sleep(0)
+        with self.assertRaises(SchedulerBusy):
+            await scheduler.submit("b", idle)
+        self.assertEqual(scheduler.stats["rejected"], 1)
+        release.set()
+        await asyncio.gather(blocker, queued)
+        self.assertEqual(scheduler.stats["completed"], 2)
+
+    async def test_failed_job_frees_its_slot(self):
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=10)
+
+        async def fail():
+            raise RuntimeError("model crashed")
+
+        async def answer():
+            return "ok"
+
+        with self.assertRaises(RuntimeError):
+            await scheduler.submit("a", fail)
+        self.assertEqual(await scheduler.submit("a", answer), "ok")
+        self.assertEqual(scheduler.running, 0)
+
+    async def test_busy_scheduler_sends_the_busy_reply(self):
+        update = SimpleNamespace(effective_user=SimpleNamespace(id=1), message=SimpleNamespace(text="ciao"))
+        settings = {"mode": "normal", "level": "beginner", "topic": "general"}
+        with mock.patch.object(handlers, "scheduler", LLMScheduler(max_concurrency=1, max_queue=0)), \
+                mock.patch.object(handlers, "get_user_settings", return_value=settings), \
+                mock.patch.object(handlers, "reply") as reply:
+            await handlers.handle_message(update, None)
+        reply.assert_called_once()
+        self.assertIn("try again", reply.call_args[0][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from notes_index import NoteIndex, tokenize
+
+
+NOTES = [
+    "Perché is used for why and because",
+    "Buongiorno means good morning",
+    "The verb essere is irregular",
+    "Buonanotte means good night",
+]
+
+
+def positions(index, query):
+    return [position for position, _ in index.search(query)]
+
+
+class NoteIndexTest(unittest.TestCase):
+    def test_tokens_are_lowercased_and_accent_folded(self):
+        self.assertEqual(tokenize("Perché, CITTÀ!"), ["perche", "citta"])
+
+    def test_search_finds_whole_words_and_prefixes(self):
+        index = NoteIndex(NOTES)
+        self.assertEqual(positions(index, "perche"), [0])
+        self.assertEqual(positions(index, "essere"), [2])
+        self.assertEqual(set(positions(index, "buon")), {1, 3})
+        self.assertEqual(positions(index, "treno"), [])
+        self.assertEqual(positions(index, "!!"), [])
+
+    def test_notes_matching_more_words_rank_first(self):
+        index = NoteIndex(NOTES)
+        self.assertEqual(positions(index, "good night"), [3, 1])
+
+    def test_exact_word_scores_higher_than_a_prefix(self):
+        index = NoteIndex(["casa", "casalinga"])
+        self.assertEqual(positions(index, "casa"), [0, 1])
+
+    def test_removal_shifts_the_positions_of_later_notes(self):
+        notes = list(NOTES)
+        index = NoteIndex(notes)
+        index.remove(1, notes.pop(1))
+        self.assertEqual(len(index), 3)
+        self.assertEqual(positions(index, "buongiorno"), [])
+        self.assertEqual(positions(index, "essere"), [1])
+        self.assertEqual(positions(index, "night"), [2])
+        self.assertEqual(notes[positions(index, "night")[0]], "Buonanotte means good night")
+
+    def test_added_notes_follow_removed_ones(self):
+        notes = list(NOTES)
+        index = NoteIndex(notes)
+        index.remove(0, notes.pop(0))
+        notes.append("Perché also asks why")
+        index.add(notes[-1])
+        self.assertEqual(positions(index, "perche"), [3])
+        # Tokens only in removed notes are gone from the prefix list
+        index.remove(3, notes.pop(3))
+        self.assertEqual(positions(index, "perc"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
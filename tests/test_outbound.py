@@ -0,0 +1,124 @@
+import asyncio
+import unittest
+from unittest import mock
+from telegram.error import RetryAfter
+import outbound
+from outbound import BULK, INTERACTIVE, STREAM, Outbox, OutboundRateLimiter, TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_refill(self):
+        bucket = TokenBucket(rate=2, capacity=3)
+        for _ in range(3):
+            self.assertEqual(bucket.wait_time(0.0), 0.0)
+            bucket.take()
+        self.assertAlmostEqual(bucket.wait_time(0.0), 0.5)
+        self.assertAlmostEqual(bucket.wait_time(0.25), 0.25)
+        self.assertEqual(bucket.wait_time(0.5), 0.0)
+
+    def test_tokens_do_not_exceed_the_capacity(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        bucket.wait_time(0.0)
+        bucket.wait_time(100.0)
+        self.assertEqual(bucket.tokens, 2)
+
+    def test_pause_empties_the_bucket(self):
+        bucket = TokenBucket(rate=1, capacity=5)
+        bucket.wait_time(0.0)
+        bucket.pause(0.0, 3)
+        self.assertEqual(bucket.wait_time(1.0), 2.0)
+        # After the pause, the tokens saved up during it are available
+        self.assertEqual(bucket.wait_time(3.0), 0.0)
+        self.assertEqual(bucket.tokens, 3)
+
+
+class OutboundRateLimiterTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.limiter = OutboundRateLimiter(global_rate=1000, chat_rate=1000, chat_burst=1000, max_retries=2)
+        await self.limiter.initialize()
+        self.addAsyncCleanup(self.limiter.shutdown)
+        self.sent = []
+
+    async def send(self, chat_id, name, lane=INTERACTIVE):
+        async def call():
+            self.sent.append(name)
+            return name
+        outbound._lane.set(lane)
+        return await self.limiter.process_request(call, (), {}, "sendMessage", {"chat_id": chat_id}, None)
+
+    async def test_waiting_calls_are_granted_in_lane_order(self):
+        # One token at a time, so the calls below all wait together
+        self.limiter.global_bucket = TokenBucket(rate=50, capacity=1)
+        await self.send(1, "first")
+        await asyncio.gather(self.send(2, "bulk", BULK), self.send(3, "stream", STREAM), self.send(4, "reply"))
+        self.assertEqual(self.sent, ["first", "reply", "stream", "bulk"])
+
+    async def test_throttled_chat_does_not_hold_up_others(self):
+        self.limiter.chat_burst = 1
+        self.limiter.chat_rate = 20
+        await asyncio.gather(self.send("a", "a1"), self.send("a", "a2"), self.send("b", "b1"))
+        self.assertEqual(self.sent, ["a1", "b1", "a2"])
+
+    async def test_retry_after_pauses_the_chat_and_retries(self):
+        attempts = []
+
+        async def call():
+            attempts.append(asyncio.get_running_loop().time())
+            if len(attempts) == 1:
+                raise RetryAfter(0.05)
+            return "ok"
+
+        result = await self.limiter.process_request(call, (), {}, "sendMessage", {"chat_id": 1}, None)
+        self.assertEqual(result, "ok")
+        self.assertGreaterEqual(attempts[1] - attempts[0], 0.04)
+        self.assertEqual(self.limiter.stats["retry_after"], 1)
+
+    async def test_gives_up_after_max_retries(self):
+        async def call():
+            raise RetryAfter(0)
+
+        with self.assertRaises(RetryAfter):
+            await self.limiter.process_request(call, (), {}, "sendMessage", {"chat_id": 1}, None)
+        self.assertEqual(self.limiter.stats["retry_after"], 3)
+
+
+class OutboxTest(unittest.IsolatedAsyncioTestCase):
+    async def test_calls_of_a_chat_run_in_order_with_their_lane(self):
+        outbox = Outbox()
+        done = []
+
+        async def call(name, delay):
+            await asyncio.sleep(delay)
+            done.append((name, outbound._lane.get()))
+            return name
+
+        first = outbox.send(1, call, "first", 0.02)
+        second = outbox.send(1, call, "second", 0, lane=BULK)
+        other = outbox.send(2, call, "other", 0, lane=STREAM)
+        self.assertEqual(await second, "second")
+        await outbox.drain()
+        self.assertEqual(first.result(), "first")
+        self.assertEqual(other.result(), "other")
+        self.assertEqual(done, [("other", STREAM), ("first", INTERACTIVE), ("second", BULK)])
+
+    async def test_failed_call_does_not_stop_the_queue(self):
+        outbox = Outbox()
+
+        async def fail():
+            raise ValueError("boom")
+
+        async def succeed():
+            return "ok"
+
+        with mock.patch("builtins.print"):
+            failed = outbox.send(1, fail)
+            after = outbox.send(1, succeed)
+            await outbox.drain()
+        with self.assertRaises(ValueError):
+            failed.result()
+        self.assertEqual(after.result(), "ok")
+        self.assertEqual(outbox.stats["failed"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
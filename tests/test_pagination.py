@@ -0,0 +1,80 @@
+import base64
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+import handlers
+from pagination import CALLBACK_PREFIX, MAX_ITEM_LENGTH, decode_cursor, encode_cursor, render_page
+
+
+def buttons(markup):
+    return {button.text: decode_cursor(button.callback_data) for button in markup.inline_keyboard[0]} if markup else {}
+
+
+class CursorTest(unittest.TestCase):
+    def test_round_trip(self):
+        for kind, offset, owner in (("notes", 0, "1"), ("flashcards", 130, "123456789012")):
+            self.assertEqual(decode_cursor(encode_cursor(kind, offset, owner)), (kind, offset, owner))
+
+    def test_fits_in_telegram_callback_data(self):
+        self.assertLessEqual(len(encode_cursor("flashcards", 10 ** 9, str(2 ** 63))), 64)
+
+    def test_invalid_data_is_rejected(self):
+        for data in (None, "", "other:abc", CALLBACK_PREFIX + "!!!", CALLBACK_PREFIX + "bm90ZXM6eDox"):
+            self.assertIsNone(decode_cursor(data), data)
+
+    def test_negative_offset_is_clamped(self):
+        token = base64.urlsafe_b64encode(b"notes:-5:1").decode()
+        self.assertEqual(decode_cursor(CALLBACK_PREFIX + token), ("notes", 0, "1"))
+
+
+class RenderPageTest(unittest.TestCase):
+    def render(self, total, offset, items=None):
+        items = items if items is not None else [f"note {number}" for number in range(total)]
+        return render_page("notes", "1", "Your notes", iter(items), total, offset, 10, str)
+
+    def test_first_page_has_only_next(self):
+        text, markup = self.render(25, 0)
+        self.assertTrue(text.startswith("Your notes (1-10 of 25):\n1. note 0\n"))
+        self.assertEqual(buttons(markup), {"Next »": ("notes", 10, "1")})
+
+    def test_middle_and_last_pages(self):
+        _, markup = self.render(25, 10)
+        self.assertEqual(buttons(markup), {"« Prev": ("notes", 0, "1"), "Next »": ("notes", 20, "1")})
+        text, markup = self.render(25, 20)
+        self.assertTrue(text.endswith("25. note 24"))
+        self.assertEqual(buttons(markup), {"« Prev": ("notes", 10, "1")})
+
+    def test_single_page_has_no_buttons(self):
+        self.assertIsNone(self.render(3, 0)[1])
+
+    def test_offset_past_a_shrunken_list_shows_the_last_page(self):
+        text, _ = self.render(12, 30)
+        self.assertTrue(text.startswith("Your notes (11-12 of 12):"))
+
+    def test_long_items_are_shortened(self):
+        text, _ = self.render(1, 0, ["x" * 1000])
+        self.assertEqual(len(text.split("\n")[1]), len("1. ") + MAX_ITEM_LENGTH)
+
+
+class PageCallbackTest(unittest.IsolatedAsyncioTestCase):
+    async def press(self, presser, data):
+        query = SimpleNamespace(data=data, answer=mock.AsyncMock(), edit_message_text=mock.AsyncMock())
+        update = SimpleNamespace(callback_query=query, effective_user=SimpleNamespace(id=presser))
+        notes = [f"note {number}" for number in range(15)]
+        with mock.patch.object(handlers, "get_user_notes", return_value=notes):
+            await handlers.page_callback(update, None)
+        return query
+
+    async def test_owner_turns_the_page(self):
+        query = await self.press(1, encode_cursor("notes", 10, "1"))
+        query.edit_message_text.assert_awaited_once()
+        self.assertIn("11. note 10", query.edit_message_text.call_args[0][0])
+
+    async def test_someone_else_cannot_turn_the_page(self):
+        query = await self.press(2, encode_cursor("notes", 10, "1"))
+        query.edit_message_text.assert_not_awaited()
+        self.assertTrue(query.answer.call_args.kwargs["show_alert"])
+
+
+if __name__ == "__main__":
+    unittest.main()
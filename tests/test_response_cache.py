@@ -0,0 +1,71 @@
+import os
+import time
+import tempfile
+import unittest
+from response_cache import ENTRY_OVERHEAD, ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_key_ignores_case_and_spacing_but_not_the_model(self):
+        key = ResponseCache.make_key("Beginner", "travel", "Io  sono  stanco", "llama3", "template")
+        self.assertEqual(key, ResponseCache.make_key("beginner", "Travel ", "io sono stanco", "llama3", "template"))
+        self.assertNotEqual(key, ResponseCache.make_key("beginner", "travel", "io sono stanco", "mistral", "template"))
+        self.assertNotEqual(key, ResponseCache.make_key("beginner", "travel", "io sono stanco", "llama3", "other"))
+
+    def test_expired_entry_is_a_miss(self):
+        cache = ResponseCache(max_bytes=10_000, ttl=60)
+        cache.put("fresh", "ok")
+        cache.put("old", "stale", stored_at=time.time() - 61)
+        self.assertEqual(cache.get("fresh"), "ok")
+        self.assertIsNone(cache.get("old"))
+        self.assertEqual(cache.snapshot()["entries"], 1)
+        self.assertEqual((cache.stats["hits"], cache.stats["misses"], cache.stats["expired"]), (1, 1, 1))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ResponseCache(max_bytes=3 * (ENTRY_OVERHEAD + 1), ttl=60)
+        for key in "abc":
+            cache.put(key, key)
+        cache.get("a")
+        cache.put("d", "d")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual([cache.get(key) for key in "acd"], ["a", "c", "d"])
+        self.assertEqual(cache.stats["evictions"], 1)
+        self.assertEqual(cache.snapshot()["bytes"], 3 * (ENTRY_OVERHEAD + 1))
+
+    def test_response_larger_than_the_cache_is_not_stored(self):
+        cache = ResponseCache(max_bytes=ENTRY_OVERHEAD + 10, ttl=60)
+        cache.put("small", "x")
+        cache.put("big", "x" * 100)
+        self.assertIsNone(cache.get("big"))
+        self.assertEqual(cache.get("small"), "x")
+
+    def test_replacing_an_entry_keeps_the_size_right(self):
+        cache = ResponseCache(max_bytes=10_000, ttl=60)
+        cache.put("a", "short")
+        cache.put("a", "a longer answer")
+        self.assertEqual(cache.snapshot()["bytes"], len("a longer answer") + ENTRY_OVERHEAD)
+
+    def test_saved_entries_survive_a_restart_until_they_expire(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.json")
+            cache = ResponseCache(max_bytes=10_000, ttl=60, path=path)
+            cache.put("fresh", "ok")
+            cache.put("old", "stale", stored_at=time.time() - 61)
+            cache.save()
+            reloaded = ResponseCache(max_bytes=10_000, ttl=60, path=path)
+            reloaded.load()
+            self.assertEqual(reloaded.get("fresh"), "ok")
+            self.assertEqual(reloaded.snapshot()["entries"], 1)
+
+    def test_unreadable_file_is_ignored(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.json")
+            with open(path, "w") as f:
+                f.write("{not json")
+            cache = ResponseCache(max_bytes=10_000, ttl=60, path=path)
+            cache.load()
+            self.assertEqual(cache.snapshot()["entries"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import gzip
+import json
+import tempfile
+import unittest
+from unittest import mock
+import data_manager
+from retention import SECONDS_PER_DAY, Archive, Retention, expired_prefix
+from storage import JsonStorage
+
+NOW = 1_700_000_000
+
+
+def turns(count, age_days=0):
+    return [{"user": f"q{number}", "ai": f"a{number}", "ts": NOW - age_days * SECONDS_PER_DAY} for number in range(count)]
+
+
+class ExpiredPrefixTest(unittest.TestCase):
+    def test_count_limit_waits_for_the_slack(self):
+        self.assertEqual(expired_prefix(turns(110), 100, 0, NOW, "ts"), 0)
+        self.assertEqual(expired_prefix(turns(111), 100, 0, NOW, "ts"), 11)
+        # Small limits are still exceeded by at least one entry first
+        self.assertEqual(expired_prefix(turns(4), 3, 0, NOW, "ts"), 0)
+        self.assertEqual(expired_prefix(turns(5), 3, 0, NOW, "ts"), 2)
+
+    def test_age_limit_removes_the_old_entries(self):
+        entries = turns(3, age_days=10) + turns(2, age_days=1)
+        self.assertEqual(expired_prefix(entries, 0, 7, NOW, "ts"), 3)
+        self.assertEqual(expired_prefix(entries, 0, 30, NOW, "ts"), 0)
+
+    def test_entries_without_a_timestamp_only_count_towards_the_count_limit(self):
+        entries = [{"user": "old"}] + turns(2, age_days=10)
+        self.assertEqual(expired_prefix(entries, 0, 7, NOW, "ts"), 0)
+        self.assertEqual(expired_prefix(entries[1:], 0, 7, NOW, "ts"), 2)
+
+    def test_limits_combine(self):
+        entries = turns(200, age_days=10) + turns(5)
+        self.assertEqual(expired_prefix(entries, 100, 7, NOW, "ts"), 200)
+        self.assertEqual(expired_prefix(turns(200), 100, 7, NOW, "ts"), 100)
+
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.archive = Archive(os.path.join(directory.name, "archive"))
+
+    def read_all(self):
+        records = []
+        for name in sorted(os.listdir(self.archive.directory)):
+            with gzip.open(os.path.join(self.archive.directory, name), "rt", encoding="utf-8") as f:
+                records += [(name, json.loads(line)) for line in f]
+        return records
+
+    def test_entries_go_to_one_file_per_section_and_month(self):
+        self.archive.append("conversation_context", [("1", {"user": "a"})], NOW)
+        self.archive.append("conversation_context", [("2", {"user": "b"})], NOW)
+        self.archive.append("flashcard_log", [("1", {"correct": True})], NOW + 40 * SECONDS_PER_DAY)
+        records = self.read_all()
+        self.assertEqual([name for name, _ in records], [
+            "conversation_context-2023-11.jsonl.gz", "conversation_context-2023-11.jsonl.gz",
+            "flashcard_log-2023-12.jsonl.gz",
+        ])
+        self.assertEqual(records[1][1], {"user": "2", "archived_at": NOW, "entry": {"user": "b"}})
+
+    def test_purge_removes_only_that_user(self):
+        # "1" must not match "10" nor an entry that mentions "1"
+        self.archive.append("conversation_context", [("1", {"user": "1"}), ("10", {"user": "1"})], NOW)
+        self.archive.append("flashcard_log", [("1", {"correct": False})], NOW)
+        self.assertEqual(self.archive.purge("1"), 2)
+        self.assertEqual([record["user"] for _, record in self.read_all()], ["10"])
+        self.assertEqual(self.archive.purge("1"), 0)
+        self.assertFalse([name for name in os.listdir(self.archive.directory) if name.endswith(".tmp")])
+
+    def test_purge_without_an_archive_directory(self):
+        self.assertEqual(self.archive.purge("1"), 0)
+
+
+class RetentionTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        storage = JsonStorage(os.path.join(directory.name, "bot_data.json"))
+        patch = mock.patch.object(data_manager, "_storage", storage)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(self.clear)
+        self.clear()
+        self.archive = Archive(os.path.join(directory.name, "archive"))
+
+    def clear(self):
+        for section in data_manager._sections().values():
+            section.clear()
+        data_manager._dirty_users.clear()
+
+    async def test_pass_archives_then_trims(self):
+        data_manager.conversation_context["1"] = turns(3, age_days=10) + turns(2)
+        data_manager.conversation_context["2"] = turns(2)
+        retention = Retention([("conversation_context", 0, 7, "ts")], self.archive, slice_seconds=0)
+        with mock.patch("retention.time.time", return_value=NOW):
+            await retention.run_pass()
+        self.assertEqual(len(data_manager.conversation_context["1"]), 2)
+        self.assertEqual(len(data_manager.conversation_context["2"]), 2)
+        self.assertEqual(retention.stats["trimmed"], 3)
+        self.assertEqual(self.archive.purge("1"), 3)
+
+    async def test_purge_user_without_an_archive(self):
+        self.assertEqual(await Retention([]).purge_user("1"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+from unittest import mock
+import numpy as np
+import retrieval
+from retrieval import BATCH_SIZE, HashingEmbedder, Retriever, TurnIndex
+
+
+TURNS = [
+    {"user": "Come si dice treno?", "ai": "Treno means train."},
+    {"user": "I like pizza", "ai": "Mi piace la pizza."},
+    {"user": "What is the train station called?", "ai": "La stazione dei treni."},
+    {"user": "Ciao!", "ai": "Ciao, come stai?"},
+    {"user": "Bene, grazie", "ai": "Ottimo!"},
+]
+
+
+class HashingEmbedderTest(unittest.IsolatedAsyncioTestCase):
+    async def test_vectors_are_deterministic_and_normalized(self):
+        embedder = HashingEmbedder(dim=64)
+        first = await embedder.embed(["il treno per Roma", ""])
+        second = await HashingEmbedder(dim=64).embed(["il treno per Roma", ""])
+        np.testing.assert_array_equal(first, second)
+        self.assertAlmostEqual(float(np.linalg.norm(first[0])), 1.0, places=5)
+        # Text without words embeds to zeros instead of dividing by zero
+        self.assertFalse(first[1].any())
+
+    async def test_shared_words_score_higher(self):
+        vectors = await HashingEmbedder().embed(["train station", "the train station", "pizza margherita"])
+        self.assertGreater(vectors[0] @ vectors[1], vectors[0] @ vectors[2])
+
+
+class TurnIndexTest(unittest.TestCase):
+    def test_search_skips_missing_rows_and_returns_oldest_first(self):
+        index = TurnIndex([{}] * 4)
+        vectors = np.eye(4, dtype=np.float32)
+        index.set_rows([0, 1, 3], vectors[[0, 1, 3]])
+        self.assertEqual(index.missing(4), [2])
+        query = np.array([0.1, 0.5, 1.0, 0.9], dtype=np.float32)
+        self.assertEqual(index.search(query, 2, 4), [1, 3])
+        # Rows at or past upto are never returned
+        self.assertEqual(index.search(query, 2, 2), [0, 1])
+
+    def test_rows_grow_past_the_initial_capacity(self):
+        index = TurnIndex([])
+        index.set_rows([40], np.ones((1, 3), dtype=np.float32))
+        self.assertEqual(index.missing(41), list(range(40)))
+        self.assertEqual(index.search(np.ones(3, dtype=np.float32), 5, 41), [40])
+
+
+class RetrieverTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.history = [dict(turn) for turn in TURNS]
+        patch = mock.patch.object(retrieval, "get_conversation_history", lambda user_id: self.history)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.retriever = Retriever(HashingEmbedder(), top_k=1, recent_turns=2)
+
+    async def test_finds_the_most_similar_older_turn(self):
+        self.assertEqual(await self.retriever.relevant_turns("1", "train station"), [2])
+        self.assertEqual(await self.retriever.relevant_turns("1", "pizza"), [1])
+
+    async def test_recent_turns_are_not_candidates(self):
+        self.retriever.top_k = 10
+        self.assertEqual(await self.retriever.relevant_turns("1", "ciao come stai"), [0, 1, 2])
+
+    async def test_disabled_or_failing_retrieval_returns_none(self):
+        self.retriever.enabled = False
+        self.assertIsNone(await self.retriever.relevant_turns("1", "train"))
+        self.retriever.enabled = True
+        with mock.patch.object(self.retriever.embedder, "embed", side_effect=OSError("down")), \
+                mock.patch("builtins.print"):
+            self.assertIsNone(await self.retriever.relevant_turns("1", "train"))
+
+    async def test_added_turn_is_embedded_in_the_background(self):
+        await self.retriever.relevant_turns("1", "train")
+        self.history.append({"user": "Dov'è il museo?", "ai": "The museum is there."})
+        self.retriever.turn_added("1", len(self.history) - 1, self.history[-1])
+        self.history.extend([{"user": "ok", "ai": "ok"}] * 2)
+        await self.retriever._tasks.copy().pop()
+        index = self.retriever._indexes["1"]
+        self.assertEqual(index.missing(len(TURNS) + 1), [3, 4])
+        self.assertEqual(await self.retriever.relevant_turns("1", "museum"), [5])
+
+    async def test_long_history_is_backfilled_in_the_background(self):
+        self.history = [{"user": f"word{number}", "ai": ""} for number in range(BATCH_SIZE + 10)]
+        self.history[3] = {"user": "the train to Rome", "ai": ""}
+        # Nothing is embedded yet when the search runs
+        self.assertEqual(await self.retriever.relevant_turns("1", "train"), [])
+        for task in list(self.retriever._tasks):
+            await task
+        self.assertEqual(await self.retriever.relevant_turns("1", "train"), [3])
+
+    async def test_replaced_history_gets_a_new_index(self):
+        await self.retriever.relevant_turns("1", "train")
+        # Trimmed: the stale index would still hold the pizza turn at row 1
+        self.history = self.history[1:]
+        self.assertEqual(await self.retriever.relevant_turns("1", "pizza"), [0])
+        self.assertIs(self.retriever._indexes["1"].history, self.history)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+from journal import Journal
+from snapshot import SnapshotReader, SnapshotStorage, json_to_snapshot, snapshot_to_json
+from storage import SECTIONS, JsonStorage
+from test_storage import USERS, StorageTestCase, load, records_of, sample_sections, save, users_of
+
+
+class SnapshotStorageTest(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.snapshot_path = self.path("bot_data.snap")
+
+    def storage(self, compact_bytes=10 ** 9, journal=True):
+        return SnapshotStorage(self.snapshot_path, Journal(self.snapshot_path + ".journal") if journal else None,
+                               compact_bytes)
+
+    def test_round_trip(self):
+        self.assertRoundTrip(lambda: self.storage(journal=False))
+
+    def test_round_trip_with_journal(self):
+        self.assertRoundTrip(self.storage)
+
+    def test_removed_user_is_gone_after_reload(self):
+        for journal in (False, True):
+            with self.subTest(journal=journal):
+                self.snapshot_path = self.path(f"journal-{journal}.snap")
+                sections = sample_sections()
+                storage = self.storage(journal=journal)
+                storage.load_all()
+                save(storage, sections)
+                for section in SECTIONS:
+                    sections[section].pop("1", None)
+                save(storage, sections, {"1"})
+                storage.close()
+                reopened = self.storage(journal=journal)
+                self.assertEqual(load(reopened, USERS), records_of(sections, USERS))
+                reopened.close()
+
+    def test_changes_are_journaled_until_compaction(self):
+        storage = self.storage()
+        storage.load_all()
+        sections = sample_sections()
+        # The first write creates the snapshot file, later ones go to the journal
+        payload = storage.prepare(sections, users_of(sections))
+        self.assertEqual(payload[0], "snapshot")
+        storage.commit(payload)
+        sections["user_notes"]["1"].append("likes opera")
+        kind, _ = storage.prepare(sections, {"1"})
+        self.assertEqual(kind, "journal")
+        self.assertEqual(storage.load_user("1")["user_notes"], sections["user_notes"]["1"])
+        storage.close()
+        with SnapshotReader(self.snapshot_path) as reader:
+            self.assertEqual(reader.read_user("1")["user_notes"], ["prefers formal Italian", "città has an accent"])
+        reopened = self.storage(compact_bytes=0)
+        self.assertEqual(load(reopened, ["1"]), records_of(sections, ["1"]))
+        # Past compact_bytes the next write folds the journal into a new snapshot
+        save(reopened, sections, set())
+        self.assertEqual(reopened.journal_size(), 0)
+        reopened.close()
+        with SnapshotReader(self.snapshot_path) as reader:
+            self.assertEqual(reader.read_user("1")["user_notes"], sections["user_notes"]["1"])
+
+    def test_granular_ops_are_replayed_after_a_restart(self):
+        storage = self.storage()
+        storage.load_all()
+        sections = sample_sections()
+        save(storage, sections)
+        schedule = {"interval": 6, "ease": 2.6, "reps": 2, "due": 1700600000.0}
+        storage.journal_write([
+            {"op": "append", "section": "user_notes", "user": "1", "value": "likes opera"},
+            {"op": "set", "section": "flashcard_schedules", "user": "1", "key": "casa", "value": schedule},
+            {"op": "unset", "section": "flashcards", "user": "1", "key": "cane"},
+            {"op": "replace", "section": "user_settings", "user": "user/2",
+             "value": {"mode": "language_learning", "level": "advanced", "topic": "food"}},
+        ])
+        # Changed in place after it was journaled, as data_manager does with the live dicts
+        schedule["reps"] = 99
+        self.assertEqual(storage.load_user("1")["flashcard_schedules"]["casa"]["reps"], 2)
+        storage.close()
+        reopened = self.storage()
+        reopened.load_all()
+        first = reopened.load_user("1")
+        self.assertEqual(first["user_notes"][-1], "likes opera")
+        self.assertEqual(first["flashcard_schedules"]["casa"]["reps"], 2)
+        self.assertEqual(first["flashcards"], {"casa": "house"})
+        self.assertEqual(reopened.load_user("user/2")["user_settings"]["level"], "advanced")
+        # Loading a user again (after an eviction) gives the same record
+        first["flashcard_schedules"]["casa"]["reps"] = 50
+        self.assertEqual(reopened.load_user("1")["flashcard_schedules"]["casa"]["reps"], 2)
+        reopened.close()
+
+    def test_json_conversion_round_trip(self):
+        source = self.path("bot_data.json")
+        target = self.path("copy.json")
+        sections = sample_sections()
+        save(JsonStorage(source), sections)
+        self.assertEqual(json_to_snapshot(source, self.snapshot_path), 2)
+        snapshot_to_json(self.snapshot_path, target)
+        self.assertEqual(load(JsonStorage(target), USERS), records_of(sections, USERS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+from srs import (
+    DAY,
+    DEFAULT_EASE,
+    MIN_EASE,
+    QUALITY_CLOSE,
+    QUALITY_CORRECT,
+    QUALITY_WRONG,
+    build_due_heap,
+    new_schedule,
+    next_due,
+    push_due,
+    review,
+)
+
+
+class ReviewTest(unittest.TestCase):
+    def test_correct_answers_follow_the_sm2_intervals(self):
+        schedule = new_schedule()
+        intervals = [review(schedule, QUALITY_CORRECT, 0)["interval"] for _ in range(4)]
+        # Quality 4 leaves the ease unchanged: 1, 6, then the interval times the ease
+        self.assertEqual(intervals, [1, 6, 15, 38])
+        self.assertEqual(schedule["ease"], DEFAULT_EASE)
+        self.assertEqual(schedule["reps"], 4)
+
+    def test_ease_moves_with_the_quality(self):
+        self.assertAlmostEqual(review(new_schedule(), 5, 0)["ease"], DEFAULT_EASE + 0.1)
+        self.assertAlmostEqual(review(new_schedule(), QUALITY_CLOSE, 0)["ease"], DEFAULT_EASE - 0.14)
+        self.assertAlmostEqual(review(new_schedule(), QUALITY_WRONG, 0)["ease"], DEFAULT_EASE - 0.54)
+
+    def test_wrong_answer_restarts_the_repetitions(self):
+        schedule = new_schedule()
+        for _ in range(3):
+            review(schedule, QUALITY_CORRECT, 0)
+        review(schedule, QUALITY_WRONG, 0)
+        self.assertEqual((schedule["reps"], schedule["interval"]), (0, 1))
+        self.assertEqual(review(schedule, QUALITY_CORRECT, 0)["interval"], 1)
+
+    def test_ease_never_drops_below_the_minimum(self):
+        schedule = new_schedule()
+        for _ in range(10):
+            review(schedule, 0, 0)
+        self.assertEqual(schedule["ease"], MIN_EASE)
+
+    def test_due_time_is_the_interval_after_now(self):
+        now = 1_000_000
+        schedule = review(new_schedule(), QUALITY_CORRECT, now)
+        self.assertEqual(schedule["due"], now + DAY)
+
+
+class DueHeapTest(unittest.TestCase):
+    def test_earliest_due_cards_come_first(self):
+        cards = {"casa": "house", "cane": "dog", "gatto": "cat"}
+        schedules = {"casa": {"due": 30}, "cane": {"due": 10}}
+        heap = build_due_heap(cards, schedules)
+        # Never reviewed cards are due right away
+        self.assertEqual(next_due(heap, 2, cards, schedules), ["gatto", "cane"])
+        self.assertEqual(next_due(heap, 3, cards, schedules), ["gatto", "cane", "casa"])
+
+    def test_stale_and_deleted_entries_are_skipped(self):
+        cards = {"casa": "house", "cane": "dog"}
+        schedules = {"casa": {"due": 10}, "cane": {"due": 20}}
+        heap = build_due_heap(cards, schedules)
+        schedules["casa"]["due"] = 50
+        push_due(heap, 50, "casa")
+        self.assertEqual(next_due(heap, 2, cards, schedules), ["cane", "casa"])
+        del cards["cane"]
+        self.assertEqual(next_due(heap, 2, cards, schedules), ["casa"])
+
+
+if __name__ == "__main__":
+    unittest.main()
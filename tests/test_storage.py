@@ -0,0 +1,215 @@
+import os
+import json
+import tempfile
+import unittest
+from journal import Journal
+from storage import SECTIONS, JsonStorage, ShardedJsonStorage, SQLiteStorage, create_storage, open_storage
+
+
+def sample_sections():
+    """Two users' records in the shape data_manager keeps them."""
+    sections = {name: {} for name in SECTIONS}
+    sections["conversation_context"]["1"] = [
+        {"user": "ciao", "ai": "Ciao! Come stai?", "ts": 1700000000.0},
+        {"user": "bene, grazie", "ai": "Che bello!", "ts": 1700000060.5},
+    ]
+    sections["user_notes"]["1"] = ["prefers formal Italian", "città has an accent"]
+    sections["user_settings"]["1"] = {"mode": "language_learning", "level": "beginner", "topic": "travel"}
+    sections["flashcards"]["1"] = {"casa": "house", "cane": "dog"}
+    sections["conversation_summaries"]["1"] = {"text": "The user greeted the bot.", "covered": 1}
+    sections["flashcard_log"]["1"] = [
+        {"flashcard": {"casa": "house"}, "user_response": "house", "correct": True, "timestamp": 1700000100.0},
+    ]
+    sections["flashcard_stats"]["1"] = {"casa": {"attempts": 1, "correct": 1, "last_seen": 1700000100.0}}
+    sections["flashcard_schedules"]["1"] = {"casa": {"interval": 1, "ease": 2.5, "reps": 1, "due": 1700086500.0}}
+    sections["user_notes"]["user/2"] = ["only notes"]
+    sections["user_settings"]["user/2"] = {"mode": "normal", "level": "beginner", "topic": "general"}
+    return sections
+
+
+USERS = ["1", "user/2"]
+
+
+def users_of(sections):
+    return {user_id for name in SECTIONS for user_id in sections[name]}
+
+
+def save(storage, sections, users=None):
+    return storage.commit(storage.prepare(sections, users_of(sections) if users is None else users))
+
+
+def load(storage, user_ids):
+    """Records of user_ids as the bot sees them after a restart (an empty section is the same as none)."""
+    sections = storage.load_all()
+    records = {}
+    for user_id in user_ids:
+        if storage.lazy:
+            record = storage.load_user(user_id) or {}
+        else:
+            record = {name: sections[name][user_id] for name in SECTIONS if user_id in sections[name]}
+        records[user_id] = {name: value for name, value in record.items() if value}
+    return records
+
+
+def records_of(sections, user_ids):
+    return {user_id: {name: sections[name][user_id] for name in SECTIONS if sections[name].get(user_id)}
+            for user_id in user_ids}
+
+
+class StorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def assertRoundTrip(self, make_storage):
+        sections = sample_sections()
+        storage = make_storage()
+        storage.load_all()
+        save(storage, sections)
+        storage.close()
+        reopened = make_storage()
+        self.assertEqual(load(reopened, USERS), records_of(sections, USERS))
+        reopened.close()
+        return sections
+
+
+class JsonStorageTest(StorageTestCase):
+    def test_round_trip(self):
+        self.assertRoundTrip(lambda: JsonStorage(self.path("bot_data.json")))
+
+    def test_only_changed_users_are_encoded_again(self):
+        path = self.path("bot_data.json")
+        storage = JsonStorage(path)
+        storage.load_all()
+        sections = sample_sections()
+        save(storage, sections)
+        sections["user_notes"]["user/2"].append("not marked dirty")
+        sections["user_notes"]["1"].append("marked dirty")
+        del sections["user_settings"]["user/2"]
+        save(storage, sections, {"1"})
+        with open(path) as f:
+            document = json.load(f)
+        self.assertEqual(document["user_notes"]["1"], sections["user_notes"]["1"])
+        # Changes to users that were not flushed are not in the document yet
+        self.assertEqual(document["user_notes"]["user/2"], ["only notes"])
+        self.assertIn("user/2", document["user_settings"])
+        save(storage, sections, {"user/2"})
+        self.assertEqual(load(JsonStorage(path), USERS), records_of(sections, USERS))
+
+    def test_journaled_users_are_encoded_at_the_next_snapshot(self):
+        path = self.path("bot_data.json")
+        storage = JsonStorage(path, Journal(path + ".journal"))
+        sections = storage.load_all()
+        sections.update(sample_sections())
+        save(storage, sections)
+        turn = {"user": "a dopo", "ai": "Ciao!", "ts": 1700000200.0}
+        sections["conversation_context"]["1"].append(turn)
+        storage.journal_write([{"op": "append", "section": "conversation_context", "user": "1", "value": turn}])
+        save(storage, sections, set())
+        storage.close()
+        os.remove(path + ".journal")
+        self.assertEqual(load(JsonStorage(path), USERS), records_of(sections, USERS))
+
+
+class LazyStorageTest(StorageTestCase):
+    """Behaviour shared by the backends that load users on demand."""
+
+    def backends(self):
+        return [("sharded", self.path("shards")), ("sqlite", self.path("bot_data.sqlite3"))]
+
+    def test_sharded_round_trip(self):
+        self.assertRoundTrip(lambda: ShardedJsonStorage(self.path("shards")))
+
+    def test_user_ids_and_missing_user(self):
+        for backend, path in self.backends():
+            with self.subTest(backend=backend):
+                storage = open_storage(backend, path)
+                self.assertTrue(storage.is_empty())
+                save(storage, sample_sections())
+                self.assertFalse(storage.is_empty())
+                self.assertEqual(set(storage.user_ids()), set(USERS))
+                self.assertIsNone(storage.load_user("unknown"))
+                storage.close()
+
+    def test_only_dirty_users_are_written(self):
+        for backend, path in self.backends():
+            with self.subTest(backend=backend):
+                storage = open_storage(backend, path)
+                sections = sample_sections()
+                save(storage, sections)
+                sections["user_notes"]["1"].append("new note")
+                sections["user_notes"]["user/2"].append("not dirty")
+                save(storage, sections, {"1"})
+                self.assertEqual(storage.load_user("1")["user_notes"], sections["user_notes"]["1"])
+                self.assertEqual(storage.load_user("user/2")["user_notes"], ["only notes"])
+                storage.close()
+
+    def test_cleared_user_is_removed(self):
+        for backend, path in self.backends():
+            with self.subTest(backend=backend):
+                storage = open_storage(backend, path)
+                sections = sample_sections()
+                save(storage, sections)
+                for section in SECTIONS:
+                    sections[section].pop("1", None)
+                save(storage, sections, {"1"})
+                storage.close()
+                reopened = open_storage(backend, path)
+                self.assertIsNone(reopened.load_user("1"))
+                self.assertEqual(set(reopened.user_ids()), {"user/2"})
+                reopened.close()
+
+
+class SQLiteStorageTest(StorageTestCase):
+    def test_round_trip(self):
+        self.assertRoundTrip(lambda: SQLiteStorage(self.path("bot_data.sqlite3")))
+
+    def test_appends_only_insert_the_new_turns(self):
+        storage = SQLiteStorage(self.path("bot_data.sqlite3"))
+        sections = sample_sections()
+        save(storage, sections, {"1"})
+        sections["conversation_context"]["1"].append({"user": "a dopo", "ai": "Ciao.", "ts": 1700000200.0})
+        payload = storage.prepare(sections, {"1"})
+        start, rows = payload[0][1]["conversation_context"]
+        self.assertEqual((start, len(rows)), (2, 1))
+        storage.commit(payload)
+        storage.close()
+        reopened = SQLiteStorage(self.path("bot_data.sqlite3"))
+        self.assertEqual(reopened.load_user("1")["conversation_context"], sections["conversation_context"]["1"])
+        reopened.close()
+
+    def test_truncated_log_is_rewritten(self):
+        storage = SQLiteStorage(self.path("bot_data.sqlite3"))
+        sections = sample_sections()
+        save(storage, sections, {"1"})
+        # Trimming then appending keeps the length but shifts every position
+        context = sections["conversation_context"]["1"]
+        del context[0]
+        storage.log_truncated("1", "conversation_context")
+        context.append({"user": "nuovo", "ai": "Sì.", "ts": 1700000300.0})
+        save(storage, sections, {"1"})
+        storage.close()
+        reopened = SQLiteStorage(self.path("bot_data.sqlite3"))
+        self.assertEqual(reopened.load_user("1")["conversation_context"], context)
+        reopened.close()
+
+    def test_json_document_is_migrated_into_an_empty_store(self):
+        data_file = self.path("bot_data.json")
+        sections = sample_sections()
+        save(JsonStorage(data_file), sections)
+        storage = create_storage("sqlite", data_file, self.path("bot_data.sqlite3"), self.path("shards"))
+        self.assertEqual(load(storage, USERS), records_of(sections, USERS))
+        storage.close()
+        self.assertFalse(os.path.exists(data_file))
+        self.assertTrue(os.path.exists(data_file + ".migrated"))
+
+    def test_unknown_backend_is_rejected(self):
+        with self.assertRaises(ValueError):
+            open_storage("yaml", self.path("bot_data.yaml"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+from outbound import outbox
+from streaming import EMPTY_ANSWER, MAX_MESSAGE_LENGTH, split_text, stream_reply
+
+
+class FakeMessage:
+    """A sent Telegram message that keeps its text and rejects what Telegram would reject."""
+
+    def __init__(self, chat, text=""):
+        self.chat = chat
+        self.chat_id = 1
+        self.text = text
+
+    def check(self, text):
+        if not text or len(text) > MAX_MESSAGE_LENGTH:
+            raise ValueError(f"Telegram would reject a message of {len(text)} characters")
+
+    async def reply_text(self, text):
+        self.check(text)
+        message = FakeMessage(self.chat, text)
+        self.chat.append(message)
+        return message
+
+    async def edit_text(self, text):
+        self.check(text)
+        self.text = text
+
+    async def delete(self):
+        self.chat.remove(self)
+
+
+async def chunks_of(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+class SplitTextTest(unittest.TestCase):
+    def test_short_text_is_not_split(self):
+        self.assertEqual(split_text("ciao"), ("ciao", ""))
+
+    def test_split_prefers_a_newline_then_a_space(self):
+        self.assertEqual(split_text("uno due\ntre quattro", limit=12), ("uno due", "tre quattro"))
+        self.assertEqual(split_text("uno due tre", limit=9), ("uno due", "tre"))
+
+    def test_text_without_breaks_is_cut_at_the_limit(self):
+        self.assertEqual(split_text("a" * 10, limit=4), ("aaaa", "aaaaaa"))
+
+
+class StreamReplyTest(unittest.IsolatedAsyncioTestCase):
+    async def stream(self, *chunks):
+        chat = []
+        text = await stream_reply(FakeMessage(chat), chunks_of(*chunks))
+        await outbox.drain()
+        return text, [message.text for message in chat]
+
+    async def test_answer_ends_up_in_the_placeholder(self):
+        text, messages = await self.stream("Ciao", ", come stai?")
+        self.assertEqual(text, "Ciao, come stai?")
+        self.assertEqual(messages, ["Ciao, come stai?"])
+
+    async def test_long_answer_continues_in_new_messages(self):
+        words = ["parola"] * 1500
+        text, messages = await self.stream(*(word + " " for word in words))
+        self.assertGreater(len(messages), 1)
+        self.assertEqual(" ".join(messages).split(), words)
+
+    async def test_single_chunk_longer_than_several_messages(self):
+        chunk = "x" * (MAX_MESSAGE_LENGTH * 2 + 100)
+        text, messages = await self.stream("inizio ", chunk)
+        self.assertTrue(all(len(message) <= MAX_MESSAGE_LENGTH for message in messages))
+        self.assertEqual("".join(messages).replace(" ", ""), ("inizio " + chunk).replace(" ", ""))
+
+    async def test_empty_answer_is_replaced(self):
+        text, messages = await self.stream("", "  ")
+        self.assertEqual(messages, [EMPTY_ANSWER])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import workers
+from storage import JsonStorage, SECTIONS
+from workers import check_shard_count, recorded_shard_count, seed_shards, shard_of, shard_path
+
+
+class SeedShardsTest(unittest.TestCase):
+    """seed_shards with the json backend in a temporary directory, without the journal."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.data_file = os.path.join(directory.name, "bot_data.json")
+        settings = {
+            "STORAGE_BACKEND": "json",
+            "DATA_FILE": self.data_file,
+            "JOURNAL_ENABLED": False,
+            "SHARD_COUNT_FILE": os.path.join(directory.name, "bot_data.workers"),
+        }
+        for name, value in settings.items():
+            patch = mock.patch.object(workers, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        print_patch = mock.patch("builtins.print")
+        print_patch.start()
+        self.addCleanup(print_patch.stop)
+
+    def write_users(self, path, user_ids):
+        sections = {name: {} for name in SECTIONS}
+        sections["user_notes"] = {user_id: [f"note of {user_id}"] for user_id in user_ids}
+        storage = JsonStorage(path)
+        storage.commit(storage.prepare(sections, set(user_ids)))
+
+    def test_users_are_split_by_shard_and_the_count_recorded(self):
+        user_ids = [str(number) for number in range(20)]
+        self.write_users(self.data_file, user_ids)
+        seed_shards(3)
+        self.assertTrue(os.path.exists(self.data_file + ".sharded"))
+        self.assertEqual(recorded_shard_count(), 3)
+        for index in range(3):
+            notes = JsonStorage(shard_path(self.data_file, index)).load_all()["user_notes"]
+            self.assertEqual(sorted(notes), sorted(u for u in user_ids if shard_of(u, 3) == index))
+
+    def test_fresh_start_records_the_count(self):
+        self.assertIsNone(recorded_shard_count())
+        seed_shards(2)
+        self.assertEqual(recorded_shard_count(), 2)
+        seed_shards(2)
+
+    def test_different_worker_count_is_refused(self):
+        self.write_users(self.data_file, ["1", "2", "3"])
+        seed_shards(2)
+        for count in (1, 3):
+            with self.assertRaises(ValueError):
+                seed_shards(count)
+        with self.assertRaises(ValueError):
+            check_shard_count(1)
+
+    def test_count_of_an_older_split_is_taken_from_the_worker_files(self):
+        # Split before the count was recorded; worker 2 has only written its journal so far
+        self.write_users(shard_path(self.data_file, 0), ["1"])
+        with open(shard_path(self.data_file, 2) + ".journal", "w"):
+            pass
+        self.assertEqual(recorded_shard_count(), 3)
+        with self.assertRaises(ValueError):
+            seed_shards(2)
+        seed_shards(3)
+        self.assertTrue(os.path.exists(workers.SHARD_COUNT_FILE))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -53,3 +53,28 @@ Your response should strictly follow the guidelines and format above. Do not pro
 
 '''
 
+# Rolling summary of older conversation turns
+summary_template = '''
+Summarize the conversation below between a user and their personal assistant so it can be used as context for future answers.
+
+Existing Summary:
+{summary}
+
+New Conversation Turns:
+{turns}
+
+Guidelines:
+- Merge the new turns into the existing summary.
+- Keep facts, preferences, names and open questions the user mentioned.
+- Write at most {max_words} words in plain text, without headings.
+
+Summary:
+'''
+
+# Follow-up question when the earlier conversation is already in the model's context (incremental mode)
+followup_template = '''
+User Question:
+{question}
+
+Answer:
+'''
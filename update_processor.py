@@ -0,0 +1,50 @@
+# update_processor.py
+import asyncio
+from telegram.ext import BaseUpdateProcessor
+
+
+def ordering_key(update):
+    """Updates with the same key are processed one after the other: the user, else the chat."""
+    if update.effective_user:
+        return f"user:{update.effective_user.id}"
+    if update.effective_chat:
+        return f"chat:{update.effective_chat.id}"
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Process updates of different users concurrently, and the updates of one user in order.
+
+    Keeping each user's updates sequential is what the ConversationHandler states and the
+    flags in context.user_data (e.g. clear_data_confirmation) rely on.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # key -> [lock, number of updates holding or waiting for it]
+        self._locks = {}
+
+    async def process_update(self, update, coroutine):
+        key = ordering_key(update) if hasattr(update, "effective_user") else None
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            # Wait for the user's previous update before taking one of the global slots
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
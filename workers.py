@@ -0,0 +1,455 @@
+# workers.py
+import os
+import re
+import zlib
+import asyncio
+import itertools
+import functools
+import multiprocessing
+from contextlib import contextmanager
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+import metrics
+from journal import Journal
+from storage import open_storage, write_atomic, SECTIONS
+from config import (
+    STORAGE_BACKEND,
+    DATA_FILE,
+    SQLITE_FILE,
+    SHARD_DIR,
+    SNAPSHOT_FILE,
+    JOURNAL_ENABLED,
+    JOURNAL_FILE,
+    RESPONSE_CACHE_FILE,
+    ARCHIVE_DIR,
+    OUTBOUND_GLOBAL_RATE,
+    METRICS_PORT,
+    WORKER_HEARTBEAT_INTERVAL,
+    WORKER_HEARTBEAT_TIMEOUT,
+    WORKER_QUEUE_LIMIT,
+)
+
+# Longest wait before restarting a worker that keeps failing
+MAX_RESTART_DELAY = 60
+# A worker that ran this long is considered healthy again and restarts without delay
+HEALTHY_UPTIME = 60
+# Deliveries of one update to crashing workers before it is dropped (so one bad update cannot crash a worker forever)
+MAX_DELIVERIES = 2
+# Number of workers the data was split between, kept next to the worker files: bot_data.workers
+SHARD_COUNT_FILE = os.path.splitext(DATA_FILE)[0] + ".workers"
+
+
+def shard_of(key, count):
+    """Worker index owning key (a user id, else a chat id, as a string)."""
+    return zlib.crc32(key.encode()) % count
+
+
+def update_shard(update, count):
+    # Same key as PerUserUpdateProcessor: the user, else the chat
+    if update.effective_user:
+        return shard_of(str(update.effective_user.id), count)
+    if update.effective_chat:
+        return shard_of(str(update.effective_chat.id), count)
+    return 0
+
+
+def shard_path(path, index):
+    """Per-worker variant of a data path: bot_data.json -> bot_data.w0.json."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.w{index}{ext}"
+
+
+def worker_environment(index, count):
+    """Settings a worker process overrides: its own data files, its share of the flood limit, its metrics port."""
+    environment = {
+        "WORKER_PROCESSES": "1",
+        "DATA_FILE": shard_path(DATA_FILE, index),
+        # The default journal name follows the data file: bot_data.w0.json.journal
+        "JOURNAL_FILE": (
+            shard_path(DATA_FILE, index) + ".journal" if JOURNAL_FILE == DATA_FILE + ".journal"
+            else shard_path(JOURNAL_FILE, index)
+        ),
+        "SQLITE_FILE": shard_path(SQLITE_FILE, index),
+        "SHARD_DIR": shard_path(SHARD_DIR, index),
+        "SNAPSHOT_FILE": shard_path(SNAPSHOT_FILE, index),
+        # The Bot API limit applies to the bot as a whole
+        "OUTBOUND_GLOBAL_RATE": str(max(OUTBOUND_GLOBAL_RATE / count, 1)),
+        "METRICS_PORT": str(METRICS_PORT + 1 + index) if METRICS_PORT else "0",
+    }
+    if RESPONSE_CACHE_FILE:
+        environment["RESPONSE_CACHE_FILE"] = shard_path(RESPONSE_CACHE_FILE, index)
+    if ARCHIVE_DIR:
+        environment["ARCHIVE_DIR"] = shard_path(ARCHIVE_DIR, index)
+    return environment
+
+
+@contextmanager
+def _environment(values):
+    """Temporarily set environment variables (a spawned process starts with the current environment)."""
+    saved = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _store_path(backend):
+    """Where the configured backend keeps its data."""
+    return {"snapshot": SNAPSHOT_FILE, "sqlite": SQLITE_FILE, "sharded": SHARD_DIR}.get(backend, DATA_FILE)
+
+
+def _has_data(backend, path):
+    # Checked before opening: opening a SQLite file or a shard directory creates it
+    if not os.path.exists(path):
+        return False
+    storage = open_storage(backend, path)
+    try:
+        return not storage.is_empty()
+    finally:
+        storage.close()
+
+
+def _shard_indexes(path):
+    """Worker indexes that have a variant of path (or a file derived from one, like its journal)."""
+    directory, name = os.path.split(os.path.abspath(path))
+    root, ext = os.path.splitext(name)
+    pattern = re.compile(rf"{re.escape(root)}\.w(\d+){re.escape(ext)}(\.|$)")
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return set()
+    return {int(match.group(1)) for match in map(pattern.match, names) if match}
+
+
+def recorded_shard_count():
+    """Workers the data is split between, or None if it was never split.
+
+    Read from SHARD_COUNT_FILE. Data split before that file existed is counted from its
+    worker files (the highest worker index + 1).
+    """
+    try:
+        with open(SHARD_COUNT_FILE) as f:
+            return int(f.read())
+    except FileNotFoundError:
+        pass
+    indexes = _shard_indexes(_store_path(STORAGE_BACKEND)) | _shard_indexes(DATA_FILE)
+    return max(indexes) + 1 if indexes else None
+
+
+def check_shard_count(count):
+    """Refuse to start when the data was split between a different number of workers than count."""
+    recorded = recorded_shard_count()
+    if recorded is not None and recorded != count:
+        raise ValueError(
+            f"The data is split between {recorded} workers, but WORKER_PROCESSES is {count}: users would be "
+            f"routed to workers without their data. Set WORKER_PROCESSES={recorded} (the count is kept in "
+            f"{SHARD_COUNT_FILE}; if that file is missing it is counted from the worker files)."
+        )
+    return recorded
+
+
+def _record_shard_count(count):
+    write_atomic(SHARD_COUNT_FILE, f"{count}\n")
+
+
+def seed_shards(count):
+    """Split the single-process data between the workers, once: each user goes to the worker that owns it.
+
+    The store of the configured backend is split into per-worker stores of the same backend.
+    If that store holds nothing, an existing bot_data.json is split instead, and each worker
+    migrates its part to the backend when it starts. The worker count is recorded, and a
+    later start with a different count is refused (see check_shard_count).
+    """
+    if check_shard_count(count) is not None:
+        if not os.path.exists(SHARD_COUNT_FILE):
+            _record_shard_count(count)
+        return
+    store = _store_path(STORAGE_BACKEND)
+    uses_journal = JOURNAL_ENABLED and STORAGE_BACKEND in ("json", "snapshot")
+    backend, path = STORAGE_BACKEND, store
+    if STORAGE_BACKEND == "json" or not _has_data(STORAGE_BACKEND, store):
+        if not os.path.exists(DATA_FILE):
+            _record_shard_count(count)
+            return
+        backend, path, uses_journal = "json", DATA_FILE, JOURNAL_ENABLED
+    print(f"Splitting {path} between {count} workers...")
+    source = open_storage(backend, path, Journal(JOURNAL_FILE) if uses_journal else None)
+    sections = source.load_all()
+    if source.lazy:
+        for user_id in source.user_ids():
+            for name, value in (source.load_user(user_id) or {}).items():
+                sections[name][user_id] = value
+    source.close()
+    shards = [{name: {} for name in SECTIONS} for _ in range(count)]
+    users = [set() for _ in range(count)]
+    for name, section in sections.items():
+        for user_id, value in section.items():
+            index = shard_of(user_id, count)
+            shards[index][name][user_id] = value
+            users[index].add(user_id)
+    for index in range(count):
+        target = open_storage(backend, shard_path(path, index))
+        target.commit(target.prepare(shards[index], users[index]))
+        target.close()
+    moved = [path, path + "-wal", path + "-shm"]
+    if uses_journal:
+        moved += [JOURNAL_FILE, JOURNAL_FILE + ".old"]
+    for old in moved:
+        if os.path.exists(old):
+            os.replace(old, old + ".sharded")
+    _record_shard_count(count)
+    print(f"Split {sum(map(len, users))} users. The old data was kept as {path}.sharded")
+
+
+class Worker:
+    """Front-process view of one worker process and the updates it has not finished yet."""
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.updates = None         # multiprocessing.Queue of (seq, update dict), None while down
+        self.status = None          # read end of the worker's status pipe
+        self.unfinished = {}        # seq -> [update dict, deliveries], in arrival order
+        self.busy = 0
+        self.last_seen = 0.0
+        self.started = 0.0
+        self.restarts = 0
+        self.failures = 0           # consecutive short-lived runs, for the restart delay
+        self.restart_at = 0.0
+
+
+class WorkerPool:
+    """Runs `target(index, updates, status)` in `count` worker processes and keeps them running.
+
+    Updates are routed by a hash of the user id, so each worker owns a fixed set of users
+    and a user's updates arrive in order. A worker reports every finished update and a
+    heartbeat over its status pipe. One that exits or stops sending heartbeats is
+    restarted (with a growing delay if it keeps failing), and the updates it had not
+    finished are delivered again; the other workers are not affected.
+    """
+
+    def __init__(self, target, count, queue_limit=WORKER_QUEUE_LIMIT,
+                 heartbeat_timeout=WORKER_HEARTBEAT_TIMEOUT, check_interval=WORKER_HEARTBEAT_INTERVAL):
+        self.target = target
+        self.count = count
+        self.queue_limit = queue_limit
+        self.heartbeat_timeout = heartbeat_timeout
+        self.check_interval = check_interval
+        self.workers = [Worker(index) for index in range(count)]
+        self._context = multiprocessing.get_context("spawn")
+        self._seq = itertools.count(1)
+        self._supervisor = None
+        self.stats = {"dispatched": 0, "dropped": 0, "restarts": 0, "redelivered": 0}
+        metrics.gauge_callback("workers_up", lambda: sum(1 for worker in self.workers if worker.process))
+        metrics.gauge_callback("worker_queue_depth", lambda: sum(len(worker.unfinished) for worker in self.workers))
+
+    def start(self):
+        for worker in self.workers:
+            self._spawn(worker)
+        self._supervisor = asyncio.get_running_loop().create_task(self._supervise())
+
+    def dispatch(self, update):
+        """Hand an update to the worker owning its user (delivered later if that worker is down)."""
+        worker = self.workers[update_shard(update, self.count)]
+        if len(worker.unfinished) >= self.queue_limit:
+            self.stats["dropped"] += 1
+            metrics.inc("worker_dropped_updates_total", worker=str(worker.index))
+            print(f"Worker {worker.index} has {len(worker.unfinished)} unfinished updates, dropping update {update.update_id}")
+            return
+        seq = next(self._seq)
+        worker.unfinished[seq] = [update.to_dict(), 1]
+        self.stats["dispatched"] += 1
+        if worker.updates is not None:
+            worker.updates.put((seq, worker.unfinished[seq][0]))
+
+    def _spawn(self, worker):
+        loop = asyncio.get_running_loop()
+        worker.updates = self._context.Queue()
+        worker.status, status_writer = self._context.Pipe(duplex=False)
+        worker.process = self._context.Process(
+            target=self.target, args=(worker.index, worker.updates, status_writer), name=f"worker-{worker.index}"
+        )
+        with _environment(worker_environment(worker.index, self.count)):
+            worker.process.start()
+        # Only the worker writes to its status pipe; closing our copy lets EOF tell us it is gone
+        status_writer.close()
+        worker.started = worker.last_seen = loop.time()
+        loop.add_reader(worker.status.fileno(), self._on_status, worker)
+        # Updates the previous process did not finish, in their original order
+        for seq, entry in list(worker.unfinished.items()):
+            if entry[1] > MAX_DELIVERIES:
+                del worker.unfinished[seq]
+                self.stats["dropped"] += 1
+                print(f"Worker {worker.index}: dropping update {entry[0].get('update_id')} after {MAX_DELIVERIES} failed deliveries")
+                continue
+            worker.updates.put((seq, entry[0]))
+        print(f"Worker {worker.index} started (pid {worker.process.pid})")
+
+    def _on_status(self, worker):
+        try:
+            kind, value = worker.status.recv()
+        except (EOFError, OSError):
+            # The process is gone; the supervisor restarts it
+            self._close_status(worker)
+            return
+        worker.last_seen = asyncio.get_running_loop().time()
+        if kind == "done":
+            worker.unfinished.pop(value, None)
+        elif kind == "heartbeat":
+            worker.busy = value
+
+    def _close_status(self, worker):
+        if worker.status is not None:
+            asyncio.get_running_loop().remove_reader(worker.status.fileno())
+            worker.status.close()
+            worker.status = None
+
+    async def _supervise(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.check_interval)
+            now = loop.time()
+            for worker in self.workers:
+                if worker.process is None:
+                    if now >= worker.restart_at:
+                        self._spawn(worker)
+                    continue
+                if not worker.process.is_alive():
+                    self._retire(worker, f"exit code {worker.process.exitcode}")
+                elif now - worker.last_seen > self.heartbeat_timeout:
+                    worker.process.kill()
+                    await loop.run_in_executor(None, worker.process.join)
+                    self._retire(worker, f"no heartbeat for {now - worker.last_seen:.0f}s")
+
+    def _retire(self, worker, reason):
+        """Forget a dead worker process and schedule its restart."""
+        now = asyncio.get_running_loop().time()
+        self._close_status(worker)
+        # The dead process may have held the queue's lock: never reuse it, and do not wait for its buffer
+        worker.updates.cancel_join_thread()
+        worker.updates.close()
+        worker.updates = None
+        worker.process = None
+        worker.failures = 0 if now - worker.started >= HEALTHY_UPTIME else worker.failures + 1
+        delay = min(2 ** worker.failures - 1, MAX_RESTART_DELAY)
+        worker.restart_at = now + delay
+        worker.restarts += 1
+        for entry in worker.unfinished.values():
+            entry[1] += 1
+        self.stats["restarts"] += 1
+        self.stats["redelivered"] += len(worker.unfinished)
+        metrics.inc("worker_restarts_total", worker=str(worker.index))
+        print(f"Worker {worker.index} stopped ({reason}); restarting in {delay}s, "
+              f"{len(worker.unfinished)} unfinished updates will be delivered again")
+
+    async def stop(self, timeout=30):
+        """Ask every worker to finish its updates and save its data, then wait for it to exit."""
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            self._supervisor = None
+        loop = asyncio.get_running_loop()
+        running = [worker for worker in self.workers if worker.process is not None]
+        for worker in running:
+            worker.updates.put(None)
+        for worker in running:
+            await loop.run_in_executor(None, worker.process.join, timeout)
+            if worker.process.is_alive():
+                print(f"Worker {worker.index} did not stop within {timeout}s, terminating it")
+                worker.process.terminate()
+                await loop.run_in_executor(None, worker.process.join)
+            self._close_status(worker)
+            worker.process = None
+
+    def summary(self):
+        return ", ".join(
+            f"w{worker.index}: {'up' if worker.process else 'down'} busy={worker.busy} "
+            f"unfinished={len(worker.unfinished)} restarts={worker.restarts}"
+            for worker in self.workers
+        )
+
+
+class ShardingUpdateProcessor(BaseUpdateProcessor):
+    """Update processor of the front process: every update goes to the worker owning its user.
+
+    No handler runs in the front process, so the pool is started and stopped with the
+    Application, and the updates are not processed here.
+    """
+
+    def __init__(self, pool):
+        super().__init__(max_concurrent_updates=1)
+        self.pool = pool
+
+    async def process_update(self, update, coroutine):
+        coroutine.close()
+        if isinstance(update, Update):
+            self.pool.dispatch(update)
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        self.pool.start()
+
+    async def shutdown(self):
+        await self.pool.stop()
+        print(f"Workers stopped: {self.pool.stats}")
+
+
+async def _heartbeat(status, updates, in_flight):
+    while True:
+        try:
+            status.send(("heartbeat", len(in_flight)))
+        except OSError:
+            # The front process is gone: finish the current updates and stop
+            updates.put(None)
+            return
+        await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+
+
+async def serve_shard(app, updates, status):
+    """Worker process: handle the updates received from the front process until told to stop.
+
+    Updates are processed as Application would process fetched ones (through its update
+    processor, so one user's updates stay in order), and each one is reported back when
+    it is finished.
+    """
+    loop = asyncio.get_running_loop()
+    in_flight = set()
+
+    def finished(seq, task):
+        in_flight.discard(task)
+        try:
+            status.send(("done", seq))
+        except OSError:
+            pass
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    heartbeat = loop.create_task(_heartbeat(status, updates, in_flight))
+    try:
+        while True:
+            item = await loop.run_in_executor(None, updates.get)
+            if item is None:
+                break
+            seq, data = item
+            update = Update.de_json(data, app.bot)
+            task = loop.create_task(app.update_processor.process_update(update, app.process_update(update)))
+            in_flight.add(task)
+            task.add_done_callback(functools.partial(finished, seq))
+        if in_flight:
+            await asyncio.wait(set(in_flight))
+    finally:
+        heartbeat.cancel()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)